@@ -1,52 +1,206 @@
 from google import genai
 from dotenv import load_dotenv
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import duckdb
+import hashlib
+import json
 import os
+import pyarrow as pa
+import re
+import threading
+
+# etl/profiling.py (queries aggiunge la root del progetto al path)
+from queries import profiling
 
 # Carica le variabili dal file .env
 load_dotenv()
 
+MODEL = "gemini-flash-lite-latest"
 
-def translate_text_to_sql(user_prompt: str) -> str:
-    """
-    Traduce una domanda in linguaggio naturale in SQL (DuckDB),
-    puntando DIRETTAMENTE alle tabelle del Gold Layer (schema gold.*).
-    Compatibile con Streamlit Cloud (DB in read-only).
-    """
-    client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+# Cache delle traduzioni: LRU in memoria + store su disco (DuckDB locale, separato dal
+# warehouse che è read-only e viene sostituito a ogni build)
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", "data/ai_cache.duckdb")
+AI_CACHE_ENTRIES = int(os.getenv("AI_CACHE_ENTRIES", "512"))
+AI_CACHE_TTL_HOURS = float(os.getenv("AI_CACHE_TTL_HOURS", "168"))
+
+# Limiti di esecuzione per le query generate dall'AI (box condiviso tra tutti gli utenti)
+AI_MAX_ROWS = int(os.getenv("AI_MAX_ROWS", "10000"))                       # righe restituite
+AI_MAX_ESTIMATED_ROWS = int(os.getenv("AI_MAX_ESTIMATED_ROWS", "10000000"))  # cardinalità stimata per operatore
+AI_MAX_CROSS_ROWS = int(os.getenv("AI_MAX_CROSS_ROWS", "1000000"))         # prodotto cartesiano stimato
+AI_QUERY_TIMEOUT_S = float(os.getenv("AI_QUERY_TIMEOUT_S", "10"))
+AI_MAX_CONCURRENT = int(os.getenv("AI_MAX_CONCURRENT", "2"))
+AI_BATCH_ROWS = 2048
 
-    context = """
+# AI_SQL_STUB=1: generatore locale deterministico al posto di Gemini (test, CI, sviluppo offline)
+AI_SQL_STUB = os.getenv("AI_SQL_STUB", "0") == "1"
+
+SCHEMA_CONTEXT = """
 Sei un esperto SQL per DuckDB.
 
 Il database usa uno Star Schema nel *Gold Layer* con queste tabelle (NOTA: hanno prefisso gold.):
 
 1) gold.fact_sales
-   colonne: [order_id, customer_id, product_id, price, freight_value, delivery_time_days, order_purchase_timestamp]
+   colonne: [order_id, customer_key, product_key, date_key, price, freight_value, delivery_time_days, order_purchase_timestamp]
 
 2) gold.dim_products
-   colonne: [product_id, product_category_name]
+   colonne: [product_key, product_id, product_category_name]
 
 3) gold.dim_customers
-   colonne: [customer_id, customer_city, customer_state]
+   colonne: [customer_key, customer_id, customer_city, customer_state]
 
 4) gold.dim_time
-   colonne: [order_purchase_timestamp, year, month, day, day_of_week, quarter]
+   colonne: [date_key, order_date, year, month, day, day_of_week, quarter]
 
 REGOLE:
 - Restituisci SOLO la query SQL pura (niente testo extra).
 - Non usare blocchi markdown (niente ```sql).
 - Usa SEMPRE i nomi completi con schema: gold.fact_sales, gold.dim_products, gold.dim_customers, gold.dim_time.
+- Join SOLO sulle chiavi intere: fact_sales.customer_key = dim_customers.customer_key,
+  fact_sales.product_key = dim_products.product_key, fact_sales.date_key = dim_time.date_key.
 - Se l'utente chiede "fatturato", usa: SUM(price) AS total_revenue.
 - Se l'utente chiede "numero ordini", usa: COUNT(DISTINCT order_id) AS total_orders.
 - Non inserire simboli di valuta nella query.
 - Evita DDL/DML: niente CREATE/INSERT/UPDATE/DELETE. Solo SELECT/WITH.
 """
 
-    response = client.models.generate_content(
-        model="gemini-flash-lite-latest",
-        contents=f"{context}\n\nDomanda: {user_prompt}"
-    )
+# Un cambio di contesto o di modello invalida le traduzioni già salvate
+SCHEMA_HASH = hashlib.sha256(f"{MODEL}\n{SCHEMA_CONTEXT}".encode()).hexdigest()[:16]
+
+
+# -----------------------------
+# Generatori (Gemini / stub locale)
+# -----------------------------
+_client = None
+_client_lock = threading.Lock()
+
+def _get_client():
+    # Client creato una volta per processo e riusato (connessioni HTTP incluse)
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        return _client
+
+def _gemini_generate(prompt: str) -> str:
+    response = _get_client().models.generate_content(model=MODEL, contents=prompt)
+    return response.text or ""
+
+def _stub_generate(prompt: str) -> str:
+    # Risposta deterministica senza rete, sulle stesse tabelle Gold del contesto
+    question = prompt.rsplit("Domanda:", 1)[-1].lower()
+    if "stat" in question:
+        return (
+            "SELECT c.customer_state, SUM(f.price) AS total_revenue "
+            "FROM gold.fact_sales f JOIN gold.dim_customers c ON f.customer_key = c.customer_key "
+            "GROUP BY c.customer_state ORDER BY total_revenue DESC"
+        )
+    if "categori" in question:
+        return (
+            "SELECT p.product_category_name, SUM(f.price) AS total_revenue "
+            "FROM gold.fact_sales f JOIN gold.dim_products p ON f.product_key = p.product_key "
+            "GROUP BY p.product_category_name ORDER BY total_revenue DESC"
+        )
+    if "ordini" in question:
+        return "SELECT COUNT(DISTINCT order_id) AS total_orders FROM gold.fact_sales"
+    return "SELECT SUM(price) AS total_revenue FROM gold.fact_sales"
 
-    raw = (response.text or "").strip()
+
+# -----------------------------
+# Cache delle traduzioni
+# -----------------------------
+_memory = OrderedDict()   # chiave -> (sql, created_at)
+_memory_lock = threading.Lock()
+_store = {"con": None, "disabled": False}
+
+def normalize_prompt(user_prompt: str) -> str:
+    # Stessa domanda con maiuscole/spazi/punteggiatura finale diversi -> stessa chiave
+    return re.sub(r"\s+", " ", user_prompt).strip().rstrip("?!. ").casefold()
+
+def _cache_key(user_prompt: str) -> str:
+    return hashlib.sha256(f"{SCHEMA_HASH}\n{normalize_prompt(user_prompt)}".encode()).hexdigest()
+
+def _expired(created_at) -> bool:
+    return created_at < datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=AI_CACHE_TTL_HOURS)
+
+def _open_store():
+    # Store su disco aperto una volta; se non scrivibile (es. FS read-only) resta solo la LRU in memoria
+    if _store["con"] is None and not _store["disabled"]:
+        try:
+            os.makedirs(os.path.dirname(AI_CACHE_PATH) or ".", exist_ok=True)
+            con = duckdb.connect(AI_CACHE_PATH)
+            con.execute("CREATE SCHEMA IF NOT EXISTS tech;")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS tech.tech_sql_translations (
+                    cache_key       VARCHAR PRIMARY KEY,
+                    schema_hash     VARCHAR,
+                    prompt          VARCHAR,
+                    sql             VARCHAR,
+                    created_at      TIMESTAMP
+                );
+            """)
+            # Eviction TTL all'apertura: le righe scadute non vengono più servite comunque
+            con.execute(
+                "DELETE FROM tech.tech_sql_translations WHERE created_at < ?",
+                [datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=AI_CACHE_TTL_HOURS)],
+            )
+            _store["con"] = con
+        except Exception as e:
+            print(f"AI cache: store su disco non disponibile ({e}), solo cache in memoria")
+            _store["disabled"] = True
+    return _store["con"]
+
+def _memory_put(key: str, sql: str, created_at):
+    _memory[key] = (sql, created_at)
+    _memory.move_to_end(key)
+    while len(_memory) > AI_CACHE_ENTRIES:
+        _memory.popitem(last=False)
+
+def _cache_get(key: str):
+    with _memory_lock:
+        hit = _memory.get(key)
+        if hit is not None:
+            if not _expired(hit[1]):
+                _memory.move_to_end(key)
+                return hit[0]
+            del _memory[key]
+
+        con = _open_store()
+        if con is None:
+            return None
+        row = con.execute(
+            "SELECT sql, created_at FROM tech.tech_sql_translations WHERE cache_key = ?", [key]
+        ).fetchone()
+        if row is None or _expired(row[1]):
+            return None
+        _memory_put(key, *row)
+        return row[0]
+
+def _cache_put(key: str, user_prompt: str, sql: str):
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    with _memory_lock:
+        _memory_put(key, sql, created_at)
+        con = _open_store()
+        if con is not None:
+            con.execute("""
+                INSERT OR REPLACE INTO tech.tech_sql_translations
+                    (cache_key, schema_hash, prompt, sql, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, [key, SCHEMA_HASH, normalize_prompt(user_prompt), sql, created_at])
+
+def clear_translation_cache():
+    with _memory_lock:
+        _memory.clear()
+        con = _open_store()
+        if con is not None:
+            con.execute("DELETE FROM tech.tech_sql_translations")
+
+
+# -----------------------------
+# Traduzione
+# -----------------------------
+def _clean_sql(raw: str) -> str:
+    raw = raw.strip()
 
     # pulizia markdown accidentale
     clean = raw.replace("```sql", "").replace("```", "").strip().rstrip(";").strip()
@@ -64,3 +218,124 @@ REGOLE:
         clean = clean[idx:].strip()
 
     return clean
+
+
+def translate_text_to_sql(user_prompt: str, generate=None) -> str:
+    """
+    Traduce una domanda in linguaggio naturale in SQL (DuckDB),
+    puntando DIRETTAMENTE alle tabelle del Gold Layer (schema gold.*).
+    Compatibile con Streamlit Cloud (DB in read-only).
+
+    Le traduzioni sono in cache (domanda normalizzata + hash del contesto schema):
+    una domanda già posta non richiede una nuova chiamata al modello.
+    `generate` (prompt -> testo) sostituisce il modello, es. _stub_generate nei test.
+    """
+    key = _cache_key(user_prompt)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    if generate is None:
+        generate = _stub_generate if AI_SQL_STUB else _gemini_generate
+
+    clean = _clean_sql(generate(f"{SCHEMA_CONTEXT}\n\nDomanda: {user_prompt}"))
+
+    # Solo traduzioni valide in cache: una risposta vuota verrà ritentata
+    if clean:
+        _cache_put(key, user_prompt, clean)
+    return clean
+
+
+# -----------------------------
+# Esecuzione controllata delle query AI
+# - una sola istruzione SELECT/WITH
+# - piano ispezionato con EXPLAIN prima di eseguire: rifiutati prodotti cartesiani
+#   e operatori con cardinalità stimata eccessiva
+# - tetto di righe iniettato nella query, risultati letti a batch Arrow
+# - timeout con con.interrupt() e massimo AI_MAX_CONCURRENT query AI per processo
+# -----------------------------
+class QueryRejected(Exception):
+    """Query AI non eseguita: non ammessa, troppo costosa, interrotta o box occupato."""
+
+_ai_slots = threading.BoundedSemaphore(AI_MAX_CONCURRENT)
+
+def _single_select(con, sql: str) -> str:
+    statements = con.extract_statements(sql)
+    if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+        raise QueryRejected("Sono ammesse solo singole query SELECT/WITH")
+    return statements[0].query.strip()
+
+def _plan_estimate(node: dict, problems: list) -> int:
+    # Cardinalità stimata del nodo; CROSS_PRODUCT non ha stima: prodotto dei figli
+    children = [_plan_estimate(child, problems) for child in node.get("children", [])]
+    name = node.get("name", "")
+    estimate = (node.get("extra_info") or {}).get("Estimated Cardinality")
+
+    if name == "CROSS_PRODUCT":
+        estimate = 1
+        for child in children:
+            estimate *= child
+        if estimate > AI_MAX_CROSS_ROWS:
+            problems.append(f"prodotto cartesiano di ~{estimate:,} righe")
+        return estimate
+
+    if estimate is not None:
+        estimate = int(estimate)
+    elif name == "UNGROUPED_AGGREGATE":
+        # Aggregato senza GROUP BY: una riga, qualunque sia l'input
+        estimate = 1
+    else:
+        estimate = max(children, default=1)
+    if estimate > AI_MAX_ESTIMATED_ROWS:
+        problems.append(f"{name} con ~{estimate:,} righe stimate")
+    return estimate
+
+def check_query_cost(con, sql: str):
+    """Solleva QueryRejected se il piano stimato da EXPLAIN supera i limiti."""
+    plan = con.execute(f"EXPLAIN (FORMAT JSON) {sql}").fetchone()[1]
+    problems = []
+    for node in json.loads(plan):
+        _plan_estimate(node, problems)
+    if problems:
+        raise QueryRejected(f"Query troppo costosa: {'; '.join(problems)}")
+
+def run_ai_query(con, sql_query: str, max_rows: int = AI_MAX_ROWS, timeout_s: float = AI_QUERY_TIMEOUT_S):
+    """
+    Esegue una query generata dall'AI entro i limiti di costo.
+
+    Ritorna (DataFrame, troncato); solleva QueryRejected se la query non è ammessa,
+    è troppo costosa, supera il timeout o il box AI è già occupato.
+    """
+    sql = _single_select(con, sql_query)
+    if not _ai_slots.acquire(timeout=timeout_s):
+        raise QueryRejected("Assistant occupato da altre query, riprova tra poco")
+    try:
+        check_query_cost(con, sql)
+
+        # Una riga oltre il tetto per sapere se il risultato è stato troncato
+        timer = threading.Timer(timeout_s, con.interrupt)
+        timer.start()
+        try:
+            reader = con.execute(f"SELECT * FROM ({sql}) LIMIT {max_rows + 1}").fetch_record_batch(AI_BATCH_ROWS)
+            batches, rows = [], 0
+            for batch in reader:
+                batches.append(batch)
+                rows += batch.num_rows
+                if rows > max_rows:
+                    break
+            table = pa.Table.from_batches(batches, schema=reader.schema)
+            # Profilo salvato solo se DuckDB l'ha completato (reader esaurito prima del break)
+            profiling.record(con, "ai", "run_ai_query")
+        except duckdb.InterruptException:
+            raise QueryRejected(f"Query interrotta dopo {timeout_s:g}s")
+        finally:
+            timer.cancel()
+    finally:
+        _ai_slots.release()
+
+    truncated = table.num_rows > max_rows
+    # Colonne ENUM (dizionari Arrow) come stringhe, non category pandas
+    df = table.slice(0, max_rows).to_pandas()
+    for column in df.select_dtypes("category"):
+        df[column] = df[column].astype(df[column].cat.categories.dtype)
+    return df, truncated
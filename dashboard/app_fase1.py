@@ -2,16 +2,12 @@ import streamlit as st
 import pandas as pd
 import os
 import plotly.express as px
-from ai_utils import translate_text_to_sql
+from ai_utils import QueryRejected, run_ai_query, translate_text_to_sql
 from queries import (
-    get_connection,
-    load_kpis,
-    load_category_data,
-    load_state_data,
-    load_shipping_time_data,
-    load_avg_shipping_data,
-    load_trend_data,
-    load_weekly_seasonality
+    BACKEND,
+    LAKE_DIR,
+    WarehousePool,
+    load_dashboard
 )
 
 # Valuta standard (unica fonte di verità per la formattazione monetaria)
@@ -31,7 +27,14 @@ st.markdown("Analisi professionale delle vendite e della logistica basata sul da
 # ------------------------------------------------------------------
 
 db_path = os.getenv("DB_PATH", "data/warehouse.duckdb")
-con = get_connection(db_path)
+
+# Un handle read-only per processo (condiviso tra sessioni e rerun), un cursore per thread
+@st.cache_resource
+def get_warehouse(path):
+    return WarehousePool(path)
+
+# DASHBOARD_BACKEND=lake: Gold letto dai Parquet di LAKE_DIR invece che dal file DuckDB
+con = get_warehouse(LAKE_DIR if BACKEND == "lake" else db_path).cursor()
 
 # ------------------------------------------------------------------
 # --- MAPPE DI DECODIFICA ---
@@ -130,10 +133,8 @@ nomi_selezionati = st.sidebar.multiselect("Seleziona lo Stato", sorted(mappa_sta
 mappa_inversa = {v: k for k, v in mappa_stati.items()}
 sigle_selezionate = [mappa_inversa[n] for n in nomi_selezionati]
 
-query_where = ""
-if sigle_selezionate:
-    stati_str = "', '".join(sigle_selezionate)
-    query_where = f"WHERE c.customer_state IN ('{stati_str}')"
+# Tutti i widget in un colpo: base filtrata condivisa + query in parallelo (e in cache)
+risultati = load_dashboard(con, states=sigle_selezionate)
 
 # ------------------------------------------------------------------
 # --- KPI PRINCIPALI ---
@@ -142,7 +143,7 @@ if sigle_selezionate:
 st.subheader("Key Performance Indicators")
 
 # ATTENZIONE: richiede queries.py aggiornato a 5 valori (vedi nota in fondo)
-total_sales, avg_delivery, total_orders, avg_freight, avg_order_value = load_kpis(con, query_where)
+total_sales, avg_delivery, total_orders, avg_freight, avg_order_value = risultati["kpis"]
 
 c1, c2, c3, c4, c5 = st.columns(5)
 c1.metric("Fatturato", f"{CURRENCY_SYMBOL} {total_sales:,.2f}")
@@ -161,7 +162,7 @@ col_cat, col_ordini = st.columns(2)
 
 with col_cat:
     st.subheader("Top 10 Categorie")
-    df_cat = load_category_data(con, query_where)
+    df_cat = risultati["category"]
     if not df_cat.empty:
         df_cat['Categoria'] = df_cat['Categoria'].map(mappa_categorie).fillna(df_cat['Categoria'])
         st.vega_lite_chart(df_cat, {
@@ -189,7 +190,7 @@ with col_cat:
 
 with col_ordini:
     st.subheader("Distribuzione Geografica Ordini")
-    df_state = load_state_data(con, query_where)
+    df_state = risultati["state"]
     if not df_state.empty:
         df_plot = df_state.copy()
         df_plot['Nome Stato'] = df_plot['Stato'].map(mappa_stati)
@@ -213,7 +214,7 @@ col_shipping_time, col_shipping_price = st.columns(2)
 
 with col_shipping_time:
     st.subheader("Tempi di consegna per Stato")
-    df_shipping_time = load_shipping_time_data(con, query_where)
+    df_shipping_time = risultati["shipping_time"]
     if not df_shipping_time.empty:
         df_shipping_time['Stato Esteso'] = df_shipping_time['Stato'].map(mappa_stati)
         # queries.py restituisce 'Tempi_Consegna'
@@ -223,7 +224,7 @@ with col_shipping_time:
 
 with col_shipping_price:
     st.subheader("Costo Medio Spedizione per Stato")
-    df_shipping = load_avg_shipping_data(con, query_where)
+    df_shipping = risultati["avg_shipping"]
     if not df_shipping.empty:
         df_shipping['Stato Esteso'] = df_shipping['Stato'].map(mappa_stati)
         # queries.py restituisce 'Costo_Spedizione'
@@ -239,7 +240,7 @@ col_trend, col_weekly = st.columns(2)
 
 with col_trend:
     st.subheader("Trend Temporale Fatturato")
-    df_trend = load_trend_data(con, query_where)
+    df_trend = risultati["trend"]
     if not df_trend.empty:
         draw_static_line(df_trend, 'Periodo', 'Fatturato', color="#4682B4")
     else:
@@ -247,7 +248,7 @@ with col_trend:
 
 with col_weekly:
     st.subheader("Stagionalità Settimanale")
-    df_weekly = load_weekly_seasonality(con, query_where)
+    df_weekly = risultati["weekly"]
     if not df_weekly.empty:
         ordine_giorni = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
         # queries.py restituisce la colonna 'day_of_week'
@@ -272,7 +273,10 @@ if user_query:
     st.code(sql_query, language="sql")
 
     try:
-        df_ai = con.execute(sql_query).df()
+        # EXPLAIN + tetto righe + timeout: una query costosa non blocca gli altri utenti
+        df_ai, troncato = run_ai_query(con, sql_query)
+        if troncato:
+            st.info(f"Risultato limitato alle prime {len(df_ai):,} righe.")
 
         # Mappatura valori (Stati e Categorie)
         if 'customer_state' in df_ai.columns:
@@ -365,7 +369,7 @@ if user_query:
         else:
             st.warning("La query non ha prodotto risultati.")
 
+    except QueryRejected as e:
+        st.warning(f"Query non eseguita: {e}")
     except Exception as e:
         st.error(f"Errore nell'esecuzione della query: {e}")
-
-con.close()
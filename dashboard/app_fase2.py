@@ -1,19 +1,10 @@
 import streamlit as st
 import pandas as pd
-import duckdb
 import os
 import plotly.express as px
 
-from ai_utils import translate_text_to_sql
-from queries import (
-    load_kpis,
-    load_category_data,
-    load_state_data,
-    load_shipping_time_data,
-    load_avg_shipping_data,
-    load_trend_data,
-    load_weekly_seasonality
-)
+from ai_utils import QueryRejected, run_ai_query, translate_text_to_sql
+from queries import BACKEND, LAKE_DIR, WarehousePool, load_dashboard
 
 CURRENCY_SYMBOL = "R$"
 
@@ -31,15 +22,23 @@ st.markdown("Dashboard basata sul **Gold Layer nel DuckDB** (pipeline incrementa
 
 DB_PATH = os.getenv("DB_PATH", "data/warehouse.duckdb")
 
-if not os.path.exists(DB_PATH):
-    st.error("**Errore Critico: Database DuckDB mancante**")
-    st.write(f"File non trovato: `{DB_PATH}`")
+# DASHBOARD_BACKEND=lake: Gold letto dai Parquet di LAKE_DIR (export_lake) invece che dal file DuckDB
+SOURCE = LAKE_DIR if BACKEND == "lake" else DB_PATH
+
+if not os.path.exists(SOURCE):
+    st.error("**Errore Critico: Database DuckDB mancante**" if BACKEND != "lake" else "**Errore Critico: Lake Parquet mancante**")
+    st.write(f"File non trovato: `{SOURCE}`")
     st.info("Esegui la pipeline Phase 2 (etl/flows/main_flows_fase2.py) per creare/aggiornare il Gold Layer nel DB.")
     st.stop()
 
+# Un handle read-only per processo (condiviso tra sessioni e rerun), un cursore per thread
+@st.cache_resource
+def get_warehouse(path):
+    return WarehousePool(path)
+
 try:
     # Read-only: compatibile anche con Streamlit Cloud
-    con = duckdb.connect(DB_PATH, read_only=True)
+    con = get_warehouse(SOURCE).cursor()
 except Exception as e:
     st.error("**Errore Critico: Impossibile aprire il database DuckDB**")
     st.write(str(e))
@@ -47,6 +46,7 @@ except Exception as e:
 
 required_gold_tables = [
     ("gold", "fact_sales"),
+    ("gold", "fact_orders"),
     ("gold", "dim_products"),
     ("gold", "dim_customers"),
     ("gold", "dim_time"),
@@ -71,7 +71,6 @@ if missing:
     st.write("Mancano queste tabelle:")
     st.write(", ".join(missing))
     st.info("Esegui la pipeline Phase 2 fino al Gold (etl/flows/main_flows_fase2.py).")
-    con.close()
     st.stop()
 
 # ------------------------------------------------------------------
@@ -160,17 +159,15 @@ nomi_selezionati = st.sidebar.multiselect("Seleziona lo Stato", sorted(mappa_sta
 mappa_inversa = {v: k for k, v in mappa_stati.items()}
 sigle_selezionate = [mappa_inversa[n] for n in nomi_selezionati]
 
-query_where = ""
-if sigle_selezionate:
-    stati_str = "', '".join(sigle_selezionate)
-    query_where = f"WHERE c.customer_state IN ('{stati_str}')"
+# Tutti i widget in un colpo: base filtrata condivisa + query in parallelo (e in cache)
+risultati = load_dashboard(con, states=sigle_selezionate)
 
 # ------------------------------------------------------------------
 # --- KPI PRINCIPALI ---
 # ------------------------------------------------------------------
 
 st.subheader("Key Performance Indicators")
-total_sales, avg_delivery, total_orders, avg_freight, avg_order_value = load_kpis(con, query_where)
+total_sales, avg_delivery, total_orders, avg_freight, avg_order_value = risultati["kpis"]
 
 c1, c2, c3, c4, c5 = st.columns(5)
 c1.metric("Fatturato", f"{CURRENCY_SYMBOL} {total_sales:,.2f}")
@@ -189,7 +186,7 @@ col_cat, col_ordini = st.columns(2)
 
 with col_cat:
     st.subheader("Top 10 Categorie")
-    df_cat = load_category_data(con, query_where)
+    df_cat = risultati["category"]
     if not df_cat.empty:
         df_cat['Categoria'] = df_cat['Categoria'].map(mappa_categorie).fillna(df_cat['Categoria'])
         st.vega_lite_chart(df_cat, {
@@ -211,7 +208,7 @@ with col_cat:
 
 with col_ordini:
     st.subheader("Distribuzione Geografica Ordini")
-    df_state = load_state_data(con, query_where)
+    df_state = risultati["state"]
     if not df_state.empty:
         df_plot = df_state.copy()
         df_plot['Nome Stato'] = df_plot['Stato'].map(mappa_stati)
@@ -238,7 +235,7 @@ col_shipping_time, col_shipping_price = st.columns(2)
 
 with col_shipping_time:
     st.subheader("Tempi di consegna per Stato")
-    df_shipping_time = load_shipping_time_data(con, query_where)
+    df_shipping_time = risultati["shipping_time"]
     if not df_shipping_time.empty:
         df_shipping_time['Stato Esteso'] = df_shipping_time['Stato'].map(mappa_stati)
         draw_static_bar(df_shipping_time, 'Stato Esteso', 'Tempi_Consegna', color="#FF7F50", orient="h", label_y="Tempi di consegna (gg)")
@@ -247,7 +244,7 @@ with col_shipping_time:
 
 with col_shipping_price:
     st.subheader("Costo Medio Spedizione per Stato")
-    df_shipping = load_avg_shipping_data(con, query_where)
+    df_shipping = risultati["avg_shipping"]
     if not df_shipping.empty:
         df_shipping['Stato Esteso'] = df_shipping['Stato'].map(mappa_stati)
         draw_static_bar(df_shipping, 'Stato Esteso', 'Costo_Spedizione', color="#9370DB", orient="h", label_y="Costi di spedizione")
@@ -262,7 +259,7 @@ col_trend, col_weekly = st.columns(2)
 
 with col_trend:
     st.subheader("Trend Temporale Fatturato")
-    df_trend = load_trend_data(con, query_where)
+    df_trend = risultati["trend"]
     if not df_trend.empty:
         fig_trend = px.line(df_trend, x='Periodo', y='Fatturato', markers=True)
         fig_trend.update_xaxes(type='category')
@@ -272,7 +269,7 @@ with col_trend:
 
 with col_weekly:
     st.subheader("Stagionalità Settimanale")
-    df_weekly = load_weekly_seasonality(con, query_where)
+    df_weekly = risultati["weekly"]
     if not df_weekly.empty:
         ordine_giorni = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
         df_weekly['day_of_week'] = pd.Categorical(df_weekly['day_of_week'], categories=ordine_giorni, ordered=True)
@@ -296,7 +293,10 @@ if user_query:
     st.code(sql_query, language="sql")
 
     try:
-        df_ai = con.execute(sql_query).df()
+        # EXPLAIN + tetto righe + timeout: una query costosa non blocca gli altri utenti
+        df_ai, troncato = run_ai_query(con, sql_query)
+        if troncato:
+            st.info(f"Risultato limitato alle prime {len(df_ai):,} righe.")
 
         if 'customer_state' in df_ai.columns:
             df_ai['customer_state'] = df_ai['customer_state'].map(mappa_stati).fillna(df_ai['customer_state'])
@@ -361,7 +361,7 @@ if user_query:
         else:
             st.warning("La query non ha prodotto risultati.")
 
+    except QueryRejected as e:
+        st.warning(f"Query non eseguita: {e}")
     except Exception as e:
         st.error(f"Errore nell'esecuzione della query: {e}")
-
-con.close()
@@ -0,0 +1,115 @@
+import streamlit as st
+import pandas as pd
+import os
+import plotly.express as px
+
+from queries import WarehousePool, load_run_steps, load_run_summary, load_slowest_statements
+
+# ------------------------------------------------------------------
+# --- CONFIGURAZIONE PAGINA ---
+# ------------------------------------------------------------------
+
+st.set_page_config(page_title="Olist - Metriche Pipeline", layout="wide")
+st.title("Metriche della Pipeline")
+st.markdown("Tempi, throughput e memoria per run e per step da **tech.tech_run_metrics** (file DuckDB).")
+
+# ------------------------------------------------------------------
+# --- CONNESSIONE DATABASE ---
+# ------------------------------------------------------------------
+
+# Le metriche stanno solo nel file DuckDB, anche con DASHBOARD_BACKEND=lake
+DB_PATH = os.getenv("DB_PATH", "data/warehouse.duckdb")
+
+if not os.path.exists(DB_PATH):
+    st.error("**Errore Critico: Database DuckDB mancante**")
+    st.write(f"File non trovato: `{DB_PATH}`")
+    st.stop()
+
+@st.cache_resource
+def get_metrics_warehouse(path):
+    return WarehousePool(path, backend="duckdb")
+
+try:
+    con = get_metrics_warehouse(DB_PATH).cursor()
+except Exception as e:
+    st.error("**Errore Critico: Impossibile aprire il database DuckDB**")
+    st.write(str(e))
+    st.stop()
+
+exists = con.execute("""
+    SELECT 1
+    FROM information_schema.tables
+    WHERE table_schema = 'tech' AND table_name = 'tech_run_metrics'
+""").fetchone()
+if not exists:
+    st.info("Nessuna metrica registrata: esegui la pipeline (Phase 1 o Phase 2) per popolare tech.tech_run_metrics.")
+    st.stop()
+
+# ------------------------------------------------------------------
+# --- RIEPILOGO RUN ---
+# ------------------------------------------------------------------
+
+n_runs = st.sidebar.slider("Ultimi run", min_value=5, max_value=100, value=30, step=5)
+
+df_runs = load_run_summary(con, runs=n_runs)
+if df_runs.empty:
+    st.info("Nessun run registrato.")
+    st.stop()
+
+ultimo = df_runs.iloc[0]
+precedenti = df_runs.iloc[1:]
+# Confronto con la mediana dei run precedenti: un rallentamento si vede subito nel delta
+delta = None if precedenti.empty else f"{ultimo['duration_s'] - precedenti['duration_s'].median():+.1f} s vs mediana"
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Durata ultimo run", f"{ultimo['duration_s']:.1f} s", delta, delta_color="inverse")
+col2.metric("Righe scritte", f"{int(ultimo['rows_out'] or 0):,}")
+col3.metric("RSS di picco", f"{ultimo['peak_rss_mb']:.0f} MB" if pd.notna(ultimo['peak_rss_mb']) else "n/d")
+col4.metric("Step falliti", int(ultimo['failed_steps']))
+
+st.subheader("Durata dei run")
+fig_runs = px.line(df_runs.sort_values("started_at"), x="started_at", y="duration_s", markers=True,
+                   labels={"started_at": "Inizio run (UTC)", "duration_s": "Durata (s)"})
+st.plotly_chart(fig_runs, width='stretch')
+
+# ------------------------------------------------------------------
+# --- TREND PER STEP ---
+# ------------------------------------------------------------------
+
+df_steps = load_run_steps(con, runs=n_runs)
+layers = sorted(df_steps["layer"].unique())
+layers_selezionati = st.sidebar.multiselect("Layer", layers, default=layers)
+df_steps = df_steps[df_steps["layer"].isin(layers_selezionati)]
+
+c1, c2 = st.columns(2)
+
+with c1:
+    st.subheader("Tempo per step")
+    fig_wall = px.line(df_steps, x="run_started_at", y="wall_s", color="step", markers=True,
+                       labels={"run_started_at": "Inizio run (UTC)", "wall_s": "Tempo (s)", "step": "Step"})
+    st.plotly_chart(fig_wall, width='stretch')
+
+with c2:
+    st.subheader("Throughput per step")
+    fig_rps = px.line(df_steps.dropna(subset=["rows_per_s"]), x="run_started_at", y="rows_per_s", color="step", markers=True,
+                      labels={"run_started_at": "Inizio run (UTC)", "rows_per_s": "Righe/s", "step": "Step"})
+    st.plotly_chart(fig_rps, width='stretch')
+
+st.subheader("Memoria per run")
+df_mem = df_runs.sort_values("started_at").melt(
+    id_vars="started_at", value_vars=["peak_rss_mb", "duckdb_mem_mb"], var_name="misura", value_name="MB"
+)
+fig_mem = px.line(df_mem, x="started_at", y="MB", color="misura", markers=True,
+                  labels={"started_at": "Inizio run (UTC)", "misura": "Misura"})
+st.plotly_chart(fig_mem, width='stretch')
+
+# ------------------------------------------------------------------
+# --- STATEMENT PIÙ LENTI ---
+# ------------------------------------------------------------------
+
+st.subheader("Statement SQL più lenti")
+run_scelto = st.selectbox(
+    "Run", df_runs["run_id"],
+    format_func=lambda r: f"{df_runs.loc[df_runs['run_id'] == r, 'started_at'].iloc[0]:%Y-%m-%d %H:%M} ({r[:8]})",
+)
+st.dataframe(load_slowest_statements(con, run_scelto), width='stretch', hide_index=True)
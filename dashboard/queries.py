@@ -1,9 +1,434 @@
 import duckdb
+import json
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+# Backend delle query: file DuckDB (DB_PATH) oppure lake Parquet del Gold (LAKE_DIR),
+# es. repliche della dashboard su storage condiviso read-only
+BACKEND = os.getenv("DASHBOARD_BACKEND", "duckdb")   # duckdb / lake
+LAKE_DIR = os.getenv("LAKE_DIR", "data/lake")
+LAKE_MANIFEST = "_manifest.json"
+
+# Profiling JSON opzionale (DUCKDB_PROFILING=1) condiviso con l'ETL: etl/profiling.py nella root del progetto
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from etl import profiling
 
 # Funzioni per eseguire query sul data warehouse DuckDB
 def get_connection(db_path):
     return duckdb.connect(db_path, read_only=True)
 
+# -------------------------------------------------------------------
+# BACKEND LAKE
+# - DuckDB in memoria con una view gold.<tabella> per ogni tabella del manifest
+#   scritto da export_lake: fatti su read_parquet(hive_partitioning), il resto su file unico
+# - tech.tech_gold_versions espone la versione Gold del manifest (chiave della cache)
+# - stesse query del backend DuckDB: i filtri su data/stato diventano pruning di
+#   partizioni year=/month= e di row group (statistiche min/max)
+# -------------------------------------------------------------------
+# Origine di ogni connessione/cursore (DuckDBPyConnection non accetta attributi):
+# (backend, file DuckDB o directory del lake). Il backend decide se aggiungere i filtri
+# sulle partizioni year/month, che esistono solo nelle view del lake; l'origine intera
+# separa le entry della cache dei risultati e il catalogo dei rollup
+_origins = weakref.WeakKeyDictionary()
+
+def _origin(con):
+    origin = _origins.get(con)
+    if origin is None:
+        # Connessione aperta fuori dal pool: file DuckDB del catalogo corrente
+        path = con.execute("SELECT path FROM duckdb_databases() WHERE database_name = current_database()").fetchone()[0]
+        origin = _origins[con] = ("duckdb", path)
+    return origin
+
+def _backend_of(con):
+    return _origin(con)[0]
+
+def _child_cursor(con):
+    # Cursore che eredita l'origine della connessione
+    cur = con.cursor()
+    _origins[cur] = _origin(con)
+    profiling.enable(cur)
+    return cur
+
+def _sql_path(path):
+    return "'" + path.replace("'", "''") + "'"
+
+def open_lake(lake_dir):
+    gold_dir = os.path.join(lake_dir, "gold")
+    with open(os.path.join(gold_dir, LAKE_MANIFEST)) as f:
+        manifest = json.load(f)
+
+    con = duckdb.connect()
+    con.execute("CREATE SCHEMA gold")
+    con.execute("CREATE SCHEMA tech")
+    for table in manifest["tables"]:
+        partitioned = os.path.join(gold_dir, table)
+        if os.path.isdir(partitioned):
+            source = f"read_parquet({_sql_path(os.path.join(partitioned, '**', '*.parquet'))}, hive_partitioning = true)"
+        else:
+            source = f"read_parquet({_sql_path(os.path.join(gold_dir, f'{table}.parquet'))})"
+        con.execute(f"CREATE VIEW gold.{table} AS SELECT * FROM {source}")
+
+    version = manifest.get("version")
+    con.execute(f"CREATE VIEW tech.tech_gold_versions AS SELECT CAST({int(version) if version is not None else 'NULL'} AS BIGINT) AS version")
+    _origins[con] = ("lake", lake_dir)
+    return con
+
+# -------------------------------------------------------------------
+# POOL DI CONNESSIONI (un handle read-only per processo, un cursore per thread)
+# - le app lo istanziano una volta con st.cache_resource: i rerun Streamlit non
+#   riaprono il file né ricaricano il catalogo, ottengono solo un cursore
+# - ogni thread (sessione/rerun Streamlit) ha il proprio cursore sull'handle condiviso
+# - se il file del warehouse viene sostituito (nuovo artifact / nuovo build) l'handle
+#   viene chiuso e riaperto e la cache dei risultati svuotata
+# - backend lake: si osserva il manifest Gold (riscritto a ogni export)
+# -------------------------------------------------------------------
+class WarehousePool:
+    def __init__(self, source, backend=BACKEND):
+        self.source = source   # file .duckdb o directory del lake
+        self.backend = backend
+        self._watched = os.path.join(source, "gold", LAKE_MANIFEST) if backend == "lake" else source
+        self._con = None
+        self._signature = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _file_signature(self):
+        # Inode + mtime + dimensione: cambia quando il file viene sostituito o riscritto
+        stat = os.stat(self._watched)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _reopen_if_replaced(self):
+        signature = self._file_signature()
+        if self._con is not None and signature == self._signature:
+            return
+        if self._con is not None:
+            # DuckDB riusa l'istanza aperta sullo stesso path: va chiusa per leggere il nuovo file
+            self._con.close()
+            clear_query_cache()
+            print(f"Dashboard: warehouse {self.source} sostituito, connessione riaperta")
+        self._con = open_lake(self.source) if self.backend == "lake" else duckdb.connect(self.source, read_only=True)
+        _origins[self._con] = (self.backend, self.source)
+        self._signature = signature
+        self._generation += 1
+
+    def cursor(self):
+        local = self._local
+        with self._lock:
+            self._reopen_if_replaced()
+            if getattr(local, "generation", None) != self._generation:
+                local.cursor = _child_cursor(self._con)
+                local.generation = self._generation
+            return local.cursor
+
+    def close(self):
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+
+# -------------------------------------------------------------------
+# CACHE DEI RISULTATI (condivisa tra sessioni/utenti dello stesso processo)
+# - chiave: (funzione, filtro, origine, versione Gold); l'origine (backend + file o
+#   directory del lake) separa sorgenti diverse con lo stesso numero di versione
+# - la versione è pubblicata da build_olist_star_schema in tech.tech_gold_versions:
+#   un nuovo build Gold svuota automaticamente le entry della sua origine
+# - eviction LRU per numero di entry e per dimensione totale (MB)
+# -------------------------------------------------------------------
+CACHE_MAX_ENTRIES = int(os.getenv("DASHBOARD_CACHE_ENTRIES", "256"))
+CACHE_MAX_MB = float(os.getenv("DASHBOARD_CACHE_MB", "256"))
+
+_cache = OrderedDict()   # key -> (risultato, bytes)
+_cache_state = {"bytes": 0, "hits": 0, "misses": 0}
+_cache_versions = {}     # origine -> versione Gold delle entry in cache
+_cache_lock = threading.Lock()
+
+def load_gold_version(con):
+    # None se la pipeline non ha ancora pubblicato versioni (DB precedente): cache disattivata
+    try:
+        return con.execute("SELECT MAX(version) FROM tech.tech_gold_versions").fetchone()[0]
+    except duckdb.CatalogException:
+        return None
+
+def _result_size(result):
+    if isinstance(result, dict):
+        return sum(_result_size(v) for v in result.values())
+    if hasattr(result, "memory_usage"):
+        return int(result.memory_usage(index=True, deep=True).sum())
+    return 1024
+
+def _copy(result):
+    # Le pagine modificano i DataFrame (map delle etichette): mai restituire l'oggetto in cache
+    if isinstance(result, dict):
+        return {k: _copy(v) for k, v in result.items()}
+    return result.copy() if hasattr(result, "copy") else result
+
+def _cache_reset():
+    _cache.clear()
+    _cache_versions.clear()
+    _cache_state["bytes"] = 0
+
+def _cache_drop_origin(origin, version):
+    # Nuova versione Gold di una sorgente: via solo le sue entry
+    for key in [k for k in _cache if k[2] == origin]:
+        _cache_state["bytes"] -= _cache.pop(key)[1]
+    _cache_versions[origin] = version
+
+def _cache_get(key, origin, version):
+    with _cache_lock:
+        if version != _cache_versions.get(origin):
+            _cache_drop_origin(origin, version)
+        entry = _cache.get(key)
+        if entry is None:
+            _cache_state["misses"] += 1
+            return None
+        _cache.move_to_end(key)
+        _cache_state["hits"] += 1
+        return _copy(entry[0])
+
+def _cache_put(key, origin, version, result):
+    size = _result_size(result)
+    with _cache_lock:
+        if version != _cache_versions.get(origin):
+            return
+        if key in _cache:
+            _cache_state["bytes"] -= _cache.pop(key)[1]
+        _cache[key] = (_copy(result), size)
+        _cache_state["bytes"] += size
+
+        max_bytes = CACHE_MAX_MB * 1024 * 1024
+        while _cache and (len(_cache) > CACHE_MAX_ENTRIES or _cache_state["bytes"] > max_bytes):
+            _, (_, evicted) = _cache.popitem(last=False)
+            _cache_state["bytes"] -= evicted
+
+def _freeze(filters):
+    # Filtri strutturati -> chiave hashable: liste come tuple ordinate, filtri vuoti ignorati
+    return tuple(sorted(
+        (k, tuple(sorted(v)) if isinstance(v, (list, tuple, set)) else v)
+        for k, v in filters.items()
+        if v is not None and v != [] and v != ()
+    ))
+
+def cached_query(func):
+    @wraps(func)
+    def wrapper(con, **filters):
+        version = load_gold_version(con)
+        if version is None:
+            return func(con, **filters)
+
+        origin = _origin(con)
+        key = (func.__name__, _freeze(filters), origin, version)
+        hit = _cache_get(key, origin, version)
+        if hit is not None:
+            return hit
+
+        result = func(con, **filters)
+        _cache_put(key, origin, version, result)
+        return result
+    return wrapper
+
+def clear_query_cache():
+    with _cache_lock:
+        _cache_reset()
+    # Il catalogo dei rollup è legato al file aperto, non solo alla versione Gold
+    with _rollup_lock:
+        _rollup_catalog.clear()
+
+def query_cache_info():
+    with _cache_lock:
+        return {"entries": len(_cache), "versions": dict(_cache_versions), **_cache_state}
+
+# -------------------------------------------------------------------
+# FILTRI STRUTTURATI (parametri bound, mai interpolati nel testo SQL)
+# - states: sigle degli Stati (customer_state)
+# - date_from / date_to: intervallo di date d'acquisto, estremi inclusi
+# - categories: categorie prodotto (product_category_name)
+# Ogni combinazione di filtri attivi ha un testo SQL stabile: cambiano solo i valori
+# bound, quindi statement e risultati sono riutilizzabili.
+# -------------------------------------------------------------------
+def _month_bounds(date_from, date_to):
+    # Intervallo allineato ai mesi -> ('YYYY-MM' | None, 'YYYY-MM' | None), altrimenti None
+    if date_from is not None and date_from.day != 1:
+        return None
+    if date_to is not None and (date_to + timedelta(days=1)).day != 1:
+        return None
+    return (
+        date_from.strftime("%Y-%m") if date_from is not None else None,
+        date_to.strftime("%Y-%m") if date_to is not None else None,
+    )
+
+def _partition_conditions(date_from, date_to):
+    # Backend lake: predicati semplici sulle colonne hive year/month, gli unici che
+    # DuckDB usa per scartare i file prima della lettura
+    conditions, params = [], []
+    if date_from is not None:
+        conditions += ["year >= ?", "(year > ? OR month >= ?)"]
+        params += [date_from.year, date_from.year, date_from.month]
+    if date_to is not None:
+        conditions += ["year <= ?", "(year < ? OR month <= ?)"]
+        params += [date_to.year, date_to.year, date_to.month]
+    return conditions, params
+
+def _filter_conditions(states=None, categories=None, months=None, dates=None):
+    conditions, params = [], []
+    if states:
+        conditions.append("customer_state IN (SELECT UNNEST(?::VARCHAR[]))")
+        params.append(list(states))
+    if categories:
+        conditions.append(f"{CATEGORY_DIM} IN (SELECT UNNEST(?::VARCHAR[]))")
+        params.append(list(categories))
+    for column, (low, high) in (("year_month", months or (None, None)), ("order_date", dates or (None, None))):
+        if low is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append(f"{column} <= ?")
+            params.append(high)
+    return conditions, params
+
+def _where(conditions):
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+# -------------------------------------------------------------------
+# ROUTER SUI ROLLUP GOLD
+# - build_olist_star_schema materializza rollup a grain (stato, categoria, mese, giorno)
+#   e li descrive in gold.rollup_catalog (dimensioni + numero righe)
+# - ogni widget dichiara le dimensioni di raggruppamento; i filtri aggiungono le proprie
+#   (un intervallo di date allineato ai mesi diventa un filtro su year_month):
+#   il router sceglie il rollup più piccolo che le copre
+# - misure a livello ordine sommabili lungo stato/mese/giorno ma non lungo la categoria:
+#   un rollup con categoria serve solo richieste raggruppate per categoria
+# - nessun rollup adatto (date al giorno, filtro categoria su KPI per ordine): stessa
+#   aggregazione calcolata al volo su gold.fact_orders o gold.fact_sales, con i filtri
+#   applicati prima dell'aggregazione per ordine
+# -------------------------------------------------------------------
+CATEGORY_DIM = "product_category_name"
+
+_rollup_catalog = {}   # origine -> (versione Gold, rollup)
+_rollup_lock = threading.Lock()
+
+def _load_rollups(con):
+    # Catalogo letto una volta per origine e versione Gold
+    origin = _origin(con)
+    version = load_gold_version(con)
+    with _rollup_lock:
+        cached = _rollup_catalog.get(origin)
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+    try:
+        rows = con.execute("SELECT table_name, dims, rows FROM gold.rollup_catalog ORDER BY rows").fetchall()
+        profiling.record(con, "dashboard", "rollup_catalog")
+    except duckdb.CatalogException:
+        rows = []
+    rollups = [(table, frozenset(dims)) for table, dims, _ in rows]
+    with _rollup_lock:
+        _rollup_catalog[origin] = (version, rollups)
+    return rollups
+
+# Stessa semantica di _rollup_select in etl/tasks/gold.py, alle sole dimensioni richieste
+# e con i filtri applicati a livello ordine/articolo: misure per ordine da gold.fact_orders,
+# categoria (raggruppamento o filtro) dal grain item di gold.fact_sales
+def _base_rollup_select(dims, conditions, item_grain):
+    dims_sql = "".join(f"{d}, " for d in dims)
+    if not item_grain:
+        return f"""
+            SELECT
+                {dims_sql}
+                SUM(order_revenue) AS revenue,
+                SUM(freight_value) AS freight_value,
+                SUM(items) AS items,
+                COUNT(*) AS orders,
+                SUM(delivery_time_days) AS delivery_days_sum,
+                COUNT(delivery_time_days) AS delivered_orders
+            FROM (
+                SELECT
+                    *,
+                    strftime(order_purchase_timestamp, '%Y-%m') AS year_month,
+                    strftime(order_purchase_timestamp, '%A') AS day_of_week
+                FROM gold.fact_orders
+            ) o
+            {_where(conditions)}
+            GROUP BY ALL
+        """
+
+    return f"""
+        WITH items AS (
+            SELECT
+                f.*,
+                c.customer_state,
+                p.product_category_name,
+                CAST(f.order_purchase_timestamp AS DATE) AS order_date,
+                strftime(f.order_purchase_timestamp, '%Y-%m') AS year_month,
+                strftime(f.order_purchase_timestamp, '%A') AS day_of_week
+            FROM gold.fact_sales f
+            JOIN gold.dim_customers c ON f.customer_key = c.customer_key
+            JOIN gold.dim_products p ON f.product_key = p.product_key
+        ),
+        per_order AS (
+            SELECT
+                {dims_sql}
+                order_id,
+                SUM(price) AS revenue,
+                SUM(freight_value) AS freight_value,
+                COUNT(*) AS items,
+                MAX(delivery_time_days) AS delivery_days
+            FROM items
+            {_where(conditions)}
+            GROUP BY {dims_sql} order_id
+        )
+        SELECT
+            {dims_sql}
+            SUM(revenue) AS revenue,
+            SUM(freight_value) AS freight_value,
+            SUM(items) AS items,
+            COUNT(*) AS orders,
+            SUM(delivery_days) AS delivery_days_sum,
+            COUNT(delivery_days) AS delivered_orders
+        FROM per_order
+        GROUP BY ALL
+    """
+
+def route_relation(con, group_dims, states=None, date_from=None, date_to=None, categories=None, backend="duckdb"):
+    """
+    Ritorna (relazione, WHERE, parametri) per aggregare alle dimensioni group_dims
+    con i filtri richiesti: rollup più piccolo compatibile, altrimenti base filtrata.
+    Con backend="lake" la base filtrata aggiunge il pruning sulle partizioni year/month.
+    """
+    group_dims = set(group_dims)
+    dated = date_from is not None or date_to is not None
+    months = _month_bounds(date_from, date_to) if dated else None
+
+    if not dated or months is not None:
+        dims = set(group_dims)
+        dims |= {"customer_state"} if states else set()
+        dims |= {CATEGORY_DIM} if categories else set()
+        dims |= {"year_month"} if months is not None else set()
+        for table, rollup_dims in _load_rollups(con):
+            if dims <= rollup_dims and (CATEGORY_DIM in rollup_dims) == (CATEGORY_DIM in group_dims):
+                conditions, params = _filter_conditions(states, categories, months=months)
+                return table, _where(conditions), params
+
+    conditions, params = _filter_conditions(states, categories, dates=(date_from, date_to) if dated else None)
+    if dated and backend == "lake":
+        partition_conditions, partition_params = _partition_conditions(date_from, date_to)
+        conditions += partition_conditions
+        params += partition_params
+    item_grain = CATEGORY_DIM in group_dims or bool(categories)
+    return f"({_base_rollup_select(sorted(group_dims), conditions, item_grain)})", "", params
+
+def _query(con, group_dims, filters, select_sql):
+    relation, where, params = route_relation(con, group_dims, backend=_backend_of(con), **filters)
+    return con.execute(select_sql.format(relation=relation, where=where), params)
+
 # -------------------------------------------------------------------
 # KPI PRINCIPALI (coerenti a livello ORDINE)
 # - total_sales: somma price per ordine e poi somma totale
@@ -12,144 +437,244 @@ def get_connection(db_path):
 # - avg_freight: media freight_value per ordine (1 ordine = 1 peso)
 # - avg_order_value: media order_revenue per ordine
 # -------------------------------------------------------------------
-def load_kpis(con, query_where):
-    return con.execute(f"""
-        WITH per_order AS (
-            SELECT
-                f.order_id,
-                SUM(f.price) AS order_revenue,
-                MAX(f.delivery_time_days) AS delivery_time_days,
-                SUM(f.freight_value) AS freight_value
-            FROM gold.fact_sales f
-            JOIN gold.dim_customers c ON f.customer_id = c.customer_id
-            {query_where}
-            GROUP BY f.order_id
-        )
-        SELECT
-            SUM(order_revenue) AS total_sales,
-            AVG(delivery_time_days) AS avg_delivery,
-            COUNT(*) AS total_orders,
-            AVG(freight_value) AS avg_freight,
-            AVG(order_revenue) AS avg_order_value
-        FROM per_order
-    """).fetchone()
+KPIS_SQL = """
+    SELECT
+        SUM(revenue) AS total_sales,
+        SUM(delivery_days_sum) / NULLIF(SUM(delivered_orders), 0) AS avg_delivery,
+        COALESCE(SUM(orders), 0) AS total_orders,
+        SUM(freight_value) / NULLIF(SUM(orders), 0) AS avg_freight,
+        SUM(revenue) / NULLIF(SUM(orders), 0) AS avg_order_value
+    FROM {relation} r
+    {where}
+"""
 
 # -------------------------------------------------------------------
 # TOP CATEGORIE (grain item: corretto sommare price per product/category)
 # -------------------------------------------------------------------
-def load_category_data(con, query_where):
-    return con.execute(f"""
-        SELECT
-            p.product_category_name AS Categoria,
-            SUM(f.price) AS Fatturato
-        FROM gold.fact_sales f
-        JOIN gold.dim_products p ON f.product_id = p.product_id
-        JOIN gold.dim_customers c ON f.customer_id = c.customer_id
-        {query_where}
-        GROUP BY Categoria
-        ORDER BY Fatturato DESC
-        LIMIT 10
-    """).df()
+CATEGORY_SQL = """
+    SELECT
+        product_category_name AS Categoria,
+        SUM(revenue) AS Fatturato
+    FROM {relation} r
+    {where}
+    GROUP BY Categoria
+    ORDER BY Fatturato DESC
+    LIMIT 10
+"""
 
 # -------------------------------------------------------------------
 # ORDINI PER STATO (conteggio ordini distinti)
 # -------------------------------------------------------------------
-def load_state_data(con, query_where):
-    return con.execute(f"""
-        SELECT
-            c.customer_state AS Stato,
-            COUNT(DISTINCT f.order_id) AS Ordini
-        FROM gold.fact_sales f
-        JOIN gold.dim_customers c ON f.customer_id = c.customer_id
-        {query_where}
-        GROUP BY Stato
-        ORDER BY Ordini DESC
-    """).df()
+STATE_SQL = """
+    SELECT
+        customer_state AS Stato,
+        CAST(SUM(orders) AS BIGINT) AS Ordini
+    FROM {relation} r
+    {where}
+    GROUP BY Stato
+    ORDER BY Ordini DESC
+"""
 
 # -------------------------------------------------------------------
 # TEMPI DI CONSEGNA PER STATO (coerenti a livello ORDINE)
-# - prima collassiamo a 1 riga per ordine (per stato)
-# - poi facciamo AVG sui soli ordini
+# - i rollup contengono già la somma dei giorni per ordine e gli ordini consegnati
+# - AVG sui soli ordini = somma giorni / ordini con data di consegna
 # -------------------------------------------------------------------
-def load_shipping_time_data(con, query_where):
-    return con.execute(f"""
-        WITH per_order AS (
-            SELECT
-                f.order_id,
-                c.customer_state AS Stato,
-                MAX(f.delivery_time_days) AS delivery_time_days
-            FROM gold.fact_sales f
-            JOIN gold.dim_customers c ON f.customer_id = c.customer_id
-            {query_where}
-            GROUP BY f.order_id, c.customer_state
-        )
-        SELECT
-            Stato,
-            AVG(delivery_time_days) AS Tempi_Consegna
-        FROM per_order
-        GROUP BY Stato
-        ORDER BY Tempi_Consegna DESC
-    """).df()
+SHIPPING_TIME_SQL = """
+    SELECT
+        customer_state AS Stato,
+        SUM(delivery_days_sum) / NULLIF(SUM(delivered_orders), 0) AS Tempi_Consegna
+    FROM {relation} r
+    {where}
+    GROUP BY Stato
+    ORDER BY Tempi_Consegna DESC
+"""
 
 # -------------------------------------------------------------------
 # COSTO MEDIO SPEDIZIONE PER STATO (coerenti a livello ORDINE)
-# - stessa logica: 1 riga per ordine (per stato), poi AVG
+# - stessa logica: spedizione totale / numero ordini
 # -------------------------------------------------------------------
-def load_avg_shipping_data(con, query_where):
-    return con.execute(f"""
-        WITH per_order AS (
-            SELECT
-                f.order_id,
-                c.customer_state AS Stato,
-                SUM(f.freight_value) AS freight_value
-            FROM gold.fact_sales f
-            JOIN gold.dim_customers c ON f.customer_id = c.customer_id
-            {query_where}
-            GROUP BY f.order_id, c.customer_state
-        )
-        SELECT
-            Stato,
-            AVG(freight_value) AS Costo_Spedizione
-        FROM per_order
-        GROUP BY Stato
-        ORDER BY Costo_Spedizione DESC
-    """).df()
+AVG_SHIPPING_SQL = """
+    SELECT
+        customer_state AS Stato,
+        SUM(freight_value) / NULLIF(SUM(orders), 0) AS Costo_Spedizione
+    FROM {relation} r
+    {where}
+    GROUP BY Stato
+    ORDER BY Costo_Spedizione DESC
+"""
 
 # -------------------------------------------------------------------
 # TREND MENSILE (fatturato)
 # Nota: somma price a grain item => corretto per fatturato
 # -------------------------------------------------------------------
-def load_trend_data(con, query_where):
-    return con.execute(f"""
-        SELECT
-            strftime(CAST(f.order_purchase_timestamp AS TIMESTAMP), '%Y-%m') AS Periodo,
-            SUM(f.price) AS Fatturato
-        FROM gold.fact_sales f
-        JOIN gold.dim_customers c ON f.customer_id = c.customer_id
-        {query_where}
-        GROUP BY 1
-        ORDER BY 1
-    """).df()
+TREND_SQL = """
+    SELECT
+        year_month AS Periodo,
+        SUM(revenue) AS Fatturato
+    FROM {relation} r
+    {where}
+    GROUP BY 1
+    ORDER BY 1
+"""
 
 # -------------------------------------------------------------------
 # STAGIONALITÀ SETTIMANALE (fatturato)
 # -------------------------------------------------------------------
-def load_weekly_seasonality(con, query_where):
-    return con.execute(f"""
-        SELECT
-            strftime(CAST(f.order_purchase_timestamp AS TIMESTAMP), '%A') AS day_of_week,
-            SUM(f.price) AS Fatturato
-        FROM gold.fact_sales f
-        JOIN gold.dim_customers c ON f.customer_id = c.customer_id
-        {query_where}
-        GROUP BY 1
-        ORDER BY CASE
-            WHEN day_of_week = 'Monday' THEN 1
-            WHEN day_of_week = 'Tuesday' THEN 2
-            WHEN day_of_week = 'Wednesday' THEN 3
-            WHEN day_of_week = 'Thursday' THEN 4
-            WHEN day_of_week = 'Friday' THEN 5
-            WHEN day_of_week = 'Saturday' THEN 6
-            WHEN day_of_week = 'Sunday' THEN 7
-        END
-    """).df()
+WEEKLY_SQL = """
+    SELECT
+        day_of_week,
+        SUM(revenue) AS Fatturato
+    FROM {relation} r
+    {where}
+    GROUP BY 1
+    ORDER BY CASE
+        WHEN day_of_week = 'Monday' THEN 1
+        WHEN day_of_week = 'Tuesday' THEN 2
+        WHEN day_of_week = 'Wednesday' THEN 3
+        WHEN day_of_week = 'Thursday' THEN 4
+        WHEN day_of_week = 'Friday' THEN 5
+        WHEN day_of_week = 'Saturday' THEN 6
+        WHEN day_of_week = 'Sunday' THEN 7
+    END
+"""
+
+# Widget della dashboard: nome -> (dimensioni di raggruppamento, SQL, tipo di risultato)
+WIDGETS = {
+    "kpis": ([], KPIS_SQL, "row"),
+    "category": ([CATEGORY_DIM], CATEGORY_SQL, "df"),
+    "state": (["customer_state"], STATE_SQL, "df"),
+    "shipping_time": (["customer_state"], SHIPPING_TIME_SQL, "df"),
+    "avg_shipping": (["customer_state"], AVG_SHIPPING_SQL, "df"),
+    "trend": (["year_month"], TREND_SQL, "df"),
+    "weekly": (["day_of_week"], WEEKLY_SQL, "df"),
+}
+
+def _fetch(relation, kind, name):
+    if kind == "row":
+        # fetchall: DuckDB completa il profilo della query solo a risultato consumato
+        rows = relation.fetchall()
+        profiling.record(relation, "dashboard", name)
+        return rows[0] if rows else None
+    # Colonne ENUM di Gold -> category in pandas: riportate a stringhe come dal backend lake
+    df = relation.df()
+    profiling.record(relation, "dashboard", name)
+    for column in df.select_dtypes("category"):
+        df[column] = df[column].astype(df[column].cat.categories.dtype)
+    return df
+
+def _load_widget(con, name, filters):
+    group_dims, select_sql, kind = WIDGETS[name]
+    return _fetch(_query(con, group_dims, filters, select_sql), kind, name)
+
+@cached_query
+def load_kpis(con, **filters):
+    return _load_widget(con, "kpis", filters)
+
+@cached_query
+def load_category_data(con, **filters):
+    return _load_widget(con, "category", filters)
+
+@cached_query
+def load_state_data(con, **filters):
+    return _load_widget(con, "state", filters)
+
+@cached_query
+def load_shipping_time_data(con, **filters):
+    return _load_widget(con, "shipping_time", filters)
+
+@cached_query
+def load_avg_shipping_data(con, **filters):
+    return _load_widget(con, "avg_shipping", filters)
+
+@cached_query
+def load_trend_data(con, **filters):
+    return _load_widget(con, "trend", filters)
+
+@cached_query
+def load_weekly_seasonality(con, **filters):
+    return _load_widget(con, "weekly", filters)
+
+# -------------------------------------------------------------------
+# ESECUZIONE DELL'INTERA DASHBOARD (1 base filtrata + widget in parallelo)
+# - i widget a livello ordine condividono una base: le righe del rollup
+#   (stato, mese, giorno) già filtrate, materializzate una volta come tabella Arrow
+#   (o la base calcolata dalla fact, se i filtri non sono serviti dai rollup)
+# - ogni widget aggrega la base su un proprio cursore DuckDB, in parallelo;
+#   la categoria (non sommabile per ordine) usa il suo rollup
+# - tempo totale ~ una lettura filtrata + il widget più lento
+# -------------------------------------------------------------------
+@cached_query
+def load_dashboard(con, **filters):
+    shared = [name for name, (dims, _, _) in WIDGETS.items() if CATEGORY_DIM not in dims]
+    base_dims = set().union(*(WIDGETS[name][0] for name in shared))
+    relation, where, params = route_relation(con, base_dims, backend=_backend_of(con), **filters)
+    base = con.execute(f"SELECT * FROM {relation} r {where}", params).to_arrow_table()
+    profiling.record(con, "dashboard", "dashboard_base")
+
+    # Cursori creati nel thread chiamante, usati ciascuno da un solo worker
+    cursors = {name: _child_cursor(con) for name in WIDGETS}
+
+    def run(name):
+        cur = cursors[name]
+        if name not in shared:
+            return name, _load_widget(cur, name, filters)
+        _, select_sql, kind = WIDGETS[name]
+        cur.register("_dashboard_base", base)
+        return name, _fetch(cur.execute(select_sql.format(relation="_dashboard_base", where="")), kind, name)
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(WIDGETS)) as pool:
+            return dict(pool.map(run, WIDGETS))
+    finally:
+        for cur in cursors.values():
+            cur.close()
+
+# -------------------------------------------------------------------
+# METRICHE DI RUN DELLA PIPELINE (tech.tech_run_metrics, solo backend file DuckDB)
+# - fuori dalla cache: cambiano a ogni run anche senza una nuova versione Gold
+# - durata del run = fine dell'ultimo step - inizio del primo (gli step concorrenti si sovrappongono)
+# -------------------------------------------------------------------
+RUN_SUMMARY_SQL = """
+    SELECT
+        run_id,
+        MIN(started_at) AS started_at,
+        date_diff('millisecond', MIN(started_at),
+                  MAX(started_at + to_microseconds(CAST(wall_s * 1e6 AS BIGINT)))) / 1000.0 AS duration_s,
+        CAST(SUM(rows_out) AS BIGINT) AS rows_out,
+        MAX(peak_rss_mb) AS peak_rss_mb,
+        MAX(duckdb_mem_mb) AS duckdb_mem_mb,
+        CAST(COUNT_IF(status = 'FAILED') AS INTEGER) AS failed_steps
+    FROM tech.tech_run_metrics
+    WHERE kind = 'STEP'
+    GROUP BY run_id
+    ORDER BY started_at DESC
+    LIMIT ?
+"""
+
+RUN_STEPS_SQL = """
+    WITH runs AS ({summary})
+    SELECT r.started_at AS run_started_at, m.run_id, m.layer, m.layer || '/' || m.step AS step,
+           m.status, m.wall_s, m.rows_in, m.rows_out, m.rows_per_s, m.peak_rss_mb, m.duckdb_mem_mb
+    FROM tech.tech_run_metrics m
+    JOIN runs r ON m.run_id = r.run_id
+    WHERE m.kind = 'STEP'
+    ORDER BY run_started_at, m.started_at
+"""
+
+SLOWEST_STATEMENTS_SQL = """
+    SELECT layer || '/' || step AS step, status, wall_s, duckdb_mem_mb, statement
+    FROM tech.tech_run_metrics
+    WHERE kind = 'SQL' AND run_id = ?
+    ORDER BY wall_s DESC
+    LIMIT ?
+"""
+
+def load_run_summary(con, runs=30):
+    return con.execute(RUN_SUMMARY_SQL, [runs]).df()
+
+def load_run_steps(con, runs=30):
+    return con.execute(RUN_STEPS_SQL.format(summary=RUN_SUMMARY_SQL), [runs]).df()
+
+def load_slowest_statements(con, run_id, limit=20):
+    return con.execute(SLOWEST_STATEMENTS_SQL, [run_id, limit]).df()
@@ -2,25 +2,32 @@ import os
 from dotenv import load_dotenv
 from prefect import flow
 
-# Import dei task
-from etl.tasks.bronze import ingest_all_raw_data
-from etl.tasks.silver import clean_olist_data
-from etl.tasks.gold import build_olist_star_schema
+# Import dei task (ogni layer espone i suoi step per tabella)
+from etl.scheduling import run_steps, task_runner
+from etl.tasks.bronze import bronze_steps
+from etl.tasks.silver import silver_steps
+from etl.tasks.gold import gold_steps
+from etl.tasks.lake import export_lake
 
 # Definizione del flusso principale
-@flow(name="Brazilian E-Commerce Pipeline")
+# Step per tabella in parallelo (al più ETL_TASK_CONCURRENCY), dipendenze dalle tabelle lette/scritte
+@flow(name="Brazilian E-Commerce Pipeline", task_runner=task_runner())
 def main_flow(db_path: str):
     # 1. BRONZE (fase raw)
     print(f"--- Avvio Fase Bronze su {db_path} ---")
-    ingest_all_raw_data(db_path)
+    run_steps(bronze_steps(db_path))
 
     # 2. SILVER (pulizia e tipizzazione dati)
     print("--- Avvio Fase Silver ---")
-    clean_olist_data(db_path)
+    run_steps(silver_steps(db_path))
 
     # 3. GOLD (costruzione star schema)
     print("--- Avvio Fase Gold ---")
-    build_olist_star_schema(db_path)
+    run_steps(gold_steps(db_path))
+
+    # 4. LAKE (export Parquet partizionato del Gold)
+    print("--- Avvio Export Lake ---")
+    export_lake(db_path)
 
     print("--- PIPELINE COMPLETATA CON SUCCESSO ---")
     
@@ -18,30 +18,38 @@ from scripts.esplosione_dati import esplodi_dati
 # Step 2: Bronze incrementale (Landing Zone -> DB)
 from scripts.bronze_incremental import run_bronze_incremental
 
-# Step 3 & 4: Silver + Gold (DB-based, già esistenti)
-from etl.tasks.silver import clean_olist_data
-from etl.tasks.gold import build_olist_star_schema
+# Step 3 & 4: Silver + Gold (DB-based, step per tabella eseguiti in parallelo)
+from etl.scheduling import run_steps, task_runner
+from etl.tasks.silver import silver_steps
+from etl.tasks.gold import gold_steps
+
+# Step 5: Export Gold (+ Silver opzionale) come Parquet partizionato (data/lake)
+from etl.tasks.lake import export_lake
 
 
 # ------------------------------------------------------------
 # DEFINIZIONE FLOW PHASE 2
 # ------------------------------------------------------------
-@flow(name="Brazilian E-Commerce Pipeline - Phase 2 (Incremental)")
+@flow(name="Brazilian E-Commerce Pipeline - Phase 2 (Incremental)", task_runner=task_runner())
 def main_flow_fase2(db_path: str):
     """
     Pipeline Phase 2 (Incrementale):
 
     1. CSV raw -> Parquet mensili (Landing Zone)
     2. Landing Zone -> Bronze (DB, incrementale anti-duplicate)
-    3. Bronze -> Silver (pulizia + validazioni)
-    4. Silver -> Gold (Star Schema)
+    3. Bronze -> Silver (pulizia + validazioni, merge incrementale)
+    4. Silver -> Gold (Star Schema, build incrementale)
+    5. Gold -> Lake Parquet (partizioni year=/month=, riscritte solo se cambiate)
+
+    Gli step 3 e 4 sono task per tabella: partono in parallelo (al più ETL_TASK_CONCURRENCY)
+    e ognuno attende solo gli step che scrivono le tabelle che legge o scrive.
     """
 
     # --------------------------------------------------------
     # STEP 1 - ESPLOSIONE DATI (FILE-BASED)
     # --------------------------------------------------------
     print("\n--- STEP 1: ESPLOSIONE DATI (CSV -> Landing Zone) ---")
-    esplodi_dati()
+    esplodi_dati(db_path=db_path)
 
     # --------------------------------------------------------
     # STEP 2 - BRONZE INCREMENTAL (DB-BASED)
@@ -53,13 +61,19 @@ def main_flow_fase2(db_path: str):
     # STEP 3 - SILVER (PULIZIA + VALIDAZIONI)
     # --------------------------------------------------------
     print("\n--- STEP 3: SILVER LAYER ---")
-    clean_olist_data(db_path)
+    run_steps(silver_steps(db_path, incremental=True))
 
     # --------------------------------------------------------
     # STEP 4 - GOLD (STAR SCHEMA)
     # --------------------------------------------------------
     print("\n--- STEP 4: GOLD LAYER (STAR SCHEMA) ---")
-    build_olist_star_schema(db_path)
+    run_steps(gold_steps(db_path, incremental=True))
+
+    # --------------------------------------------------------
+    # STEP 5 - EXPORT LAKE (PARQUET PARTIZIONATO)
+    # --------------------------------------------------------
+    print("\n--- STEP 5: EXPORT LAKE (Gold -> Parquet) ---")
+    export_lake(db_path)
 
     print("\n--- PIPELINE PHASE 2 COMPLETATA CON SUCCESSO ---")
 
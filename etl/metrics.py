@@ -0,0 +1,204 @@
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+import duckdb
+from prefect.runtime import flow_run
+
+try:
+    import resource   # solo Unix: su Windows l'RSS di picco resta NULL
+except ImportError:
+    resource = None
+
+from etl import profiling
+from etl.utils import ensure_run_metrics_table, utc_now_iso
+
+# Metriche di run in tech.tech_run_metrics (ETL_RUN_METRICS=0 per non registrarle)
+RUN_METRICS = os.getenv("ETL_RUN_METRICS", "1") == "1"
+# Testo degli statement salvato (spazi compattati, troncato)
+STATEMENT_CHARS = 300
+
+# Fuori da un flow Prefect (script, task chiamati direttamente): un run id per processo
+_PROCESS_RUN_ID = os.getenv("ETL_RUN_ID") or uuid.uuid4().hex
+
+
+def run_id() -> str:
+    # Dentro un flow: l'id del flow run, lo stesso per tutti i task (anche nei thread del task runner)
+    return flow_run.id or _PROCESS_RUN_ID
+
+
+# -----------------------------
+# Misure di processo e DuckDB
+# -----------------------------
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # Picco dall'avvio del processo: KB su Linux, byte su macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def _duckdb_memory_mb(con: duckdb.DuckDBPyConnection):
+    # Memoria in uso nel buffer manager dell'istanza (condivisa da tutte le connessioni al file)
+    try:
+        return con.execute("SELECT SUM(memory_usage_bytes) FROM duckdb_memory()").fetchone()[0] / 2**20
+    except duckdb.Error:
+        return None
+
+
+def _count_rows(con: duckdb.DuckDBPyConnection, tables):
+    # Righe delle tabelle "schema.tabella" esistenti; None se nessuna esiste
+    existing = con.execute("""
+        SELECT table_schema || '.' || table_name
+        FROM information_schema.tables
+        WHERE table_type = 'BASE TABLE'
+          AND list_contains(?, table_schema || '.' || table_name)
+        ORDER BY 1
+    """, [sorted(tables)]).fetchall()
+    if not existing:
+        return None
+    return con.execute("SELECT " + " + ".join(f"(SELECT COUNT(*) FROM {t})" for t, in existing)).fetchone()[0]
+
+
+# -----------------------------
+# Step e statement misurati
+# -----------------------------
+class StepMetrics:
+    """
+    Misure di uno step: una riga STEP e una riga SQL per statement, scritte a fine step.
+    rows_in / rows_out si possono impostare dallo step; rows_per_s = rows_out / wall_s.
+    """
+
+    def __init__(self, layer: str, step: str):
+        self.layer = layer
+        self.step = step
+        self.rows_in = None
+        self.rows_out = None
+        self.started_at = utc_now_iso()
+        self.rows = []
+        self._start = time.perf_counter()
+
+    def _row(self, kind, statement, status, started_at, wall_s, rows_in, rows_out, duckdb_mem_mb):
+        rows_per_s = rows_out / wall_s if rows_out is not None and wall_s > 0 else None
+        return (
+            run_id(), self.layer, self.step, kind, statement, status, started_at,
+            wall_s, rows_in, rows_out, rows_per_s, _peak_rss_mb(), duckdb_mem_mb,
+        )
+
+    def statement(self, sql: str, status: str, started_at: str, wall_s: float, duckdb_mem_mb):
+        text = " ".join(sql.split())[:STATEMENT_CHARS]
+        self.rows.append(self._row("SQL", text, status, started_at, wall_s, None, None, duckdb_mem_mb))
+
+    def finish(self, status: str, duckdb_mem_mb=None):
+        wall_s = time.perf_counter() - self._start
+        self.rows.append(self._row("STEP", None, status, self.started_at, wall_s, self.rows_in, self.rows_out, duckdb_mem_mb))
+        print(f"Metriche: {self.layer}/{self.step} {status} in {wall_s:.2f}s (rows_out={self.rows_out})")
+
+
+def _write(con: duckdb.DuckDBPyConnection, metrics: StepMetrics):
+    if not RUN_METRICS:
+        return
+    # Le metriche non devono mai far fallire la pipeline
+    try:
+        ensure_run_metrics_table(con)
+        con.executemany(
+            "INSERT INTO tech.tech_run_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            metrics.rows,
+        )
+    except duckdb.Error as e:
+        print(f"Metriche: {metrics.layer}/{metrics.step} non registrate ({e})")
+
+
+class MeteredConnection:
+    """
+    Connessione DuckDB che misura ogni execute() (tempo, memoria DuckDB, RSS di picco).
+    Il resto dell'API passa alla connessione originale. Le variabili Python usate come
+    tabelle (SELECT * FROM df) non sono visibili attraverso il wrapper: usare register().
+
+    Con DUCKDB_PROFILING=1 salva anche il profilo JSON di ogni statement (etl/profiling.py):
+    letto all'execute() successivo, quando il risultato precedente è già stato consumato.
+    """
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, metrics: StepMetrics):
+        self._con = con
+        # Cursore separato per le misure: non invalida il risultato appena prodotto
+        self._probe = con.cursor()
+        self._last_query = None
+        self.metrics = metrics
+        profiling.enable(con)
+
+    def record_profile(self):
+        if self._last_query is not None:
+            profiling.record(self._con, "etl", f"{self.metrics.layer}/{self.metrics.step}", expected_sql=self._last_query)
+            self._last_query = None
+
+    def execute(self, query, *args, **kwargs):
+        self.record_profile()
+        started_at = utc_now_iso()
+        start = time.perf_counter()
+        status = "FAILED"
+        try:
+            result = self._con.execute(query, *args, **kwargs)
+            status = "OK"
+            self._last_query = query
+            return result
+        finally:
+            self.metrics.statement(query, status, started_at, time.perf_counter() - start, _duckdb_memory_mb(self._probe))
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+
+@contextmanager
+def metered_step(db_path, layer: str, step: str, reads=(), writes=()):
+    """
+    Connessione DuckDB misurata per uno step, chiusa all'uscita; a fine step (anche se
+    fallito) registra in tech.tech_run_metrics lo step e ogni statement eseguito.
+
+    Se lo step non imposta con.metrics.rows_in / rows_out, valgono le righe delle tabelle
+    `reads` all'inizio e di `writes` alla fine (gli stessi nomi "schema.tabella" degli step).
+    """
+    raw = duckdb.connect(db_path)
+    con = MeteredConnection(raw, StepMetrics(layer, step))
+    status = "FAILED"
+    try:
+        rows_in = _count_rows(raw, reads)
+        yield con
+        status = "OK"
+    finally:
+        try:
+            con.record_profile()
+            metrics = con.metrics
+            if metrics.rows_in is None:
+                metrics.rows_in = rows_in
+            if metrics.rows_out is None and status == "OK":
+                metrics.rows_out = _count_rows(raw, writes)
+            metrics.finish(status, _duckdb_memory_mb(raw))
+            _write(raw, metrics)
+        finally:
+            con._probe.close()
+            raw.close()
+
+
+@contextmanager
+def timed_step(db_path, layer: str, step: str):
+    """Step senza connessione DuckDB (landing zone): righe impostate dal chiamante su rows_in / rows_out."""
+    metrics = StepMetrics(layer, step)
+    status = "FAILED"
+    try:
+        yield metrics
+        status = "OK"
+    finally:
+        metrics.finish(status)
+        if RUN_METRICS:
+            try:
+                con = duckdb.connect(db_path)
+            except duckdb.Error as e:
+                print(f"Metriche: {layer}/{step} non registrate ({e})")
+            else:
+                try:
+                    _write(con, metrics)
+                finally:
+                    con.close()
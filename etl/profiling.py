@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime, timezone
+
+import duckdb
+
+# Profiling JSON di DuckDB per statement (opt-in): ETL, dashboard e query dell'assistant AI
+PROFILING = os.getenv("DUCKDB_PROFILING", "0") == "1"
+# Profili in JSON Lines, un file per sorgente/giorno/processo (nessuna scrittura concorrente tra processi)
+PROFILE_DIR = os.getenv("DUCKDB_PROFILE_DIR", "data/profiles")
+
+# Letterali stringa e numerici: stessa impronta per la stessa query con valori diversi
+_LITERALS_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_write_lock = threading.Lock()
+
+
+def _normalize(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def fingerprint(sql: str) -> str:
+    return hashlib.sha1(_LITERALS_RE.sub("?", _normalize(sql)).lower().encode()).hexdigest()[:16]
+
+
+def enable(con: duckdb.DuckDBPyConnection):
+    # Vale per la singola connessione/cursore; 'no_output': il profilo si legge con get_profiling_information
+    if PROFILING:
+        con.execute("PRAGMA enable_profiling = 'no_output'")
+
+
+def _operators(node: dict, depth: int = 0) -> list:
+    # Albero degli operatori appiattito (pre-ordine): nome, profondità, tempo e cardinalità
+    rows = []
+    for child in node.get("children", []):
+        rows.append({
+            "operator": child.get("operator_name"),
+            "depth": depth,
+            "timing_s": child.get("operator_timing"),
+            "cardinality": child.get("operator_cardinality"),
+            "rows_scanned": child.get("operator_rows_scanned"),
+        })
+        rows.extend(_operators(child, depth + 1))
+    return rows
+
+
+def record(con: duckdb.DuckDBPyConnection, source: str, label: str = None, expected_sql: str = None):
+    """
+    Salva il profilo dell'ultima query di `con` (già consumata per intero: per le SELECT
+    DuckDB completa il profilo solo dopo l'ultima riga) in PROFILE_DIR.
+
+    Ogni riga: impronta dello statement, sorgente (etl / dashboard / ai), etichetta (step o
+    widget), testo, latenza, righe, operatori con i tempi e l'albero completo del piano.
+    Con `expected_sql` il profilo viene scartato se appartiene a un'altra query.
+    """
+    if not PROFILING:
+        return
+    try:
+        profile = json.loads(con.get_profiling_information(format="json"))
+    except (duckdb.Error, ValueError):
+        return
+    query = _normalize(profile.get("query_name") or "")
+    # Statement non profilati (BEGIN, SET, ...) o risultato non ancora consumato
+    if not query or (expected_sql is not None and query != _normalize(expected_sql)):
+        return
+
+    entry = {
+        "fingerprint": fingerprint(query),
+        "source": source,
+        "label": label,
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "query": query,
+        "latency_s": profile.get("latency"),
+        "cpu_time_s": profile.get("cpu_time"),
+        "rows": profile.get("rows_returned"),
+        "peak_buffer_memory": profile.get("system_peak_buffer_memory"),
+        "operators": _operators(profile),
+        "plan": profile.get("children", []),
+    }
+    path = os.path.join(PROFILE_DIR, f"{source}_{datetime.now():%Y%m%d}_{os.getpid()}.jsonl")
+    with _write_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
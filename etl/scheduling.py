@@ -0,0 +1,56 @@
+import os
+
+from prefect.context import FlowRunContext, TaskRunContext
+from prefect.task_runners import ThreadPoolTaskRunner
+
+# Task per tabella eseguiti insieme al massimo (DuckDB parallelizza già ogni singola query
+# sui core disponibili: la concorrenza serve a sovrapporre gli step indipendenti)
+TASK_CONCURRENCY = int(os.getenv("ETL_TASK_CONCURRENCY", "4"))
+
+
+def task_runner() -> ThreadPoolTaskRunner:
+    return ThreadPoolTaskRunner(max_workers=TASK_CONCURRENCY)
+
+
+# -----------------------------
+# Step: (task Prefect, parametri, tabelle lette, tabelle scritte)
+# -----------------------------
+def step(task, params: dict, reads, writes) -> tuple:
+    return task, params, frozenset(reads), frozenset(writes)
+
+
+def _conflicts(earlier: tuple, later: tuple) -> bool:
+    # Scrittura-lettura, lettura-scrittura o scrittura-scrittura sulla stessa tabella
+    _, _, reads_a, writes_a = earlier
+    _, _, reads_b, writes_b = later
+    return bool(writes_a & (reads_b | writes_b) or reads_a & writes_b)
+
+
+def dependencies(steps: list) -> list:
+    """Per ogni step, gli indici degli step precedenti (nell'ordine della lista) da attendere."""
+    return [
+        [j for j in range(i) if _conflicts(steps[j], steps[i])]
+        for i in range(len(steps))
+    ]
+
+
+def run_steps(steps: list) -> list:
+    """
+    Esegue gli step rispettando le dipendenze ricavate dalle tabelle lette/scritte.
+
+    L'ordine della lista è sempre un'esecuzione seriale valida: uno step attende solo
+    gli step precedenti in conflitto con lui, gli altri partono subito.
+    - dentro un flow: task.submit(wait_for=...) sul task runner del flow (al più
+      TASK_CONCURRENCY task in parallelo con task_runner())
+    - fuori da un flow o dentro un task: chiamate dirette in ordine di lista
+
+    Ritorna i risultati degli step nell'ordine della lista; il primo step fallito
+    solleva la sua eccezione.
+    """
+    if FlowRunContext.get() is None or TaskRunContext.get() is not None:
+        return [task.fn(**params) for task, params, _, _ in steps]
+
+    futures = []
+    for (task, params, _, _), deps in zip(steps, dependencies(steps)):
+        futures.append(task.submit(**params, wait_for=[futures[j] for j in deps]))
+    return [future.result() for future in futures]
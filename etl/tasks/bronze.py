@@ -3,16 +3,47 @@ import duckdb
 import os
 from prefect import task
 
-@task(name="Ingest All CSVs to Bronze")
-def ingest_all_raw_data(db_path):
-    datasets = [
-        "olist_orders_dataset.csv",
-        "olist_order_items_dataset.csv",
-        "olist_products_dataset.csv",
-        "olist_customers_dataset.csv",
-        "olist_sellers_dataset.csv"
-    ]
-    
+from etl.metrics import metered_step
+from etl.scheduling import run_steps, step
+from etl.utils import STREAMING, apply_memory_limit, ensure_run_metrics_table
+
+RAW_DATASETS = [
+    "olist_orders_dataset.csv",
+    "olist_order_items_dataset.csv",
+    "olist_products_dataset.csv",
+    "olist_customers_dataset.csv",
+    "olist_sellers_dataset.csv"
+]
+
+
+def _bronze_table(file: str) -> str:
+    return file.replace("olist_", "").replace("_dataset.csv", "")
+
+
+@task(name="Ingest CSV to Bronze", task_run_name="bronze-{file}")
+def ingest_raw_table(db_path, file: str, streaming: bool = STREAMING):
+    table_name = _bronze_table(file)
+    path = f"data/raw/{file}"
+
+    with metered_step(db_path, "bronze", table_name) as con:
+        if streaming:
+            apply_memory_limit(con)
+            # Reader DuckDB: scansione a blocchi, tipi dedotti su tutto il file
+            rows = con.execute(f"""
+                CREATE OR REPLACE TABLE bronze.{table_name} AS
+                SELECT * FROM read_csv('{path}', header = true, auto_detect = true, sample_size = -1)
+            """).fetchone()[0]
+        else:
+            # Carico con Polars e salvo in DuckDB (registrato: la connessione misurata non vede le variabili locali)
+            con.register("raw_df", pl.read_csv(path))
+            rows = con.execute(f"CREATE OR REPLACE TABLE bronze.{table_name} AS SELECT * FROM raw_df").fetchone()[0]
+            con.unregister("raw_df")
+        con.metrics.rows_in = con.metrics.rows_out = rows
+        print(f"Caricato {table_name} nel layer Bronze")
+
+
+def bronze_steps(db_path, streaming: bool = STREAMING) -> list:
+    """Prepara cartella e schema Bronze; un task per CSV (tabelle indipendenti, tutti in parallelo)."""
     # Ricavo la cartella dal percorso del database
     db_dir = os.path.dirname(db_path)
     if db_dir and not os.path.exists(db_dir):
@@ -21,14 +52,25 @@ def ingest_all_raw_data(db_path):
 
     con = duckdb.connect(db_path)
     con.execute("CREATE SCHEMA IF NOT EXISTS bronze")
-    
-    for file in datasets:
-        table_name = file.replace("olist_", "").replace("_dataset.csv", "")
-        path = f"data/raw/{file}"
-        
-        # Carico con Polars e salvo in DuckDB
-        df = pl.read_csv(path)
-        con.execute(f"CREATE OR REPLACE TABLE bronze.{table_name} AS SELECT * FROM df")
-        print(f"Caricato {table_name} nel layer Bronze")
-    
-    con.close()
\ No newline at end of file
+    ensure_run_metrics_table(con)
+    con.close()
+
+    return [
+        step(ingest_raw_table, {"db_path": db_path, "file": file, "streaming": streaming},
+             reads={f"raw.{file}"}, writes={f"bronze.{_bronze_table(file)}"})
+        for file in RAW_DATASETS
+    ]
+
+
+@task(name="Ingest All CSVs to Bronze")
+def ingest_all_raw_data(db_path, streaming: bool = STREAMING):
+    """
+    CSV raw -> Bronze.
+
+    - streaming=False: lettura completa con Polars (il file intero passa in memoria).
+    - streaming=True: lettura nativa DuckDB (read_csv) a blocchi, con tetto di memoria
+      configurabile via ETL_MEMORY_LIMIT: il CSV non viene mai caricato per intero.
+
+    Esegue in sequenza gli step di bronze_steps (i flow li lanciano in parallelo).
+    """
+    run_steps(bronze_steps(db_path, streaming))
@@ -1,42 +1,112 @@
 import duckdb
 from prefect import task
 
-@task(name="Build Olist Star Schema (Gold)")
-def build_olist_star_schema(db_path):
-    con = duckdb.connect(db_path)
-    con.execute("CREATE SCHEMA IF NOT EXISTS gold")
-    
-    print("Costruzione Layer Gold: Fact e Dimension tables")
+from etl.metrics import metered_step
+from etl.scheduling import run_steps, step
+from etl.tasks.silver import DIMENSION_SOURCES
+from etl.utils import (
+    assign_surrogate_keys,
+    changed_files_since,
+    changed_order_months,
+    column_exists,
+    column_type,
+    ensure_gold_version_table,
+    ensure_key_map_table,
+    ensure_rowgroup_stats_table,
+    ensure_run_metrics_table,
+    ensure_watermark_table,
+    get_watermark,
+    publish_gold_version,
+    set_watermark,
+    table_exists,
+    utc_now_iso,
+)
 
-    # DIM_CUSTOMERS
-    con.execute("""
-        CREATE OR REPLACE TABLE gold.dim_customers AS 
-        SELECT 
-            customer_id,
-            customer_city,
-            customer_state
-        FROM silver.customers
-    """)
+GOLD_TABLES = ["dim_customers", "dim_products", "dim_time", "fact_sales", "fact_orders"]
 
-    # DIM_PRODUCTS
-    con.execute("""
-        CREATE OR REPLACE TABLE gold.dim_products AS 
-        SELECT 
-            product_id,
-            product_category_name
-        FROM silver.products
-    """)
+# LAYOUT FISICO DELLE FACT
+# Righe ordinate per data d'acquisto (e stato): le zone map min/max di ogni row group
+# coprono intervalli di date disgiunti e i filtri per periodo saltano i row group fuori range
+FACT_SORT_KEYS = {
+    "fact_sales": "order_purchase_timestamp, order_id",
+    "fact_orders": "order_date, customer_state",
+}
+# Indici ART sulle chiavi usate per lookup puntuali (ordine, cliente, prodotto)
+GOLD_INDEXES = {
+    "fact_sales": ["order_id"],
+    "fact_orders": ["order_id"],
+    "dim_customers": ["customer_id"],
+    "dim_products": ["product_id"],
+}
+# Colonne di cui registrare min/max per row group in tech.tech_gold_rowgroups
+ROWGROUP_STATS_COLUMNS = {
+    "fact_sales": ["order_purchase_timestamp"],
+    "fact_orders": ["order_date", "customer_state"],
+}
 
-    # DIM_TIME (DAILY GRAIN: 1 riga per giorno)
-    con.execute("""
-        CREATE OR REPLACE TABLE gold.dim_time AS
+# ROLLUP (cubo pre-aggregato per la dashboard): tabella -> dimensioni
+# Misure additive (revenue, freight_value, items) + misure a livello ordine
+# (orders, delivery_days_sum, delivered_orders), sommabili lungo stato/mese/giorno
+# perché ogni ordine ha un solo valore per queste dimensioni (non lungo la categoria)
+GOLD_ROLLUPS = {
+    "agg_sales_state": ["customer_state"],
+    "agg_sales_state_weekday": ["customer_state", "day_of_week"],
+    "agg_sales_state_month": ["customer_state", "year_month"],
+    "agg_sales_state_month_weekday": ["customer_state", "year_month", "day_of_week"],
+    "agg_sales_state_category": ["customer_state", "product_category_name"],
+    "agg_sales_cube": ["customer_state", "product_category_name", "year_month", "day_of_week"],
+}
+
+# Colonne a bassa cardinalità ereditate da Silver come ENUM (GROUP BY e join su interi piccoli)
+ENUM_COLUMNS = [
+    ("dim_customers", "customer_state"),
+    ("dim_products", "product_category_name"),
+    ("fact_orders", "customer_state"),
+]
+
+# CHIAVI SURROGATE (intere, stabili tra build: tech.tech_key_map)
+# Le join Gold (fact <-> dimensioni) avvengono su interi invece che su id esadecimali da 32 caratteri
+SURROGATE_KEYS = {
+    "customer": "customer_id",
+    "product": "product_id",
+}
+
+# DIM_CUSTOMERS
+DIM_CUSTOMERS_SELECT = """
+    SELECT
+        k.surrogate_key AS customer_key,
+        c.customer_id,
+        c.customer_city,
+        c.customer_state
+    FROM silver.customers c
+    JOIN tech.tech_key_map k ON k.entity = 'customer' AND k.natural_key = c.customer_id
+"""
+
+# DIM_PRODUCTS
+DIM_PRODUCTS_SELECT = """
+    SELECT
+        k.surrogate_key AS product_key,
+        p.product_id,
+        p.product_category_name
+    FROM silver.products p
+    JOIN tech.tech_key_map k ON k.entity = 'product' AND k.natural_key = p.product_id
+"""
+
+# DATE_KEY intero YYYYMMDD (fact -> dim_time), derivato dalla data: non serve una mappa
+def _date_key(date_expr: str) -> str:
+    return f"CAST(year({date_expr}) * 10000 + month({date_expr}) * 100 + day({date_expr}) AS INTEGER)"
+
+# DIM_TIME (DAILY GRAIN: 1 riga per giorno)
+def _dim_time_select(orders_relation: str) -> str:
+    return f"""
         WITH base AS (
             SELECT
                 CAST(order_purchase_timestamp AS DATE) AS order_date
-            FROM silver.orders
+            FROM {orders_relation}
             WHERE order_purchase_timestamp IS NOT NULL
         )
         SELECT DISTINCT
+            {_date_key('order_date')} AS date_key,
             order_date,
             EXTRACT(day FROM order_date) AS day,
             EXTRACT(month FROM order_date) AS month,
@@ -44,25 +114,469 @@ def build_olist_star_schema(db_path):
             EXTRACT(quarter FROM order_date) AS quarter,
             DAYNAME(order_date) AS day_of_week
         FROM base
-    """)
+    """
 
-    # FACT_SALES
-    # Unisco gli ordini agli articoli e calcolo i tempi di consegna
-    con.execute("""
-        CREATE OR REPLACE TABLE gold.fact_sales AS 
-        SELECT 
+# FACT_SALES
+# Unisco gli ordini agli articoli e calcolo i tempi di consegna
+# Solo chiavi intere verso le dimensioni (order_id resta come dimensione degenere)
+def _fact_sales_select(orders_relation: str) -> str:
+    return f"""
+        SELECT
             o.order_id,
-            o.customer_id,
-            oi.product_id,
+            ck.surrogate_key AS customer_key,
+            pk.surrogate_key AS product_key,
+            {_date_key('o.order_purchase_timestamp')} AS date_key,
             oi.price,
             oi.freight_value,
             o.order_purchase_timestamp,
             -- Calcolo del tempo di consegna in giorni
             date_diff('day', o.order_purchase_timestamp, o.order_delivered_customer_date) as delivery_time_days
-        FROM silver.orders o
+        FROM {orders_relation} o
         JOIN silver.order_items oi ON o.order_id = oi.order_id
+        LEFT JOIN tech.tech_key_map ck ON ck.entity = 'customer' AND ck.natural_key = o.customer_id
+        LEFT JOIN tech.tech_key_map pk ON pk.entity = 'product' AND pk.natural_key = oi.product_id
         WHERE o.order_status = 'delivered'
+    """
+
+# FACT_ORDERS (ORDER GRAIN: 1 riga per ordine)
+# KPI per ordine (fatturato, spedizione, giorni di consegna) senza riaggregare fact_sales
+def _fact_orders_select(order_filter: str = "") -> str:
+    return f"""
+        SELECT
+            f.order_id,
+            f.customer_key,
+            c.customer_state,
+            f.order_purchase_timestamp,
+            CAST(f.order_purchase_timestamp AS DATE) AS order_date,
+            f.date_key,
+            SUM(f.price) AS order_revenue,
+            SUM(f.freight_value) AS freight_value,
+            MAX(f.delivery_time_days) AS delivery_time_days,
+            COUNT(*) AS items
+        FROM gold.fact_sales f
+        JOIN gold.dim_customers c ON f.customer_key = c.customer_key
+        {order_filter}
+        GROUP BY ALL
+    """
+
+# ROLLUP: misure per ordine lette da fact_orders; per la categoria (grain item)
+# prima 1 riga per (dimensioni, ordine) da fact_sales, poi aggregazione alle dimensioni
+def _rollup_select(dims: list) -> str:
+    dims_sql = "".join(f"{d}, " for d in dims)
+    if "product_category_name" not in dims:
+        return f"""
+            SELECT
+                {dims_sql}
+                SUM(order_revenue) AS revenue,
+                SUM(freight_value) AS freight_value,
+                SUM(items) AS items,
+                COUNT(*) AS orders,
+                SUM(delivery_time_days) AS delivery_days_sum,
+                COUNT(delivery_time_days) AS delivered_orders
+            FROM (
+                SELECT
+                    *,
+                    strftime(order_purchase_timestamp, '%Y-%m') AS year_month,
+                    strftime(order_purchase_timestamp, '%A') AS day_of_week
+                FROM gold.fact_orders
+            ) o
+            GROUP BY ALL
+        """
+
+    return f"""
+        WITH items AS (
+            SELECT
+                f.*,
+                c.customer_state,
+                p.product_category_name,
+                strftime(f.order_purchase_timestamp, '%Y-%m') AS year_month,
+                strftime(f.order_purchase_timestamp, '%A') AS day_of_week
+            FROM gold.fact_sales f
+            JOIN gold.dim_customers c ON f.customer_key = c.customer_key
+            JOIN gold.dim_products p ON f.product_key = p.product_key
+        ),
+        per_order AS (
+            SELECT
+                {dims_sql}
+                order_id,
+                SUM(price) AS revenue,
+                SUM(freight_value) AS freight_value,
+                COUNT(*) AS items,
+                MAX(delivery_time_days) AS delivery_days
+            FROM items
+            GROUP BY {dims_sql} order_id
+        )
+        SELECT
+            {dims_sql}
+            SUM(revenue) AS revenue,
+            SUM(freight_value) AS freight_value,
+            SUM(items) AS items,
+            COUNT(*) AS orders,
+            SUM(delivery_days) AS delivery_days_sum,
+            COUNT(delivery_days) AS delivered_orders
+        FROM per_order
+        GROUP BY ALL
+    """
+
+
+# -----------------------------
+# Layout fisico: ordinamento, indici ART, statistiche dei row group
+# -----------------------------
+def _clustered(table: str, select_sql: str) -> str:
+    return f"SELECT * FROM ({select_sql}) ORDER BY {FACT_SORT_KEYS[table]}"
+
+def _recluster(con: duckdb.DuckDBPyConnection, table: str):
+    # Riscrive la fact in ordine (gli indici della tabella sostituita vanno ricreati)
+    con.execute(f"CREATE OR REPLACE TABLE gold.{table} AS {_clustered(table, f'SELECT * FROM gold.{table}')}")
+
+def _create_indexes(con: duckdb.DuckDBPyConnection):
+    # IF NOT EXISTS: ricrea solo gli indici persi con un CREATE OR REPLACE
+    for table, columns in GOLD_INDEXES.items():
+        for column in columns:
+            con.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON gold.{table} ({column})")
+
+def _record_rowgroup_stats(con: duckdb.DuckDBPyConnection):
+    # Min/max per row group dai metadati di storage (nessuna scansione dei dati)
+    ensure_rowgroup_stats_table(con)
+    recorded_at = utc_now_iso()
+    for table, columns in ROWGROUP_STATS_COLUMNS.items():
+        con.execute("DELETE FROM tech.tech_gold_rowgroups WHERE table_name = ?", [table])
+        con.execute(f"""
+            INSERT INTO tech.tech_gold_rowgroups
+            SELECT
+                ? AS table_name,
+                column_name,
+                row_group_id,
+                SUM(count) AS rows,
+                -- stats: "[Min: <v>, Max: <v>(, Has Unicode: ...)][Has Null: ...]" per segmento
+                MIN(split_part(split_part(stats, 'Min: ', 2), ', Max: ', 1)) AS min_value,
+                MAX(split_part(split_part(split_part(stats, 'Max: ', 2), ']', 1), ', Has ', 1)) AS max_value,
+                CAST(? AS TIMESTAMP) AS recorded_at
+            FROM pragma_storage_info('gold.{table}')
+            WHERE column_name IN (SELECT UNNEST(?::VARCHAR[]))
+              AND segment_type <> 'VALIDITY'
+            GROUP BY column_name, row_group_id
+        """, [table, recorded_at, columns])
+        groups = con.execute(
+            "SELECT COUNT(DISTINCT row_group_id) FROM tech.tech_gold_rowgroups WHERE table_name = ?", [table]
+        ).fetchone()[0]
+        print(f"Gold: {table} | row group={groups} | statistiche in tech.tech_gold_rowgroups")
+
+
+# -----------------------------
+# Rollup + catalogo per il router della dashboard
+# -----------------------------
+def _build_rollups(con: duckdb.DuckDBPyConnection):
+    # Ricalcolati dalla fact a ogni build che modifica Gold: piccoli rispetto alla fact
+    con.execute("""
+        CREATE OR REPLACE TABLE gold.rollup_catalog (
+            table_name      VARCHAR,
+            dims            VARCHAR[],
+            rows            BIGINT
+        )
     """)
+    for table, dims in GOLD_ROLLUPS.items():
+        con.execute(f"CREATE OR REPLACE TABLE gold.{table} AS {_rollup_select(dims)}")
+        rows = con.execute(f"SELECT COUNT(*) FROM gold.{table}").fetchone()[0]
+        con.execute("INSERT INTO gold.rollup_catalog VALUES (?, ?, ?)", [f"gold.{table}", dims, rows])
+    print(f"Gold: rollup ricostruiti ({', '.join(GOLD_ROLLUPS)})")
+
+def _rollups_outdated(con: duckdb.DuckDBPyConnection) -> bool:
+    # Catalogo assente o diverso da GOLD_ROLLUPS (Gold costruito con una versione precedente)
+    if not table_exists(con, "gold", "rollup_catalog"):
+        return True
+    built = {r[0] for r in con.execute("SELECT table_name FROM gold.rollup_catalog").fetchall()}
+    return built != {f"gold.{t}" for t in GOLD_ROLLUPS}
+
+
+# -----------------------------
+# Full rebuild
+# -----------------------------
+# Tabella Gold -> tabella Silver il cui watermark diventa quello Gold (NULL in Phase 1)
+GOLD_WATERMARK_SOURCES = {
+    "dim_customers": "customers",
+    "dim_products": "products",
+    "dim_time": "orders",
+    "fact_sales": "orders",
+    "fact_orders": "orders",
+}
+
+def _assign_gold_keys(con: duckdb.DuckDBPyConnection):
+    # La mappa delle chiavi non viene mai ricostruita: le chiavi restano quelle già assegnate.
+    # Chiavi anche per id presenti solo negli ordini (anagrafica non ancora arrivata)
+    for entity, column in SURROGATE_KEYS.items():
+        assign_surrogate_keys(con, entity, f"SELECT {column} FROM silver.{entity}s")
+    assign_surrogate_keys(con, "customer", "SELECT customer_id FROM silver.orders")
+    assign_surrogate_keys(con, "product", "SELECT product_id FROM silver.order_items")
+
+def _gold_select(table: str) -> str:
+    return {
+        "dim_customers": DIM_CUSTOMERS_SELECT,
+        "dim_products": DIM_PRODUCTS_SELECT,
+        "dim_time": _dim_time_select("silver.orders"),
+        "fact_sales": _clustered("fact_sales", _fact_sales_select("silver.orders")),
+        "fact_orders": _clustered("fact_orders", _fact_orders_select()),
+    }[table]
+
+def _rebuild_table(con: duckdb.DuckDBPyConnection, table: str):
+    con.execute(f"CREATE OR REPLACE TABLE gold.{table} AS {_gold_select(table)}")
+    rows = con.execute(f"SELECT COUNT(*) FROM gold.{table}").fetchone()[0]
+    watermark = get_watermark(con, "silver", GOLD_WATERMARK_SOURCES[table])
+    set_watermark(con, "gold", table, watermark, rows_merged=rows, mode="FULL")
+
+
+# -----------------------------
+# Build incrementale
+# -----------------------------
+def _silver_rebuilt_since_last_build(con: duckdb.DuckDBPyConnection) -> bool:
+    # Un full rebuild Silver successivo all'ultimo build Gold invalida il delta
+    row = con.execute("""
+        SELECT 1
+        FROM tech.tech_layer_watermarks s, tech.tech_layer_watermarks g
+        WHERE s.layer = 'silver' AND s.mode = 'FULL'
+          AND g.layer = 'gold' AND g.table_name = 'fact_sales'
+          AND s.updated_at > g.updated_at
+        LIMIT 1
+    """).fetchone()
+    return row is not None
+
+def _can_run_incremental(con: duckdb.DuckDBPyConnection) -> bool:
+    if not table_exists(con, "tech", "tech_processed_files"):
+        return False
+    for table in GOLD_TABLES:
+        if not table_exists(con, "gold", table):
+            return False
+        if get_watermark(con, "gold", table) is None:
+            return False
+    # Gold costruito prima delle chiavi surrogate: serve un full rebuild
+    if not column_exists(con, "gold", "fact_sales", "customer_key"):
+        print("Gold: fact_sales senza chiavi surrogate, full rebuild")
+        return False
+    # Gold costruito da Silver ancora VARCHAR: le colonne ENUM arrivano con il full rebuild
+    for table, column in ENUM_COLUMNS:
+        if not column_type(con, "gold", table, column).startswith("ENUM"):
+            print(f"Gold: {table}.{column} non è ENUM, full rebuild")
+            return False
+    return not _silver_rebuilt_since_last_build(con)
+
+def _build_facts_incremental(con: duckdb.DuckDBPyConnection) -> bool:
+    watermark = get_watermark(con, "gold", "fact_sales")
+    # Solo i mesi già consolidati in Silver (watermark Silver come limite superiore)
+    months, new_watermark = changed_order_months(con, watermark, until=get_watermark(con, "silver", "orders"))
+    if not months:
+        set_watermark(con, "gold", "fact_sales", watermark, rows_merged=0, mode="SKIP")
+        set_watermark(con, "gold", "dim_time", watermark, rows_merged=0, mode="SKIP")
+        set_watermark(con, "gold", "fact_orders", watermark, rows_merged=0, mode="SKIP")
+        print("Gold: fact_sales/fact_orders/dim_time invariate (nessun nuovo mese in Silver)")
+        return False
+
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE _gold_delta_orders AS
+        SELECT *
+        FROM silver.orders o
+        WHERE o.order_purchase_timestamp >= CAST(? || '-01' AS TIMESTAMP)
+          AND o.order_purchase_timestamp < CAST(? || '-01' AS TIMESTAMP) + INTERVAL 1 MONTH
+          AND strftime(o.order_purchase_timestamp, '%Y-%m') IN (SELECT UNNEST(?::VARCHAR[]))
+    """, [months[0], months[-1], months])
+
+    # Delta in coda alle fact: l'ordinamento resta valido solo se il delta non precede
+    # righe già presenti (mese riconsegnato / dati tardivi) -> altrimenti riordino completo.
+    # Righe esistenti dal primo mese del delta in poi, fuori dai mesi del delta: fact_sales
+    # è ordinata per data, il range legge solo i row group di coda (zone map)
+    out_of_order = con.execute("""
+        SELECT EXISTS (
+            SELECT 1
+            FROM gold.fact_sales f
+            WHERE f.order_purchase_timestamp >= CAST(? || '-01' AS TIMESTAMP)
+              AND strftime(f.order_purchase_timestamp, '%Y-%m') NOT IN (SELECT UNNEST(?::VARCHAR[]))
+        )
+    """, [months[0], months]).fetchone()[0]
+
+    # Upsert per order_id + solo le date mancanti in dim_time, in un'unica transazione
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute("DELETE FROM gold.fact_sales WHERE order_id IN (SELECT order_id FROM _gold_delta_orders)")
+        con.execute(f"INSERT INTO gold.fact_sales {_clustered('fact_sales', _fact_sales_select('_gold_delta_orders'))}")
+        con.execute("DELETE FROM gold.fact_orders WHERE order_id IN (SELECT order_id FROM _gold_delta_orders)")
+        con.execute(f"""
+            INSERT INTO gold.fact_orders
+            {_clustered('fact_orders', _fact_orders_select('WHERE f.order_id IN (SELECT order_id FROM _gold_delta_orders)'))}
+        """)
+        if out_of_order:
+            for table in FACT_SORT_KEYS:
+                _recluster(con, table)
+            print("Gold: delta precedente a righe esistenti, fact riordinate")
+        con.execute(f"""
+            INSERT INTO gold.dim_time
+            SELECT *
+            FROM ({_dim_time_select('_gold_delta_orders')}) d
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM gold.dim_time t
+                WHERE t.order_date = d.order_date
+            )
+        """)
+
+        facts_merged = con.execute(f"SELECT COUNT(*) FROM ({_fact_sales_select('_gold_delta_orders')})").fetchone()[0]
+        orders_merged = con.execute("""
+            SELECT COUNT(*) FROM gold.fact_orders WHERE order_id IN (SELECT order_id FROM _gold_delta_orders)
+        """).fetchone()[0]
+        dates_total = con.execute("SELECT COUNT(*) FROM gold.dim_time").fetchone()[0]
+        set_watermark(con, "gold", "fact_sales", new_watermark, rows_merged=facts_merged, mode="INCREMENTAL")
+        set_watermark(con, "gold", "fact_orders", new_watermark, rows_merged=orders_merged, mode="INCREMENTAL")
+        set_watermark(con, "gold", "dim_time", new_watermark, rows_merged=dates_total, mode="INCREMENTAL")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    print(
+        f"Gold: merge mesi {', '.join(months)} | fact_sales={facts_merged} | "
+        f"fact_orders={orders_merged} | dim_time={dates_total}"
+    )
+    return True
+
+def _build_dimension_incremental(con: duckdb.DuckDBPyConnection, gold_table: str, silver_table: str, select_sql: str) -> bool:
+    watermark = get_watermark(con, "gold", gold_table)
+    changed = [
+        ts for fn, ts in changed_files_since(con, watermark, until=get_watermark(con, "silver", silver_table))
+        if fn == DIMENSION_SOURCES[silver_table]
+    ]
+    if not changed:
+        set_watermark(con, "gold", gold_table, watermark, rows_merged=0, mode="SKIP")
+        return False
+
+    con.execute(f"CREATE OR REPLACE TABLE gold.{gold_table} AS {select_sql}")
+    rows = con.execute(f"SELECT COUNT(*) FROM gold.{gold_table}").fetchone()[0]
+    set_watermark(con, "gold", gold_table, max(changed), rows_merged=rows, mode="INCREMENTAL")
+    print(f"Gold: {gold_table} ricostruita (rows={rows})")
+    return True
+
+
+def _build_customers_incremental(con: duckdb.DuckDBPyConnection):
+    # fact_orders denormalizza lo stato del cliente: se dim_customers cambia va ricalcolata
+    if _build_dimension_incremental(con, "dim_customers", "customers", DIM_CUSTOMERS_SELECT):
+        con.execute(f"CREATE OR REPLACE TABLE gold.fact_orders AS {_gold_select('fact_orders')}")
+        print("Gold: fact_orders ricostruita (dim_customers cambiata)")
+
+def _changed_since_last_version(con: duckdb.DuckDBPyConnection) -> bool:
+    # Step che hanno modificato Gold dopo l'ultima versione pubblicata (questo build o uno interrotto)
+    row = con.execute("""
+        SELECT 1
+        FROM tech.tech_layer_watermarks
+        WHERE layer = 'gold' AND mode <> 'SKIP'
+          AND updated_at > (SELECT COALESCE(MAX(built_at), TIMESTAMP '-infinity') FROM tech.tech_gold_versions)
+        LIMIT 1
+    """).fetchone()
+    return row is not None
+
+
+# -----------------------------
+# Step per tabella (eseguibili in parallelo dai flow)
+# -----------------------------
+KEY_MAP = "tech.tech_key_map"
+SILVER_SOURCES = {"silver.orders", "silver.order_items", "silver.customers", "silver.products"}
+
+# Step: nome -> (funzione, tabelle lette, tabelle scritte); ogni step aggiorna anche
+# le proprie righe di tech.tech_layer_watermarks
+GOLD_FULL_STEPS = {
+    "keys": (_assign_gold_keys, SILVER_SOURCES, {KEY_MAP}),
+    "dim_customers": (lambda con: _rebuild_table(con, "dim_customers"), {"silver.customers", KEY_MAP}, {"gold.dim_customers"}),
+    "dim_products": (lambda con: _rebuild_table(con, "dim_products"), {"silver.products", KEY_MAP}, {"gold.dim_products"}),
+    "dim_time": (lambda con: _rebuild_table(con, "dim_time"), {"silver.orders"}, {"gold.dim_time"}),
+    "fact_sales": (lambda con: _rebuild_table(con, "fact_sales"), {"silver.orders", "silver.order_items", KEY_MAP}, {"gold.fact_sales"}),
+    "fact_orders": (lambda con: _rebuild_table(con, "fact_orders"), {"gold.fact_sales", "gold.dim_customers"}, {"gold.fact_orders"}),
+}
+GOLD_INCREMENTAL_STEPS = {
+    "keys": GOLD_FULL_STEPS["keys"],
+    "dim_customers": (
+        _build_customers_incremental,
+        {"silver.customers", "tech.tech_processed_files", KEY_MAP, "gold.fact_sales"},
+        {"gold.dim_customers", "gold.fact_orders"},
+    ),
+    "dim_products": (
+        lambda con: _build_dimension_incremental(con, "dim_products", "products", DIM_PRODUCTS_SELECT),
+        {"silver.products", "tech.tech_processed_files", KEY_MAP},
+        {"gold.dim_products"},
+    ),
+    # fact_sales, fact_orders e dim_time nella stessa transazione di upsert
+    "facts": (
+        _build_facts_incremental,
+        {"silver.orders", "silver.order_items", "tech.tech_processed_files", KEY_MAP, "gold.dim_customers"},
+        {"gold.fact_sales", "gold.fact_orders", "gold.dim_time"},
+    ),
+}
+
+
+@task(name="Gold Step", task_run_name="gold-{name}")
+def gold_step(db_path, name: str, incremental: bool = False):
+    func, reads, writes = (GOLD_INCREMENTAL_STEPS if incremental else GOLD_FULL_STEPS)[name]
+    with metered_step(db_path, "gold", name, reads, writes) as con:
+        func(con)
+
+
+@task(name="Finalize Gold")
+def finalize_gold(db_path, mode: str):
+    gold = {f"gold.{table}" for table in GOLD_TABLES}
+    with metered_step(db_path, "gold", "finalize", gold, gold) as con:
+        if mode == "FULL":
+            print("Gold: full rebuild completato")
+
+        # Indici persi con un CREATE OR REPLACE (o Gold costruito prima degli indici)
+        _create_indexes(con)
+
+        # Rollup mancanti o non aggiornati: vanno creati anche senza nuovi dati
+        if mode == "FULL" or _changed_since_last_version(con) or _rollups_outdated(con):
+            _record_rowgroup_stats(con)
+            _build_rollups(con)
+            version = publish_gold_version(con, mode)
+            print(f"Gold: pubblicata versione {version} ({mode})")
+
+        return "Layer Gold costruito con successo"
+
+
+def gold_steps(db_path, incremental: bool = False) -> list:
+    """Prepara schema e tabelle tecniche, sceglie full/incrementale e ritorna gli step Gold."""
+    con = duckdb.connect(db_path)
+    try:
+        con.execute("CREATE SCHEMA IF NOT EXISTS gold")
+        ensure_watermark_table(con)
+        ensure_key_map_table(con)
+        ensure_gold_version_table(con)
+        ensure_rowgroup_stats_table(con)
+        ensure_run_metrics_table(con)
+        print("Costruzione Layer Gold: Fact e Dimension tables")
+        incremental = incremental and _can_run_incremental(con)
+    finally:
+        con.close()
+
+    steps = [
+        step(gold_step, {"db_path": db_path, "name": name, "incremental": incremental}, reads, writes)
+        for name, (_, reads, writes) in (GOLD_INCREMENTAL_STEPS if incremental else GOLD_FULL_STEPS).items()
+    ]
+    # Indici, statistiche, rollup e versione: dopo tutti gli step
+    gold = {f"gold.{table}" for table in GOLD_TABLES}
+    steps.append(step(finalize_gold, {"db_path": db_path, "mode": "INCREMENTAL" if incremental else "FULL"},
+                      reads=gold, writes=gold | {"gold.rollups", "tech.tech_gold_versions"}))
+    return steps
+
+
+@task(name="Build Olist Star Schema (Gold)")
+def build_olist_star_schema(db_path, incremental: bool = False):
+    """
+    Silver -> Gold (Star Schema).
+
+    - incremental=False: ricostruzione completa di fact (item e ordine) e dimension tables.
+    - incremental=True: upsert in fact_sales/fact_orders dei soli ordini dei mesi consolidati in Silver
+      dopo il watermark Gold, aggiunta delle sole date mancanti in dim_time e ricostruzione
+      delle dimensioni solo se cambiate. Rieseguire con lo stesso watermark non modifica nulla.
+      Fallback al full rebuild se Gold non esiste, manca il watermark o Silver è stato
+      ricostruito da zero dopo l'ultimo build.
+
+    Ogni build che modifica Gold ricalcola i rollup (GOLD_ROLLUPS, gold.rollup_catalog) e
+    pubblica una nuova versione in tech.tech_gold_versions (usata dalla dashboard per
+    invalidare la cache dei risultati).
 
-    con.close()
-    return "Layer Gold costruito con successo"
\ No newline at end of file
+    Esegue in sequenza gli step di gold_steps (i flow li lanciano in parallelo).
+    """
+    return run_steps(gold_steps(db_path, incremental))[-1]
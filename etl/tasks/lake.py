@@ -0,0 +1,195 @@
+import duckdb
+import json
+import os
+import shutil
+from prefect import task
+
+from etl import profiling
+from etl.utils import utc_now_iso
+
+# Lake Parquet (lettura diretta per notebook/consumer, senza lock sul file DuckDB)
+LAKE_DIR = os.getenv("LAKE_DIR", "data/lake")
+LAKE_EXPORT_SILVER = os.getenv("LAKE_EXPORT_SILVER", "0") == "1"
+# Row group piccoli rispetto al default DuckDB (122880): più granularità per il pruning
+# sulle statistiche min/max dentro una partizione mensile
+LAKE_ROW_GROUP_SIZE = int(os.getenv("LAKE_ROW_GROUP_SIZE", "16384"))
+LAKE_COMPRESSION = "zstd"
+
+MANIFEST_NAME = "_manifest.json"
+# Righe senza data (es. ordini Silver senza data d'acquisto): partizione hive di default,
+# letta con year/month NULL da read_parquet(hive_partitioning = true)
+NULL_PARTITION = "year=__HIVE_DEFAULT_PARTITION__/month=__HIVE_DEFAULT_PARTITION__"
+
+# Tabelle esportate: nome -> (SELECT sorgente, colonna data per year=/month= o None, ordinamento)
+# - fatti partizionati per mese d'acquisto, ordinati per la colonna filtrata più spesso
+# - dimensioni e rollup piccoli: un file unico
+GOLD_EXPORTS = {
+    "fact_sales": ("SELECT * FROM gold.fact_sales", "order_purchase_timestamp", "order_purchase_timestamp, order_id"),
+    "fact_orders": ("SELECT * FROM gold.fact_orders", "order_purchase_timestamp", "customer_state, order_purchase_timestamp"),
+    "dim_customers": ("SELECT * FROM gold.dim_customers", None, "customer_state, customer_id"),
+    "dim_products": ("SELECT * FROM gold.dim_products", None, "product_id"),
+    "dim_time": ("SELECT * FROM gold.dim_time", None, "order_date"),
+    "agg_sales_state": ("SELECT * FROM gold.agg_sales_state", None, "customer_state"),
+    "agg_sales_state_weekday": ("SELECT * FROM gold.agg_sales_state_weekday", None, "customer_state"),
+    "agg_sales_state_month": ("SELECT * FROM gold.agg_sales_state_month", None, "year_month, customer_state"),
+    "agg_sales_state_month_weekday": ("SELECT * FROM gold.agg_sales_state_month_weekday", None, "year_month, customer_state"),
+    "agg_sales_state_category": ("SELECT * FROM gold.agg_sales_state_category", None, "customer_state"),
+    "agg_sales_cube": ("SELECT * FROM gold.agg_sales_cube", None, "year_month, customer_state"),
+    "rollup_catalog": ("SELECT * FROM gold.rollup_catalog", None, "rows"),
+}
+
+SILVER_EXPORTS = {
+    "orders": ("SELECT * FROM silver.orders", "order_purchase_timestamp", "order_purchase_timestamp, order_id"),
+    # Articoli partizionati con il mese dell'ordine (in Silver non hanno una data propria)
+    "order_items": ("""
+        SELECT oi.*, o.order_purchase_timestamp AS _order_ts
+        FROM silver.order_items oi
+        JOIN silver.orders o ON oi.order_id = o.order_id
+    """, "_order_ts", "order_id, order_item_id"),
+}
+
+
+# -----------------------------
+# Manifest e fingerprint
+# -----------------------------
+def _read_manifest(layer_dir: str) -> dict:
+    path = os.path.join(layer_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _write_manifest(layer_dir: str, manifest: dict):
+    path = os.path.join(layer_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def _hashed_columns(con: duckdb.DuckDBPyConnection, select_sql: str) -> str:
+    # hash() di un ENUM usa l'indice interno del valore, che cambia quando il tipo si
+    # allarga (nuovo customer_state, ...): nell'impronta gli ENUM entrano come testo
+    columns = con.execute(f"DESCRIBE {select_sql}").fetchall()
+    return ", ".join(
+        f'CAST("{name}" AS VARCHAR) AS "{name}"' if column_type.startswith("ENUM") else f'"{name}"'
+        for name, column_type, *_ in columns
+    )
+
+def _fingerprints(con: duckdb.DuckDBPyConnection, select_sql: str, date_col: str) -> dict:
+    # Impronta indipendente dall'ordine delle righe: COUNT + somma degli hash di riga, per partizione
+    partition = (
+        f"COALESCE(strftime({date_col}, 'year=%Y/month=') || CAST(month({date_col}) AS VARCHAR), '{NULL_PARTITION}')"
+        if date_col else "''"
+    )
+    rows = con.execute(f"""
+        WITH src AS (SELECT {_hashed_columns(con, select_sql)} FROM ({select_sql}))
+        SELECT {partition} AS part, COUNT(*), CAST(SUM(CAST(hash(src) AS HUGEINT)) AS VARCHAR)
+        FROM src
+        GROUP BY ALL
+    """).fetchall()
+    profiling.record(con, "etl", "lake/export")
+    return {part: {"rows": n, "fingerprint": fp} for part, n, fp in rows}
+
+
+# -----------------------------
+# Scrittura
+# -----------------------------
+def _copy_parquet(con: duckdb.DuckDBPyConnection, select_sql: str, path: str):
+    # Scrittura su file temporaneo + rename: un lettore non vede mai un file a metà
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    con.execute(f"""
+        COPY ({select_sql}) TO '{path}.tmp'
+        (FORMAT parquet, COMPRESSION {LAKE_COMPRESSION}, ROW_GROUP_SIZE {LAKE_ROW_GROUP_SIZE})
+    """)
+    profiling.record(con, "etl", "lake/export")
+    os.replace(f"{path}.tmp", path)
+
+def _export_table(con, layer_dir: str, table: str, spec: tuple, previous: dict) -> dict:
+    select_sql, date_col, order_by = spec
+    current = _fingerprints(con, select_sql, date_col)
+
+    if date_col is None:
+        path = os.path.join(layer_dir, f"{table}.parquet")
+        if current.get("") != previous.get("") or not os.path.exists(path):
+            _copy_parquet(con, f"SELECT * FROM ({select_sql}) ORDER BY {order_by}", path)
+            print(f"Lake: {table} riscritta ({current.get('', {}).get('rows', 0)} righe)")
+        return current
+
+    # Tabelle partizionate: si riscrivono solo le partizioni con impronta diversa
+    table_dir = os.path.join(layer_dir, table)
+    rewritten = 0
+    for part, stats in sorted(current.items()):
+        path = os.path.join(table_dir, part, "data.parquet")
+        if stats == previous.get(part) and os.path.exists(path):
+            continue
+        if part == NULL_PARTITION:
+            where = f"{date_col} IS NULL"
+        else:
+            # Range sulla data (zone map) invece di year()/month()
+            year, month = (int(kv.split("=")[1]) for kv in part.split("/"))
+            where = (
+                f"{date_col} >= DATE '{year:04d}-{month:02d}-01' "
+                f"AND {date_col} < DATE '{year:04d}-{month:02d}-01' + INTERVAL 1 MONTH"
+            )
+        # Colonne helper "_" escluse
+        columns = f"* EXCLUDE ({date_col})" if date_col.startswith("_") else "*"
+        _copy_parquet(con, f"""
+            SELECT {columns}
+            FROM ({select_sql})
+            WHERE {where}
+            ORDER BY {order_by}
+        """, path)
+        rewritten += 1
+
+    # Partizioni sparite dalla sorgente
+    removed = [part for part in previous if part not in current]
+    for part in removed:
+        shutil.rmtree(os.path.join(table_dir, part), ignore_errors=True)
+
+    print(f"Lake: {table} | partizioni={len(current)} | riscritte={rewritten} | rimosse={len(removed)}")
+    return current
+
+def _export_layer(con, layer: str, exports: dict, version=None):
+    layer_dir = os.path.join(LAKE_DIR, layer)
+    os.makedirs(layer_dir, exist_ok=True)
+    manifest = _read_manifest(layer_dir)
+
+    # Gold invariato dall'ultimo export (stessa versione pubblicata): niente da fare
+    if version is not None and manifest.get("version") == version and set(manifest.get("tables", {})) == set(exports):
+        print(f"Lake: {layer} già allineato alla versione {version}")
+        return
+
+    tables = {}
+    for table, spec in exports.items():
+        tables[table] = _export_table(con, layer_dir, table, spec, manifest.get("tables", {}).get(table, {}))
+
+    _write_manifest(layer_dir, {
+        "version": version,
+        "exported_at": utc_now_iso(),
+        "partitioning": "year=/month=",
+        "tables": tables,
+    })
+
+
+@task(name="Export Lake (Parquet)")
+def export_lake(db_path, include_silver: bool = LAKE_EXPORT_SILVER):
+    """
+    Gold (e opzionalmente Silver) -> Parquet in LAKE_DIR.
+
+    - fatti partizionati hive year=/month= sulla data d'acquisto, dimensioni e rollup in un file
+    - zstd, row group da LAKE_ROW_GROUP_SIZE righe, righe ordinate per le colonne filtrate
+    - riscritte solo le partizioni la cui impronta (righe + hash) è cambiata rispetto a
+      <layer>/_manifest.json; il manifest riporta anche la versione Gold esportata
+    """
+    con = duckdb.connect(db_path, read_only=True)
+    try:
+        profiling.enable(con)
+        try:
+            version = con.execute("SELECT MAX(version) FROM tech.tech_gold_versions").fetchone()[0]
+        except duckdb.CatalogException:
+            version = None
+        _export_layer(con, "gold", GOLD_EXPORTS, version)
+        if include_silver:
+            _export_layer(con, "silver", SILVER_EXPORTS)
+        return "Lake Parquet aggiornato"
+    finally:
+        con.close()
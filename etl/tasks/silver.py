@@ -2,13 +2,33 @@ import duckdb
 import pandera.pandas as pa
 from prefect import task
 
+from etl.metrics import metered_step
+from etl.scheduling import run_steps, step
+from etl.utils import (
+    changed_files_since,
+    changed_order_months,
+    column_type,
+    ensure_run_metrics_table,
+    ensure_watermark_table,
+    get_watermark,
+    latest_processed_at,
+    rows_appended_since,
+    set_watermark,
+    table_exists,
+)
+from etl.validation import validate_in_duckdb
+
+# Stati ordine ammessi: dominio fisso del tipo ENUM silver.order_status_t
+ORDER_STATUSES = [
+    'delivered', 'shipped', 'canceled', 'invoiced',
+    'processing', 'approved', 'unavailable', 'created'
+]
+
 # --- DEFINIZIONE SCHEMI DI VALIDAZIONE ---
 # Controllo colonne stringa con valori predefiniti (stati ordine)
+# Con il tipo ENUM un valore fuori lista fa già fallire il cast: il check resta come documentazione
 orders_schema = pa.DataFrameSchema({
-    "order_status": pa.Column(str, pa.Check.isin([
-        'delivered', 'shipped', 'canceled', 'invoiced', 
-        'processing', 'approved', 'unavailable', 'created'
-    ]))
+    "order_status": pa.Column(str, pa.Check.isin(ORDER_STATUSES))
 })
 
 # Controllo colonne numeriche (prezzi >= 0) e ID non nulli
@@ -18,50 +38,350 @@ order_items_schema = pa.DataFrameSchema({
     "order_id": pa.Column(str, nullable=False)
 })
 
-@task(name="Clean Olist Data (Silver)")
-def clean_olist_data(db_path):
-    con = duckdb.connect(db_path)
+# --- TIPI ENUM (colonne a bassa cardinalità) ---
+# Tipo -> (tabella Bronze, colonna) da cui derivare i valori; i tipi vengono estesi
+# (mai ridotti) quando nei dump compaiono valori nuovi
+ENUM_SOURCES = {
+    "customer_state_t": ("customers", "customer_state"),
+    "customer_city_t": ("customers", "customer_city"),
+    "product_category_t": ("products", "product_category_name"),
+}
+# Colonne Silver tipizzate: (tabella, colonna) -> tipo
+ENUM_COLUMNS = {
+    ("orders", "order_status"): "order_status_t",
+    ("customers", "customer_state"): "customer_state_t",
+    ("customers", "customer_city"): "customer_city_t",
+    ("products", "product_category_name"): "product_category_t",
+}
+
+# --- SELECT DI PULIZIA (condivise tra full rebuild e merge incrementale) ---
+# 1. Pulizia ordini: conversione date da stringa a TIMESTAMP
+ORDERS_SELECT = """
+    SELECT
+        order_id,
+        customer_id,
+        CAST(order_status AS silver.order_status_t) AS order_status,
+        CAST(order_purchase_timestamp AS TIMESTAMP) as order_purchase_timestamp,
+        CAST(order_delivered_customer_date AS TIMESTAMP) as order_delivered_customer_date,
+        CAST(order_estimated_delivery_date AS TIMESTAMP) as order_estimated_delivery_date
+    FROM bronze.orders
+    WHERE order_id IS NOT NULL
+"""
+
+# 2. Pulizia articoli: prezzi come float
+ORDER_ITEMS_SELECT = """
+    SELECT
+        order_id,
+        order_item_id,
+        product_id,
+        seller_id,
+        CAST(price AS DOUBLE) as price,
+        CAST(freight_value AS DOUBLE) as freight_value
+    FROM bronze.order_items
+"""
+
+# 3. Anagrafiche: copia del dump Bronze con le colonne a bassa cardinalità come ENUM
+CUSTOMERS_SELECT = """
+    SELECT * REPLACE (
+        CAST(customer_city AS silver.customer_city_t) AS customer_city,
+        CAST(customer_state AS silver.customer_state_t) AS customer_state
+    )
+    FROM bronze.customers
+"""
+
+PRODUCTS_SELECT = """
+    SELECT * REPLACE (
+        CAST(product_category_name AS silver.product_category_t) AS product_category_name
+    )
+    FROM bronze.products
+"""
+
+# File della landing zone (loggati in tech.tech_processed_files) da cui dipende ogni tabella Silver
+DIMENSION_SOURCES = {
+    "products": "olist_products_dataset.parquet",
+    "customers": "olist_customers_dataset.parquet",
+}
+SILVER_TABLES = ["orders", "order_items", "products", "customers"]
+DIMENSION_SELECTS = {
+    "products": PRODUCTS_SELECT,
+    "customers": CUSTOMERS_SELECT,
+}
+
+
+# -----------------------------
+# Tipi ENUM
+# -----------------------------
+def _enum_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def _sync_enum_type(con: duckdb.DuckDBPyConnection, type_name: str, values: list) -> bool:
+    # Valori già nel tipo + valori nuovi, in ordine alfabetico (ORDER BY come su VARCHAR)
+    exists = con.execute("""
+        SELECT 1 FROM duckdb_types() WHERE schema_name = 'silver' AND type_name = ?
+    """, [type_name]).fetchone()
+    current = con.execute(f"SELECT enum_range(NULL::silver.{type_name})").fetchone()[0] if exists else None
+    merged = sorted(set(current or []) | set(values))
+    if merged == current:
+        return False
+    con.execute(f"CREATE OR REPLACE TYPE silver.{type_name} AS ENUM ({', '.join(map(_enum_literal, merged))})")
+    added = len(merged) - len(current or [])
+    print(f"Silver: tipo {type_name} {'esteso' if current is not None else 'creato'} (+{added} valori, totale {len(merged)})")
+    return True
+
+def _sync_enum_types(con: duckdb.DuckDBPyConnection):
+    _sync_enum_type(con, "order_status_t", ORDER_STATUSES)
+    for type_name, (table, column) in ENUM_SOURCES.items():
+        values = [r[0] for r in con.execute(f"SELECT DISTINCT {column} FROM bronze.{table} WHERE {column} IS NOT NULL").fetchall()]
+        _sync_enum_type(con, type_name, values)
+
+def _align_enum_columns(con: duckdb.DuckDBPyConnection):
+    # Colonne non ancora (o non più) del tipo corrente: Silver VARCHAR di run precedenti
+    # o tabelle non ricaricate dopo un'estensione del tipo
+    for (table, column), type_name in ENUM_COLUMNS.items():
+        expected = con.execute(f"SELECT CAST(NULL AS silver.{type_name})").description[0][1]
+        if column_type(con, "silver", table, column) != str(expected):
+            con.execute(f"ALTER TABLE silver.{table} ALTER COLUMN {column} TYPE silver.{type_name}")
+            print(f"Silver: {table}.{column} convertita in silver.{type_name}")
+
+
+# -----------------------------
+# Validazioni
+# -----------------------------
+# Gli schemi Pandera sono compilati in SQL ed eseguiti dentro DuckDB (un'unica
+# query aggregata): se un check fallisce viene sollevato SchemaErrors e il task si blocca qui
+def _validate_orders(con: duckdb.DuckDBPyConnection, relation: str):
+    validate_in_duckdb(con, orders_schema, relation)
+
+def _validate_order_items(con: duckdb.DuckDBPyConnection, relation: str, orders_relation: str):
+    # Vincolo referenziale: ogni articolo deve appartenere a un ordine Silver
+    validate_in_duckdb(con, order_items_schema, relation, references={"order_id": (orders_relation, "order_id")})
+
+
+# -----------------------------
+# Full rebuild
+# -----------------------------
+def _set_full_watermark(con: duckdb.DuckDBPyConnection, table: str):
+    # Il watermark è lo stato di tech.tech_processed_files appena copiato (NULL in Phase 1)
+    rows = con.execute(f"SELECT COUNT(*) FROM silver.{table}").fetchone()[0]
+    set_watermark(con, "silver", table, latest_processed_at(con), rows_merged=rows, mode="FULL")
+
+def _rebuild_orders(con: duckdb.DuckDBPyConnection):
+    # TABELLA ORDERS
+    con.execute(f"CREATE OR REPLACE TABLE silver.orders AS {ORDERS_SELECT}")
+    _validate_orders(con, "silver.orders")
+    _set_full_watermark(con, "orders")
+
+def _rebuild_order_items(con: duckdb.DuckDBPyConnection):
+    # TABELLA ORDERS_ITEMS (il vincolo referenziale legge silver.orders)
+    con.execute(f"CREATE OR REPLACE TABLE silver.order_items AS {ORDER_ITEMS_SELECT}")
+    _validate_order_items(con, "silver.order_items", "silver.orders")
+    _set_full_watermark(con, "order_items")
+
+def _rebuild_dimension(con: duckdb.DuckDBPyConnection, table: str):
+    # 3. Altre tabelle: copia pulita (ENUM sulle colonne a bassa cardinalità)
+    con.execute(f"CREATE OR REPLACE TABLE silver.{table} AS {DIMENSION_SELECTS[table]}")
+    ## con.execute("CREATE OR REPLACE TABLE silver.sellers AS SELECT * FROM bronze.sellers")
+    _set_full_watermark(con, table)
+
+
+# -----------------------------
+# Merge incrementale
+# -----------------------------
+def _can_run_incremental(con: duckdb.DuckDBPyConnection) -> bool:
+    if not table_exists(con, "tech", "tech_processed_files"):
+        return False
+    for table in SILVER_TABLES:
+        if not table_exists(con, "silver", table):
+            return False
+        if get_watermark(con, "silver", table) is None:
+            return False
+    return True
+
+def _first_appended_rowid(con: duckdb.DuckDBPyConnection, table: str, appended: int):
+    # bronze.orders / bronze.order_items sono append-only: le righe dei file caricati dopo
+    # il watermark sono le ultime `appended` in coda (rowid). None se Bronze è più corto del log
+    total = con.execute(f"SELECT COUNT(*) FROM bronze.{table}").fetchone()[0]
+    return total - appended if appended <= total else None
+
+def _rebuild_orders_fallback(con: duckdb.DuckDBPyConnection, reason: str):
+    print(f"Silver: {reason}, fallback a full rebuild di orders/order_items")
+    _rebuild_orders(con)
+    _rebuild_order_items(con)
+
+def _merge_orders_incremental(con: duckdb.DuckDBPyConnection):
+    watermark = get_watermark(con, "silver", "orders")
+    months, new_watermark = changed_order_months(con, watermark)
+    if not months:
+        set_watermark(con, "silver", "orders", watermark, rows_merged=0, mode="SKIP")
+        set_watermark(con, "silver", "order_items", watermark, rows_merged=0, mode="SKIP")
+        print("Silver: orders/order_items invariati (nessun nuovo mese in Bronze)")
+        return
+
+    first_order = _first_appended_rowid(con, "orders", rows_appended_since(con, watermark, "orders_"))
+    first_item = _first_appended_rowid(con, "order_items", rows_appended_since(con, watermark, "order_items_"))
+    if first_order is None or first_item is None:
+        _rebuild_orders_fallback(con, "Bronze non allineato al log dei file caricati")
+        return
+
+    # Delta = righe Bronze dei soli mesi toccati: il filtro sul range di date
+    # sfrutta le zone map di bronze.orders (caricato in append mese per mese)
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE _silver_delta_orders AS
+        SELECT * FROM ({ORDERS_SELECT}) o
+        WHERE o.order_purchase_timestamp >= CAST(? || '-01' AS TIMESTAMP)
+          AND o.order_purchase_timestamp < CAST(? || '-01' AS TIMESTAMP) + INTERVAL 1 MONTH
+          AND strftime(o.order_purchase_timestamp, '%Y-%m') IN (SELECT UNNEST(?::VARCHAR[]))
+    """, [months[0], months[-1], months])
+
+    # Controllo di allineamento sul solo delta: ogni ordine nuovo con chiave e data
+    # d'acquisto deve cadere nei mesi del merge (gli ordini senza data entrano solo col full)
+    missed = con.execute("""
+        SELECT COUNT(*)
+        FROM bronze.orders
+        WHERE rowid >= ?
+          AND order_id IS NOT NULL
+          AND order_purchase_timestamp IS NOT NULL
+          AND order_id NOT IN (SELECT order_id FROM _silver_delta_orders)
+    """, [first_order]).fetchone()[0]
+    if missed:
+        _rebuild_orders_fallback(con, f"{missed} ordini nuovi fuori dai mesi {', '.join(months)}")
+        return
+
+    # Articoli = righe delle partizioni order_items caricate (coda di bronze.order_items),
+    # validate come nel full: anche il vincolo referenziale verso gli ordini Silver
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE _silver_delta_items AS
+        {ORDER_ITEMS_SELECT}
+        WHERE rowid >= ?
+    """, [first_item])
+    _validate_orders(con, "_silver_delta_orders")
+    _validate_order_items(con, "_silver_delta_items", """(
+        SELECT order_id FROM _silver_delta_orders
+        UNION ALL
+        SELECT order_id FROM silver.orders WHERE order_id IN (SELECT order_id FROM _silver_delta_items)
+    )""")
+
+    # MERGE (upsert per chiave) in un'unica transazione
+    con.execute("BEGIN TRANSACTION")
     try:
-        con.execute("CREATE SCHEMA IF NOT EXISTS silver")
-    
-        # TABELLA ORDERS
-        # 1. Pulizia ordini: conversione date da stringa a TIMESTAMP
+        con.execute("DELETE FROM silver.orders WHERE order_id IN (SELECT order_id FROM _silver_delta_orders)")
+        con.execute("INSERT INTO silver.orders SELECT * FROM _silver_delta_orders")
         con.execute("""
-            CREATE OR REPLACE TABLE silver.orders AS 
-            SELECT 
-                order_id, 
-                customer_id,
-                order_status,
-                CAST(order_purchase_timestamp AS TIMESTAMP) as order_purchase_timestamp,
-                CAST(order_delivered_customer_date AS TIMESTAMP) as order_delivered_customer_date,
-                CAST(order_estimated_delivery_date AS TIMESTAMP) as order_estimated_delivery_date
-            FROM bronze.orders
-            WHERE order_id IS NOT NULL
+            DELETE FROM silver.order_items s
+            USING _silver_delta_items d
+            WHERE s.order_id = d.order_id AND s.order_item_id = d.order_item_id
         """)
-        # Validazione Pandera: se fallisce, il task si blocca qui
-        orders_schema.validate(con.execute("SELECT order_status FROM silver.orders").df())
+        con.execute("INSERT INTO silver.order_items SELECT * FROM _silver_delta_items")
 
-        # TABELLA ORDERS_ITEMS
-        # 2. Pulizia articoli: prezzi come float
-        con.execute("""
-            CREATE OR REPLACE TABLE silver.order_items AS 
-            SELECT 
-                order_id,
-                order_item_id,
-                product_id,
-                seller_id,
-                CAST(price AS DOUBLE) as price,
-                CAST(freight_value AS DOUBLE) as freight_value
-            FROM bronze.order_items
-        """)
-        # Validazione Pandera
-        order_items_schema.validate(con.execute("SELECT order_id, price, freight_value FROM silver.order_items").df())
-
-        # 3. Altre tabelle: copia pulita
-        con.execute("CREATE OR REPLACE TABLE silver.products AS SELECT * FROM bronze.products")
-        con.execute("CREATE OR REPLACE TABLE silver.customers AS SELECT * FROM bronze.customers")
-        ## con.execute("CREATE OR REPLACE TABLE silver.sellers AS SELECT * FROM bronze.sellers")
-    
+        orders_merged = con.execute("SELECT COUNT(*) FROM _silver_delta_orders").fetchone()[0]
+        items_merged = con.execute("SELECT COUNT(*) FROM _silver_delta_items").fetchone()[0]
+        set_watermark(con, "silver", "orders", new_watermark, rows_merged=orders_merged, mode="INCREMENTAL")
+        set_watermark(con, "silver", "order_items", new_watermark, rows_merged=items_merged, mode="INCREMENTAL")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    print(f"Silver: merge mesi {', '.join(months)} | orders={orders_merged} | order_items={items_merged}")
+
+def _merge_dimension_incremental(con: duckdb.DuckDBPyConnection, table: str):
+    # Le anagrafiche arrivano in Bronze come dump completi: si ricopiano solo se il dump è cambiato
+    watermark = get_watermark(con, "silver", table)
+    changed = [ts for fn, ts in changed_files_since(con, watermark) if fn == DIMENSION_SOURCES[table]]
+    if not changed:
+        set_watermark(con, "silver", table, watermark, rows_merged=0, mode="SKIP")
+        return
+
+    con.execute(f"CREATE OR REPLACE TABLE silver.{table} AS {DIMENSION_SELECTS[table]}")
+    rows = con.execute(f"SELECT COUNT(*) FROM silver.{table}").fetchone()[0]
+    set_watermark(con, "silver", table, max(changed), rows_merged=rows, mode="INCREMENTAL")
+    print(f"Silver: {table} ricaricata (dump Bronze cambiato, rows={rows})")
+
+# -----------------------------
+# Step per tabella (eseguibili in parallelo dai flow)
+# -----------------------------
+# Pseudo-tabella per le dipendenze: i tipi ENUM dello schema silver
+ENUM_TYPES = "silver.enum_types"
+
+# Step: nome -> (funzione, tabelle lette, tabelle scritte); ogni step aggiorna anche
+# le proprie righe di tech.tech_layer_watermarks
+SILVER_FULL_STEPS = {
+    "enum_types": (_sync_enum_types, {"bronze.customers", "bronze.products"}, {ENUM_TYPES}),
+    "orders": (_rebuild_orders, {"bronze.orders", ENUM_TYPES}, {"silver.orders"}),
+    "order_items": (_rebuild_order_items, {"bronze.order_items", "silver.orders"}, {"silver.order_items"}),
+    "products": (lambda con: _rebuild_dimension(con, "products"), {"bronze.products", ENUM_TYPES}, {"silver.products"}),
+    "customers": (lambda con: _rebuild_dimension(con, "customers"), {"bronze.customers", ENUM_TYPES}, {"silver.customers"}),
+}
+SILVER_INCREMENTAL_STEPS = {
+    "enum_types": SILVER_FULL_STEPS["enum_types"],
+    # orders e order_items nella stessa transazione di merge
+    "orders": (
+        _merge_orders_incremental,
+        {"bronze.orders", "bronze.order_items", "tech.tech_processed_files", ENUM_TYPES},
+        {"silver.orders", "silver.order_items"},
+    ),
+    "products": (
+        lambda con: _merge_dimension_incremental(con, "products"),
+        {"bronze.products", "tech.tech_processed_files", ENUM_TYPES},
+        {"silver.products"},
+    ),
+    "customers": (
+        lambda con: _merge_dimension_incremental(con, "customers"),
+        {"bronze.customers", "tech.tech_processed_files", ENUM_TYPES},
+        {"silver.customers"},
+    ),
+}
+
+
+@task(name="Silver Step", task_run_name="silver-{name}")
+def silver_step(db_path, name: str, incremental: bool = False):
+    func, reads, writes = (SILVER_INCREMENTAL_STEPS if incremental else SILVER_FULL_STEPS)[name]
+    with metered_step(db_path, "silver", name, reads, writes) as con:
+        func(con)
+
+
+@task(name="Finalize Silver")
+def finalize_silver(db_path, incremental: bool = False):
+    silver = {f"silver.{table}" for table in SILVER_TABLES}
+    with metered_step(db_path, "silver", "finalize", silver, silver) as con:
+        _align_enum_columns(con)
         return "Silver Layer validato e completato"
+
+
+def silver_steps(db_path, incremental: bool = False) -> list:
+    """Prepara schema e watermark, sceglie full/incrementale e ritorna gli step Silver."""
+    con = duckdb.connect(db_path)
+    try:
+        con.execute("CREATE SCHEMA IF NOT EXISTS silver")
+        ensure_watermark_table(con)
+        ensure_run_metrics_table(con)
+        incremental = incremental and _can_run_incremental(con)
     finally:
-        con.close()
\ No newline at end of file
+        con.close()
+
+    steps = [
+        step(silver_step, {"db_path": db_path, "name": name, "incremental": incremental}, reads, writes)
+        for name, (_, reads, writes) in (SILVER_INCREMENTAL_STEPS if incremental else SILVER_FULL_STEPS).items()
+    ]
+    # Controllo di allineamento / fallback e conversione ENUM: dopo tutti gli step
+    silver = {f"silver.{table}" for table in SILVER_TABLES}
+    steps.append(step(finalize_silver, {"db_path": db_path, "incremental": incremental},
+                      reads=silver | {ENUM_TYPES}, writes=silver))
+    return steps
+
+
+@task(name="Clean Olist Data (Silver)")
+def clean_olist_data(db_path, incremental: bool = False):
+    """
+    Bronze -> Silver.
+
+    - incremental=False: rebuild completo (CREATE OR REPLACE) di tutte le tabelle.
+    - incremental=True: MERGE dei soli file caricati in Bronze dopo l'ultimo watermark
+      (tech.tech_processed_files); fallback al full rebuild se Silver non esiste ancora,
+      se manca il watermark o se le righe nuove di Bronze non rientrano nei mesi del merge.
+    - order_status, customer_state, customer_city e product_category_name sono ENUM
+      (schema silver); i tipi sono derivati da Bronze ed estesi a ogni run con i valori nuovi.
+
+    Esegue in sequenza gli step di silver_steps (i flow li lanciano in parallelo).
+    """
+    return run_steps(silver_steps(db_path, incremental))[-1]
@@ -1,11 +1,266 @@
 import duckdb
 import os
+import re
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DB_PATH = os.getenv("DB_PATH", "data/warehouse.duckdb")
 
+# Ingestion a memoria limitata (container ETL con RAM ridotta)
+STREAMING = os.getenv("ETL_STREAMING", "0") == "1"
+MEMORY_LIMIT = os.getenv("ETL_MEMORY_LIMIT")  # es. "1GB"; None = default DuckDB
+
+# orders_YYYY-MM.parquet / order_items_YYYY-MM.parquet (landing zone / tech.tech_processed_files)
+ORDERS_MONTHLY_RE = re.compile(r"^(?:orders|order_items)_(\d{4}-\d{2})\.parquet$")
+
 # Funzione per ottenere la connessione al database
 def get_connection():
-    return duckdb.connect(DB_PATH)
\ No newline at end of file
+    return duckdb.connect(DB_PATH)
+
+
+def apply_memory_limit(con: duckdb.DuckDBPyConnection):
+    # Tetto di memoria DuckDB: oltre il limite gli operatori fanno spill su disco
+    if MEMORY_LIMIT:
+        con.execute(f"SET memory_limit = '{MEMORY_LIMIT}'")
+        con.execute("SET preserve_insertion_order = false")
+
+
+# -----------------------------
+# Tech: watermark per layer/tabella
+# -----------------------------
+def utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def table_exists(con: duckdb.DuckDBPyConnection, schema: str, table: str) -> bool:
+    row = con.execute("""
+        SELECT 1
+        FROM information_schema.tables
+        WHERE table_schema = ? AND table_name = ?
+        LIMIT 1
+    """, [schema, table]).fetchone()
+    return row is not None
+
+
+def column_exists(con: duckdb.DuckDBPyConnection, schema: str, table: str, column: str) -> bool:
+    row = con.execute("""
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ? AND column_name = ?
+        LIMIT 1
+    """, [schema, table, column]).fetchone()
+    return row is not None
+
+
+def column_type(con: duckdb.DuckDBPyConnection, schema: str, table: str, column: str):
+    row = con.execute("""
+        SELECT data_type
+        FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ? AND column_name = ?
+    """, [schema, table, column]).fetchone()
+    return row[0] if row else None
+
+
+def ensure_watermark_table(con: duckdb.DuckDBPyConnection):
+    con.execute("CREATE SCHEMA IF NOT EXISTS tech;")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tech.tech_layer_watermarks (
+            layer           VARCHAR,
+            table_name      VARCHAR,
+            watermark       TIMESTAMP,
+            rows_merged     BIGINT,
+            mode            VARCHAR,   -- FULL / INCREMENTAL / SKIP
+            updated_at      TIMESTAMP,
+            PRIMARY KEY (layer, table_name)
+        );
+    """)
+
+
+def get_watermark(con: duckdb.DuckDBPyConnection, layer: str, table_name: str):
+    row = con.execute("""
+        SELECT watermark
+        FROM tech.tech_layer_watermarks
+        WHERE layer = ? AND table_name = ?
+    """, [layer, table_name]).fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(
+    con: duckdb.DuckDBPyConnection,
+    layer: str,
+    table_name: str,
+    watermark,
+    rows_merged: int,
+    mode: str
+):
+    con.execute("""
+        INSERT INTO tech.tech_layer_watermarks
+            (layer, table_name, watermark, rows_merged, mode, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (layer, table_name) DO UPDATE SET
+            watermark   = excluded.watermark,
+            rows_merged = excluded.rows_merged,
+            mode        = excluded.mode,
+            updated_at  = excluded.updated_at
+    """, [layer, table_name, watermark, rows_merged, mode, utc_now_iso()])
+
+
+# -----------------------------
+# Tech: versione Gold pubblicata (chiave di invalidazione della cache dashboard)
+# -----------------------------
+def ensure_gold_version_table(con: duckdb.DuckDBPyConnection):
+    con.execute("CREATE SCHEMA IF NOT EXISTS tech;")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tech.tech_gold_versions (
+            version         BIGINT PRIMARY KEY,
+            built_at        TIMESTAMP,
+            mode            VARCHAR    -- FULL / INCREMENTAL
+        );
+    """)
+
+
+def publish_gold_version(con: duckdb.DuckDBPyConnection, mode: str) -> int:
+    ensure_gold_version_table(con)
+    version = con.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM tech.tech_gold_versions").fetchone()[0]
+    con.execute("INSERT INTO tech.tech_gold_versions VALUES (?, ?, ?)", [version, utc_now_iso(), mode])
+    return version
+
+
+# -----------------------------
+# Tech: mappa delle chiavi surrogate Gold (chiave naturale -> intero)
+# -----------------------------
+def ensure_key_map_table(con: duckdb.DuckDBPyConnection):
+    con.execute("CREATE SCHEMA IF NOT EXISTS tech;")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tech.tech_key_map (
+            entity          VARCHAR,   -- customer / product
+            natural_key     VARCHAR,
+            surrogate_key   INTEGER,
+            assigned_at     TIMESTAMP,
+            PRIMARY KEY (entity, natural_key)
+        );
+    """)
+
+
+def assign_surrogate_keys(con: duckdb.DuckDBPyConnection, entity: str, keys_sql: str) -> int:
+    """
+    Assegna una chiave intera alle chiavi naturali di `keys_sql` (una colonna) non ancora
+    mappate: MAX(chiave) + 1..n in ordine di chiave naturale. Le chiavi già assegnate non
+    cambiano mai, né tra build incrementali né con un full rebuild.
+    """
+    ensure_key_map_table(con)
+    return con.execute(f"""
+        INSERT INTO tech.tech_key_map
+        SELECT
+            ? AS entity,
+            natural_key,
+            (SELECT COALESCE(MAX(surrogate_key), 0) FROM tech.tech_key_map WHERE entity = ?)
+                + ROW_NUMBER() OVER (ORDER BY natural_key) AS surrogate_key,
+            CAST(? AS TIMESTAMP) AS assigned_at
+        FROM (
+            SELECT DISTINCT k AS natural_key
+            FROM ({keys_sql}) s(k)
+            WHERE k IS NOT NULL
+        ) n
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM tech.tech_key_map m
+            WHERE m.entity = ? AND m.natural_key = n.natural_key
+        )
+    """, [entity, entity, utc_now_iso(), entity]).fetchone()[0]
+
+
+# -----------------------------
+# Tech: statistiche min/max per row group delle fact Gold (verifica del pruning)
+# -----------------------------
+def ensure_rowgroup_stats_table(con: duckdb.DuckDBPyConnection):
+    con.execute("CREATE SCHEMA IF NOT EXISTS tech;")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tech.tech_gold_rowgroups (
+            table_name      VARCHAR,
+            column_name     VARCHAR,
+            row_group_id    BIGINT,
+            rows            BIGINT,
+            min_value       VARCHAR,
+            max_value       VARCHAR,
+            recorded_at     TIMESTAMP
+        );
+    """)
+
+
+# -----------------------------
+# Tech: metriche per run (tempi, righe, memoria di step e statement SQL)
+# -----------------------------
+def ensure_run_metrics_table(con: duckdb.DuckDBPyConnection):
+    con.execute("CREATE SCHEMA IF NOT EXISTS tech;")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tech.tech_run_metrics (
+            run_id          VARCHAR,   -- flow run Prefect (o un id per processo fuori dai flow)
+            layer           VARCHAR,   -- landing / bronze / silver / gold
+            step            VARCHAR,
+            kind            VARCHAR,   -- STEP / SQL
+            statement       VARCHAR,   -- testo SQL (troncato), NULL per gli step
+            status          VARCHAR,   -- OK / FAILED
+            started_at      TIMESTAMP,
+            wall_s          DOUBLE,
+            rows_in         BIGINT,
+            rows_out        BIGINT,
+            rows_per_s      DOUBLE,
+            peak_rss_mb     DOUBLE,
+            duckdb_mem_mb   DOUBLE
+        );
+    """)
+
+
+# -----------------------------
+# Tech: file caricati in Bronze (tech.tech_processed_files)
+# -----------------------------
+def latest_processed_at(con: duckdb.DuckDBPyConnection):
+    if not table_exists(con, "tech", "tech_processed_files"):
+        return None
+    return con.execute("""
+        SELECT MAX(processed_at)
+        FROM tech.tech_processed_files
+        WHERE status = 'OK'
+    """).fetchone()[0]
+
+
+def changed_files_since(con: duckdb.DuckDBPyConnection, watermark, until=None) -> list:
+    # File caricati con successo in Bronze nell'intervallo (watermark, until]
+    return con.execute("""
+        SELECT file_name, processed_at
+        FROM tech.tech_processed_files
+        WHERE status = 'OK'
+          AND rows_inserted > 0
+          AND processed_at > ?
+          AND (CAST(? AS TIMESTAMP) IS NULL OR processed_at <= ?)
+        ORDER BY file_name
+    """, [watermark, until, until]).fetchall()
+
+
+def rows_appended_since(con: duckdb.DuckDBPyConnection, watermark, prefix: str) -> int:
+    # Righe inserite in Bronze dai file mensili <prefix>YYYY-MM.parquet caricati dopo il watermark
+    return con.execute("""
+        SELECT COALESCE(SUM(rows_inserted), 0)
+        FROM tech.tech_processed_files
+        WHERE status = 'OK'
+          AND processed_at > ?
+          AND regexp_full_match(file_name, ?)
+    """, [watermark, re.escape(prefix) + r"\d{4}-\d{2}\.parquet"]).fetchone()[0]
+
+
+def changed_order_months(con: duckdb.DuckDBPyConnection, watermark, until=None):
+    """
+    Ritorna (mesi 'YYYY-MM' toccati, nuovo watermark) per i file orders/order_items
+    mensili caricati dopo il watermark. Nessun cambiamento -> ([], watermark).
+    """
+    changed = [
+        (ORDERS_MONTHLY_RE.match(fn).group(1), ts)
+        for fn, ts in changed_files_since(con, watermark, until)
+        if ORDERS_MONTHLY_RE.match(fn)
+    ]
+    if not changed:
+        return [], watermark
+    return sorted({m for m, _ in changed}), max(ts for _, ts in changed)
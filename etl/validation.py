@@ -0,0 +1,215 @@
+import duckdb
+import pandas as pd
+import pandera.pandas as pa
+from pandera.errors import SchemaDefinitionError, SchemaError, SchemaErrorReason, SchemaErrors
+
+# Failure case riportati per ogni check fallito (valori distinti)
+FAILURE_SAMPLE = 10
+
+# Famiglie di tipi DuckDB compatibili con i dtype dichiarati negli schemi Pandera
+DUCKDB_TYPE_FAMILIES = {
+    "string": ("VARCHAR", "ENUM"),
+    "float": ("DOUBLE", "FLOAT", "REAL", "DECIMAL"),
+    "int": ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT",
+            "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT"),
+    "bool": ("BOOLEAN",),
+    "datetime": ("TIMESTAMP", "DATE"),
+}
+
+
+# -----------------------------
+# Compilazione check Pandera -> SQL
+# -----------------------------
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _literal(value) -> str:
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _literal_list(values) -> str:
+    return ", ".join(_literal(v) for v in values)
+
+
+def _failure_condition(col: str, check: pa.Check) -> str:
+    """Predicato SQL vero sulle righe che NON passano il check."""
+    stats = check.statistics
+    name = check.name
+
+    if name == "isin":
+        cond = f"{col} NOT IN ({_literal_list(stats['allowed_values'])})"
+    elif name == "notin":
+        cond = f"{col} IN ({_literal_list(stats['forbidden_values'])})"
+    elif name == "greater_than_or_equal_to":
+        cond = f"{col} < {_literal(stats['min_value'])}"
+    elif name == "greater_than":
+        cond = f"{col} <= {_literal(stats['min_value'])}"
+    elif name == "less_than_or_equal_to":
+        cond = f"{col} > {_literal(stats['max_value'])}"
+    elif name == "less_than":
+        cond = f"{col} >= {_literal(stats['max_value'])}"
+    elif name == "equal_to":
+        cond = f"{col} <> {_literal(stats['value'])}"
+    elif name == "not_equal_to":
+        cond = f"{col} = {_literal(stats['value'])}"
+    elif name == "in_range":
+        low = ">=" if stats.get("include_min", True) else ">"
+        high = "<=" if stats.get("include_max", True) else "<"
+        cond = (
+            f"NOT ({col} {low} {_literal(stats['min_value'])} "
+            f"AND {col} {high} {_literal(stats['max_value'])})"
+        )
+    else:
+        raise SchemaDefinitionError(
+            f"Check Pandera '{name}' non supportato dalla validazione in DuckDB: "
+            f"usare isin/notin, ge/gt/le/lt, eq/ne o in_range"
+        )
+
+    # Come Pandera: i NULL sono responsabilità di nullable, non dei check
+    if check.ignore_na:
+        cond = f"({col} IS NOT NULL AND {cond})"
+    return cond
+
+
+def _dtype_family(dtype) -> str:
+    name = str(dtype).lower()
+    if name.startswith("str"):
+        return "string"
+    for family in ("float", "int", "bool", "datetime"):
+        if name.startswith(family):
+            return family
+    return None
+
+
+def _describe(con: duckdb.DuckDBPyConnection, relation: str) -> dict:
+    # Solo metadati: nessuna scansione dei dati
+    return dict(con.execute(f"SELECT column_name, column_type FROM (DESCRIBE {relation})").fetchall())
+
+
+# -----------------------------
+# Report Pandera
+# -----------------------------
+def _schema_error(column: pa.Column, message: str, check, check_index, reason_code, failure_cases: list) -> SchemaError:
+    return SchemaError(
+        column,
+        None,
+        message,
+        failure_cases=pd.DataFrame({"index": [None] * len(failure_cases), "failure_case": failure_cases}),
+        check=check,
+        check_index=check_index,
+        reason_code=reason_code,
+        column_name=column.name,
+    )
+
+
+def _sample_failures(con, relation: str, where_sql: str, params: list, col: str, cond: str, sample: int) -> list:
+    # Solo i valori distinti che falliscono, con LIMIT: i dati non escono da DuckDB
+    rows = con.execute(f"""
+        SELECT DISTINCT {col}
+        FROM {relation} r
+        WHERE ({where_sql}) AND {cond}
+        LIMIT {sample}
+    """, params).fetchall()
+    return [r[0] for r in rows]
+
+
+# -----------------------------
+# API
+# -----------------------------
+def validate_in_duckdb(
+    con: duckdb.DuckDBPyConnection,
+    schema: pa.DataFrameSchema,
+    relation: str,
+    where: str = None,
+    params: list = None,
+    references: dict = None,
+    sample: int = FAILURE_SAMPLE,
+) -> int:
+    """
+    Valida `relation` contro uno schema Pandera direttamente in DuckDB.
+
+    I check dichiarati (dtype, nullable, isin/notin, ge/gt/le/lt, eq/ne, in_range)
+    e i vincoli referenziali (references={colonna: (tabella, colonna)}) sono compilati
+    in un'unica query aggregata; `where` (con `params`) limita la validazione alle sole
+    righe nuove. Solo per i check falliti viene estratto un campione di failure case.
+
+    Ritorna il numero di righe validate; in caso di errori solleva pandera SchemaErrors
+    (stesso report di schema.validate(lazy=True), failure_cases inclusi). Uno schema con
+    check non supportati viene rifiutato prima della query con SchemaDefinitionError.
+    """
+    if schema.checks or schema.unique:
+        unsupported = [check.name for check in schema.checks] + ([f"unique={schema.unique}"] if schema.unique else [])
+        raise SchemaDefinitionError(f"Check a livello DataFrame non supportati dalla validazione in DuckDB: {unsupported}")
+
+    where_sql = where or "TRUE"
+    params = params or []
+    types = _describe(con, relation)
+    errors = []
+
+    # (colonna Pandera, check, indice check, reason, predicato di fallimento)
+    compiled = []
+    for name, column in schema.columns.items():
+        if column.unique:
+            raise SchemaDefinitionError(f"Column(unique=True) non supportato dalla validazione in DuckDB ('{name}')")
+
+        if name not in types:
+            errors.append(_schema_error(
+                column, f"column '{name}' not in dataframe", "column_in_dataframe", None,
+                SchemaErrorReason.COLUMN_NOT_IN_DATAFRAME, [name],
+            ))
+            continue
+
+        family = _dtype_family(column.dtype) if column.dtype is not None else None
+        if family and not types[name].startswith(DUCKDB_TYPE_FAMILIES[family]):
+            errors.append(_schema_error(
+                column, f"expected series '{name}' to have type {column.dtype}, got {types[name]}",
+                f"dtype('{column.dtype}')", None, SchemaErrorReason.WRONG_DATATYPE, [types[name]],
+            ))
+
+        col = f"r.{_quote(name)}"
+        if not column.nullable:
+            compiled.append((column, "not_nullable", None, SchemaErrorReason.SERIES_CONTAINS_NULLS, f"{col} IS NULL"))
+        for i, check in enumerate(column.checks):
+            compiled.append((column, check, i, SchemaErrorReason.DATAFRAME_CHECK, _failure_condition(col, check)))
+
+        ref = (references or {}).get(name)
+        if ref:
+            ref_table, ref_col = ref
+            compiled.append((
+                column, f"references({ref_table}.{ref_col})", len(column.checks), SchemaErrorReason.DATAFRAME_CHECK,
+                f"({col} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {ref_table} x WHERE x.{_quote(ref_col)} = {col}))",
+            ))
+
+    # Unica passata: un flag per check per riga, aggregato con COUNT_IF
+    flags = ",\n            ".join(f"{cond} AS f{i}" for i, (*_, cond) in enumerate(compiled)) or "NULL AS f"
+    counts = "".join(f", COUNT_IF(f{i})" for i in range(len(compiled)))
+    row = con.execute(f"""
+        SELECT COUNT(*){counts}
+        FROM (
+            SELECT
+            {flags}
+            FROM {relation} r
+            WHERE {where_sql}
+        )
+    """, params).fetchone()
+    n_rows, failures = row[0], row[1:]
+
+    for (column, check, check_index, reason, cond), n_failed in zip(compiled, failures):
+        if not n_failed:
+            continue
+        col = f"r.{_quote(column.name)}"
+        cases = _sample_failures(con, relation, where_sql, params, col, cond, sample)
+        message = (
+            f"Column '{column.name}' failed validator {check}: "
+            f"{n_failed} righe su {n_rows}, failure cases: {cases}"
+        )
+        errors.append(_schema_error(column, message, check, check_index, reason, cases))
+
+    if errors:
+        raise SchemaErrors(schema, errors, pd.DataFrame())
+    return n_rows
@@ -6,19 +6,28 @@
 #
 # - orders: incrementale, anti-duplicate su order_id
 # - order_items: incrementale, anti-duplicate su (order_id, order_item_id)
-#                + carica solo gli items relativi ai nuovi order_id inseriti
+#                + legge solo le partizioni order_items_YYYY-MM dei mesi toccati
 # - customers/products: dump completi (REPLACE) quando cambiano
+# - modalità batch (default): tutti i mesi cambiati in un unico scan/anti-join/insert
 #
 # Log tecnico:
 # - tech_processed_files: file_name, fingerprint, processed_at, rows_in, rows_inserted, status, note
+# - tech_run_metrics: tempo, righe, RSS di picco e memoria DuckDB dello step e di ogni statement
 #--------------------------------------------------------------
 
 import os
+import sys
 import json
 import duckdb
 from pathlib import Path
 from datetime import datetime, timezone
 
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from etl.metrics import metered_step
+
 # Consiglio: DB_PATH da env (perfetto anche per GitHub Actions)
 DB_PATH = os.getenv("DB_PATH", "data/warehouse.duckdb")
 
@@ -28,7 +37,8 @@ MANIFEST_PATH = os.path.join(LANDING_DIR, "_manifest.json")
 ORDERS_PREFIX = "orders_"          # orders_YYYY-MM.parquet
 ORDERS_SUFFIX = ".parquet"
 
-ORDER_ITEMS_FILE = "olist_order_items_dataset.parquet"
+ORDER_ITEMS_PREFIX = "order_items_"  # order_items_YYYY-MM.parquet (co-partizionati con orders)
+
 CUSTOMERS_FILE = "olist_customers_dataset.parquet"
 PRODUCTS_FILE = "olist_products_dataset.parquet"
 
@@ -47,6 +57,12 @@ def _load_manifest(path: str) -> dict:
 def _is_orders_monthly(filename: str) -> bool:
     return filename.startswith(ORDERS_PREFIX) and filename.endswith(ORDERS_SUFFIX)
 
+def _is_order_items_monthly(filename: str) -> bool:
+    return filename.startswith(ORDER_ITEMS_PREFIX) and filename.endswith(ORDERS_SUFFIX)
+
+def _month_of(filename: str, prefix: str) -> str:
+    return filename[len(prefix):-len(ORDERS_SUFFIX)]
+
 def _safe_int(x) -> int:
     try:
         return int(x)
@@ -63,47 +79,130 @@ def _table_exists(con: duckdb.DuckDBPyConnection, schema: str, table: str) -> bo
     return row is not None
 
 # -----------------------------
-# DQC base (DuckDB)
+# DQC base (DuckDB): statistiche dal footer Parquet, scan solo se inconcludenti
 # -----------------------------
-def _run_dqc_orders(con: duckdb.DuckDBPyConnection, parquet_path: str):
-    rows = con.execute(f"SELECT COUNT(*) FROM read_parquet('{parquet_path}')").fetchone()[0]
-    if rows == 0:
-        raise ValueError(f"DQC FAIL: {os.path.basename(parquet_path)} è vuoto.")
-
-    nulls = con.execute(f"""
-        SELECT
-            SUM(CASE WHEN order_id IS NULL THEN 1 ELSE 0 END) AS null_order_id,
-            SUM(CASE WHEN customer_id IS NULL THEN 1 ELSE 0 END) AS null_customer_id
-        FROM read_parquet('{parquet_path}')
-    """).fetchone()
-    if nulls[0] > 0:
-        raise ValueError(f"DQC FAIL: order_id NULL in {os.path.basename(parquet_path)}")
-    if nulls[1] > 0:
-        raise ValueError(f"DQC FAIL: customer_id NULL in {os.path.basename(parquet_path)}")
-
-def _run_dqc_order_items(con: duckdb.DuckDBPyConnection, parquet_path: str):
-    rows = con.execute(f"SELECT COUNT(*) FROM read_parquet('{parquet_path}')").fetchone()[0]
-    if rows == 0:
-        raise ValueError(f"DQC FAIL: {os.path.basename(parquet_path)} è vuoto.")
-
-    nulls = con.execute(f"""
-        SELECT
-            SUM(CASE WHEN order_id IS NULL THEN 1 ELSE 0 END) AS null_order_id,
-            SUM(CASE WHEN order_item_id IS NULL THEN 1 ELSE 0 END) AS null_order_item_id,
-            SUM(CASE WHEN product_id IS NULL THEN 1 ELSE 0 END) AS null_product_id
-        FROM read_parquet('{parquet_path}')
-    """).fetchone()
-    if nulls[0] > 0 or nulls[1] > 0:
-        raise ValueError(f"DQC FAIL: chiave (order_id/order_item_id) NULL in {os.path.basename(parquet_path)}")
-    if nulls[2] > 0:
-        raise ValueError(f"DQC FAIL: product_id NULL in {os.path.basename(parquet_path)}")
-
-    # prezzi non negativi (se presenti)
-    cols = [r[0] for r in con.execute(f"DESCRIBE SELECT * FROM read_parquet('{parquet_path}')").fetchall()]
-    if "price" in cols:
-        neg = con.execute(f"SELECT COUNT(*) FROM read_parquet('{parquet_path}') WHERE price < 0").fetchone()[0]
+DQC_ORDERS = {"not_null": ["order_id", "customer_id"], "non_negative": []}
+DQC_ORDER_ITEMS = {"not_null": ["order_id", "order_item_id", "product_id"], "non_negative": ["price"]}
+
+def _parquet_row_counts(con: duckdb.DuckDBPyConnection, parquet_paths: list) -> dict:
+    # Righe per file dai soli metadati dei row group (nessuna lettura dei dati)
+    return dict(con.execute("""
+        SELECT file_name, SUM(row_group_num_rows)
+        FROM (SELECT DISTINCT file_name, row_group_id, row_group_num_rows FROM parquet_metadata(?))
+        GROUP BY file_name
+    """, [parquet_paths]).fetchall())
+
+def _dqc_profile(con: duckdb.DuckDBPyConnection, parquet_paths: list, rules: dict) -> dict:
+    """
+    Profilo DQC per file: {"rows": n, "nulls": {col: n}, "negatives": {col: n}}.
+    Righe, NULL e minimi arrivano dalle statistiche dei row group (parquet_metadata);
+    solo i file con statistiche mancanti o non conclusive (es. minimo < 0, da contare)
+    vengono letti, tutti insieme, con un'unica scansione.
+    """
+    not_null, non_negative = rules["not_null"], rules["non_negative"]
+    rows = _parquet_row_counts(con, parquet_paths)
+    stats = {
+        (fn, col): (nulls, nulls_known, min_value, min_known)
+        for fn, col, nulls, nulls_known, min_value, min_known in con.execute("""
+            SELECT
+                file_name,
+                path_in_schema,
+                SUM(stats_null_count),
+                COUNT(*) = COUNT(stats_null_count),
+                MIN(TRY_CAST(stats_min_value AS DOUBLE)),
+                BOOL_AND(COALESCE(
+                    stats_null_count = row_group_num_rows OR TRY_CAST(stats_min_value AS DOUBLE) IS NOT NULL,
+                    FALSE
+                ))
+            FROM parquet_metadata(?)
+            WHERE path_in_schema IN (SELECT UNNEST(?::VARCHAR[]))
+            GROUP BY file_name, path_in_schema
+        """, [parquet_paths, not_null + non_negative]).fetchall()
+    }
+
+    profile = {}
+    to_scan = []
+    for path in parquet_paths:
+        p = {"rows": _safe_int(rows.get(path, 0)), "nulls": {}, "negatives": {}}
+        conclusive = True
+        for col in not_null:
+            s = stats.get((path, col))
+            if s is None or not s[1]:
+                conclusive = False
+            else:
+                p["nulls"][col] = _safe_int(s[0])
+        for col in non_negative:
+            s = stats.get((path, col))
+            if s is None:
+                # colonna assente: check non applicabile (come prima del DESCRIBE)
+                p["negatives"][col] = 0
+            elif s[3] and (s[2] is None or s[2] >= 0):
+                p["negatives"][col] = 0
+            else:
+                conclusive = False
+
+        if conclusive or p["rows"] == 0:
+            profile[path] = p
+        else:
+            to_scan.append(path)
+
+    if to_scan:
+        # Fallback: un'unica scansione fusa (righe, NULL e negativi) dei soli file inconcludenti
+        scan_negative = [c for c in non_negative if any((path, c) in stats for path in to_scan)]
+        exprs = [f"COUNT_IF({c} IS NULL)" for c in not_null] + [f"COUNT_IF({c} < 0)" for c in scan_negative]
+        for fn, n, *counts in con.execute(f"""
+            SELECT filename, COUNT(*), {", ".join(exprs)}
+            FROM read_parquet(?, filename = true, union_by_name = true)
+            GROUP BY filename
+        """, [to_scan]).fetchall():
+            profile[fn] = {
+                "rows": n,
+                "nulls": dict(zip(not_null, counts)),
+                "negatives": {c: 0 for c in non_negative} | dict(zip(scan_negative, counts[len(not_null):])),
+            }
+
+    print(f"DQC: {len(parquet_paths) - len(to_scan)} file da metadati, {len(to_scan)} scansionati")
+    return profile
+
+def _run_dqc_orders_batch(con: duckdb.DuckDBPyConnection, parquet_paths: list) -> dict:
+    # Ritorna rows_in per file (dal profilo DQC, senza un ulteriore COUNT(*))
+    profile = _dqc_profile(con, parquet_paths, DQC_ORDERS)
+    rows_in = {}
+    for path in parquet_paths:
+        p = profile[path]
+        if p["rows"] == 0:
+            raise ValueError(f"DQC FAIL: {os.path.basename(path)} è vuoto.")
+        if p["nulls"]["order_id"] > 0:
+            raise ValueError(f"DQC FAIL: order_id NULL in {os.path.basename(path)}")
+        if p["nulls"]["customer_id"] > 0:
+            raise ValueError(f"DQC FAIL: customer_id NULL in {os.path.basename(path)}")
+        rows_in[path] = p["rows"]
+    return rows_in
+
+def _run_dqc_order_items_batch(con: duckdb.DuckDBPyConnection, parquet_paths: list) -> dict:
+    profile = _dqc_profile(con, parquet_paths, DQC_ORDER_ITEMS)
+    rows_in = {}
+    for path in parquet_paths:
+        p = profile[path]
+        if p["rows"] == 0:
+            raise ValueError(f"DQC FAIL: {os.path.basename(path)} è vuoto.")
+        if p["nulls"]["order_id"] > 0 or p["nulls"]["order_item_id"] > 0:
+            raise ValueError(f"DQC FAIL: chiave (order_id/order_item_id) NULL in {os.path.basename(path)}")
+        if p["nulls"]["product_id"] > 0:
+            raise ValueError(f"DQC FAIL: product_id NULL in {os.path.basename(path)}")
+
+        # prezzi non negativi (se presenti)
+        neg = p["negatives"]["price"]
         if neg > 0:
-            raise ValueError(f"DQC FAIL: trovati {neg} price negativi in {os.path.basename(parquet_path)}")
+            raise ValueError(f"DQC FAIL: trovati {neg} price negativi in {os.path.basename(path)}")
+        rows_in[path] = p["rows"]
+    return rows_in
+
+def _run_dqc_orders(con: duckdb.DuckDBPyConnection, parquet_path: str) -> int:
+    return _run_dqc_orders_batch(con, [parquet_path])[parquet_path]
+
+def _run_dqc_order_items(con: duckdb.DuckDBPyConnection, parquet_path: str) -> int:
+    return _run_dqc_order_items_batch(con, [parquet_path])[parquet_path]
 
 # -----------------------------
 # Tech table
@@ -176,185 +275,318 @@ def _replace_table_from_parquet(con: duckdb.DuckDBPyConnection, table_fqn: str,
     con.execute(f"CREATE OR REPLACE TABLE {table_fqn} AS SELECT * FROM read_parquet('{parquet_path}');")
 
 # -----------------------------
-# Main ingestion
+# Order items mensili (partizioni co-partizionate con orders)
 # -----------------------------
-def run_bronze_incremental(db_path: str = DB_PATH):
-    Path(LANDING_DIR).mkdir(parents=True, exist_ok=True)
-
-    manifest = _load_manifest(MANIFEST_PATH)
-    files_meta = manifest.get("files", {})
+def _item_partitions(files_meta: dict) -> dict:
+    # mese -> (file_name, fingerprint, path)
+    parts = {}
+    for fn in sorted(files_meta.keys()):
+        if not _is_order_items_monthly(fn):
+            continue
+        path = os.path.join(LANDING_DIR, fn)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Manca {path} (atteso da manifest).")
+        parts[_month_of(fn, ORDER_ITEMS_PREFIX)] = (fn, files_meta[fn].get("fingerprint", ""), path)
+    return parts
+
+def _changed_item_months(con: duckdb.DuckDBPyConnection, item_parts: dict) -> set:
+    # Partizioni items nuove/cambiate: DQC prima di caricarle
+    changed = {
+        month
+        for month, (fn, fp, path) in item_parts.items()
+        if not _already_processed_same_fingerprint(con, fn, fp)
+    }
+    if changed:
+        _run_dqc_order_items_batch(con, [item_parts[m][2] for m in sorted(changed)])
+    return changed
+
+def _insert_new_items(con: duckdb.DuckDBPyConnection, item_paths: list) -> dict:
+    # Anti-dup composito (order_id, order_item_id) sulle sole partizioni indicate.
+    # Ritorna {path: items inseriti}
+    if not item_paths:
+        return {}
+    con.execute("DROP TABLE IF EXISTS _tmp_new_items;")
+    con.execute("""
+        CREATE TEMP TABLE _tmp_new_items AS
+        SELECT oi.*
+        FROM read_parquet(?, filename = true) oi
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM bronze.order_items bi
+            WHERE bi.order_id = oi.order_id
+              AND bi.order_item_id = oi.order_item_id
+        );
+    """, [item_paths])
+    con.execute("INSERT INTO bronze.order_items BY NAME SELECT * EXCLUDE (filename) FROM _tmp_new_items;")
+    return dict(con.execute("SELECT filename, COUNT(*) FROM _tmp_new_items GROUP BY filename").fetchall())
+
+def _log_item_partitions(con: duckdb.DuckDBPyConnection, item_parts: dict, months_read: set, inserted_by_path: dict):
+    read_paths = [item_parts[m][2] for m in sorted(months_read)]
+    rows_in = _parquet_row_counts(con, read_paths) if read_paths else {}
+
+    for month, (fn, fp, path) in item_parts.items():
+        if month not in months_read:
+            _log_processed(con, fn, fp, rows_in=0, rows_inserted=0, status="SKIP", note="immutato (fingerprint)")
+            continue
+        _log_processed(
+            con, fn, fp,
+            rows_in=_safe_int(rows_in.get(path, 0)),
+            rows_inserted=_safe_int(inserted_by_path.get(path, 0)),
+            status="OK",
+            note=f"partizione items del mese {month}"
+        )
 
-    if not files_meta:
-        print("Manifest vuoto: nessun file da processare.")
-        return
+# -----------------------------
+# Orders mensili: modalità file-per-file
+# -----------------------------
+def _ingest_orders_per_file(con: duckdb.DuckDBPyConnection, files_meta: dict, monthly_orders_files: list, item_parts: dict):
+    total_orders_inserted = 0
+    total_items_inserted = 0
+    changed_item_months = _changed_item_months(con, item_parts)
+    months_read = set()
+    items_inserted_by_path = {}
+
+    for fn in monthly_orders_files:
+        meta = files_meta.get(fn, {})
+        fp = meta.get("fingerprint", "")
+        parquet_path = os.path.join(LANDING_DIR, fn)
+
+        if not os.path.exists(parquet_path):
+            raise FileNotFoundError(f"Manca {parquet_path} (atteso da manifest).")
+
+        if _already_processed_same_fingerprint(con, fn, fp):
+            _log_processed(con, fn, fp, rows_in=0, rows_inserted=0, status="SKIP", note="immutato (fingerprint)")
+            continue
+
+        rows_in = _run_dqc_orders(con, parquet_path)
+
+        # 3.1) Trova nuovi orders con NOT EXISTS (DuckDB-safe)
+        con.execute("DROP TABLE IF EXISTS _tmp_new_orders;")
+        con.execute(f"""
+            CREATE TEMP TABLE _tmp_new_orders AS
+            SELECT s.*
+            FROM read_parquet('{parquet_path}') s
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM bronze.orders b
+                WHERE b.order_id = s.order_id
+            );
+        """)
+        new_orders_cnt = con.execute("SELECT COUNT(*) FROM _tmp_new_orders;").fetchone()[0]
+
+        # 3.2) Inserisci solo i nuovi orders
+        if new_orders_cnt > 0:
+            con.execute("INSERT INTO bronze.orders SELECT * FROM _tmp_new_orders;")
+
+        # 3.3) Carica order_items dalla sola partizione dello stesso mese (anti-dup composito)
+        month = _month_of(fn, ORDERS_PREFIX)
+        new_items_cnt = 0
+        if month in item_parts:
+            inserted = _insert_new_items(con, [item_parts[month][2]])
+            items_inserted_by_path.update(inserted)
+            months_read.add(month)
+            new_items_cnt = sum(inserted.values())
+
+        total_orders_inserted += _safe_int(new_orders_cnt)
+        total_items_inserted += _safe_int(new_items_cnt)
+
+        _log_processed(
+            con, fn, fp,
+            rows_in=rows_in,
+            rows_inserted=new_orders_cnt,
+            status="OK",
+            note=f"orders_inserted={new_orders_cnt}; items_inserted={new_items_cnt}"
+        )
+        print(f"OK: {fn} | rows_in={rows_in} | new_orders={new_orders_cnt} | new_items={new_items_cnt}")
+
+    # Partizioni items cambiate senza che sia cambiato il mese orders corrispondente
+    for month in sorted(changed_item_months - months_read):
+        inserted = _insert_new_items(con, [item_parts[month][2]])
+        items_inserted_by_path.update(inserted)
+        months_read.add(month)
+        total_items_inserted += sum(inserted.values())
+
+    _log_item_partitions(con, item_parts, months_read, items_inserted_by_path)
+    return total_orders_inserted, total_items_inserted
 
-    con = duckdb.connect(db_path)
-    try:
-        _ensure_bronze_schema(con)
-        _ensure_tech_table(con)
-
-        # ---------
-        # 1) Dimensioni (customers/products): REPLACE se cambiano
-        # ---------
-        for dim_file, dim_table in [
-            (CUSTOMERS_FILE, "bronze.customers"),
-            (PRODUCTS_FILE, "bronze.products"),
-        ]:
-            meta = files_meta.get(dim_file)
-            if not meta:
-                continue
-
-            fp = meta.get("fingerprint", "")
-            parquet_path = os.path.join(LANDING_DIR, dim_file)
-            if not os.path.exists(parquet_path):
-                raise FileNotFoundError(f"Manca {parquet_path} (atteso da manifest).")
-
-            if _already_processed_same_fingerprint(con, dim_file, fp):
-                _log_processed(con, dim_file, fp, rows_in=0, rows_inserted=0, status="SKIP", note="immutato (fingerprint)")
-                continue
-
-            rows_in = con.execute(f"SELECT COUNT(*) FROM read_parquet('{parquet_path}')").fetchone()[0]
-            _replace_table_from_parquet(con, dim_table, parquet_path)
-            _log_processed(con, dim_file, fp, rows_in=rows_in, rows_inserted=rows_in, status="OK", note=f"REPLACE -> {dim_table}")
-            print(f"OK: {dim_file} -> {dim_table} (rows={rows_in})")
-
-        # ---------
-        # 2) Order items parquet: lo usiamo come sorgente per filtrare gli items dei nuovi ordini
-        #    Nota: non “carichiamo tutto” sempre, ma garantiamo tabella + DQC quando serve.
-        # ---------
-        oi_meta = files_meta.get(ORDER_ITEMS_FILE)
-        if not oi_meta:
-            raise FileNotFoundError(f"{ORDER_ITEMS_FILE} non presente in manifest (landing_zone).")
-
-        oi_fp = oi_meta.get("fingerprint", "")
-        oi_path = os.path.join(LANDING_DIR, ORDER_ITEMS_FILE)
-        if not os.path.exists(oi_path):
-            raise FileNotFoundError(f"Manca {oi_path} (atteso da manifest).")
-
-        # Assicura tabella bronze.order_items (schema)
-        _ensure_order_items_table(con, oi_path)
-
-        # Se order_items immutato e tabella esiste già, non serve rifare DQC ogni run.
-        oi_is_unchanged = _already_processed_same_fingerprint(con, ORDER_ITEMS_FILE, oi_fp)
-        if not oi_is_unchanged:
-            _run_dqc_order_items(con, oi_path)
-
-        # ---------
-        # 3) Orders mensili: incrementale anti-dup su order_id
-        # ---------
-        monthly_orders_files = sorted([fn for fn in files_meta.keys() if _is_orders_monthly(fn)])
-        if not monthly_orders_files:
-            print("Nessun file orders_YYYY-MM.parquet nel manifest.")
-            return
-
-        first_orders_path = os.path.join(LANDING_DIR, monthly_orders_files[0])
-        if not os.path.exists(first_orders_path):
-            raise FileNotFoundError(f"Manca {first_orders_path} (atteso da manifest).")
-        _ensure_orders_table(con, first_orders_path)
+# -----------------------------
+# Orders mensili: modalità batch (set-based)
+# -----------------------------
+def _ingest_orders_batch(con: duckdb.DuckDBPyConnection, files_meta: dict, monthly_orders_files: list, item_parts: dict):
+    to_process = []
+    for fn in monthly_orders_files:
+        fp = files_meta.get(fn, {}).get("fingerprint", "")
+        parquet_path = os.path.join(LANDING_DIR, fn)
 
-        total_orders_inserted = 0
-        total_items_inserted = 0
+        if not os.path.exists(parquet_path):
+            raise FileNotFoundError(f"Manca {parquet_path} (atteso da manifest).")
 
-        for fn in monthly_orders_files:
-            meta = files_meta.get(fn, {})
-            fp = meta.get("fingerprint", "")
-            parquet_path = os.path.join(LANDING_DIR, fn)
+        if _already_processed_same_fingerprint(con, fn, fp):
+            _log_processed(con, fn, fp, rows_in=0, rows_inserted=0, status="SKIP", note="immutato (fingerprint)")
+            continue
+        to_process.append((fn, fp, parquet_path))
 
-            if not os.path.exists(parquet_path):
-                raise FileNotFoundError(f"Manca {parquet_path} (atteso da manifest).")
+    # Partizioni items da leggere: mesi orders da processare + partizioni items cambiate
+    months_read = {_month_of(fn, ORDERS_PREFIX) for fn, _, _ in to_process}
+    months_read = (months_read | _changed_item_months(con, item_parts)) & set(item_parts)
 
-            if _already_processed_same_fingerprint(con, fn, fp):
-                _log_processed(con, fn, fp, rows_in=0, rows_inserted=0, status="SKIP", note="immutato (fingerprint)")
-                continue
+    if not to_process and not months_read:
+        _log_item_partitions(con, item_parts, months_read, {})
+        return 0, 0
 
-            _run_dqc_orders(con, parquet_path)
-            rows_in = con.execute(f"SELECT COUNT(*) FROM read_parquet('{parquet_path}')").fetchone()[0]
+    parquet_paths = [path for _, _, path in to_process]
+    rows_in = _run_dqc_orders_batch(con, parquet_paths) if parquet_paths else {}
 
-            # 3.1) Trova nuovi orders con NOT EXISTS (DuckDB-safe)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        # 3.1) Un solo scan di tutti i mesi + un solo anti-join su bronze.orders.
+        #      Se lo stesso order_id compare in più file vince il primo (come nel loop per file).
+        inserted = {}
+        if parquet_paths:
             con.execute("DROP TABLE IF EXISTS _tmp_new_orders;")
-            con.execute(f"""
+            con.execute("""
                 CREATE TEMP TABLE _tmp_new_orders AS
                 SELECT s.*
-                FROM read_parquet('{parquet_path}') s
+                FROM read_parquet(?, filename = true) s
                 WHERE NOT EXISTS (
                     SELECT 1
                     FROM bronze.orders b
                     WHERE b.order_id = s.order_id
-                );
-            """)
-            new_orders_cnt = con.execute("SELECT COUNT(*) FROM _tmp_new_orders;").fetchone()[0]
+                )
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY s.order_id ORDER BY s.filename) = 1;
+            """, [parquet_paths])
 
-            # 3.2) Inserisci solo i nuovi orders
-            if new_orders_cnt > 0:
-                con.execute("INSERT INTO bronze.orders SELECT * FROM _tmp_new_orders;")
+            # 3.2) Un solo insert dei nuovi orders
+            con.execute("INSERT INTO bronze.orders BY NAME SELECT * EXCLUDE (filename) FROM _tmp_new_orders;")
+            inserted = dict(con.execute("""
+                SELECT filename, COUNT(*) FROM _tmp_new_orders GROUP BY filename
+            """).fetchall())
 
-            # 3.3) Carica order_items SOLO per i nuovi order_id (anti-dup composito)
-            con.execute("DROP TABLE IF EXISTS _tmp_new_order_ids;")
-            con.execute("""
-                CREATE TEMP TABLE _tmp_new_order_ids AS
-                SELECT DISTINCT order_id FROM _tmp_new_orders;
-            """)
-
-            if new_orders_cnt > 0:
-                # Se order_items parquet è “immutato”, va bene: lo leggiamo comunque per estrarre SOLO i nuovi items.
-                # Se invece era cambiato, abbiamo già eseguito DQC sopra.
-                con.execute("DROP TABLE IF EXISTS _tmp_new_items;")
-                con.execute(f"""
-                    CREATE TEMP TABLE _tmp_new_items AS
-                    SELECT oi.*
-                    FROM read_parquet('{oi_path}') oi
-                    JOIN _tmp_new_order_ids ids
-                      ON oi.order_id = ids.order_id
-                    WHERE NOT EXISTS (
-                        SELECT 1
-                        FROM bronze.order_items bi
-                        WHERE bi.order_id = oi.order_id
-                          AND bi.order_item_id = oi.order_item_id
-                    );
-                """)
-                new_items_cnt = con.execute("SELECT COUNT(*) FROM _tmp_new_items;").fetchone()[0]
-
-                if new_items_cnt > 0:
-                    con.execute("INSERT INTO bronze.order_items SELECT * FROM _tmp_new_items;")
-            else:
-                new_items_cnt = 0
+        # 3.3) Un solo scan delle partizioni items dei mesi toccati (anti-dup composito)
+        items_inserted = _insert_new_items(con, [item_parts[m][2] for m in sorted(months_read)])
 
-            total_orders_inserted += _safe_int(new_orders_cnt)
-            total_items_inserted += _safe_int(new_items_cnt)
+        # 3.4) Log per file in tech.tech_processed_files
+        _log_item_partitions(con, item_parts, months_read, items_inserted)
+
+        total_orders_inserted = 0
+        total_items_inserted = sum(items_inserted.values())
+        for fn, fp, path in to_process:
+            month = _month_of(fn, ORDERS_PREFIX)
+            new_orders_cnt = _safe_int(inserted.get(path, 0))
+            new_items_cnt = _safe_int(items_inserted.get(item_parts[month][2], 0)) if month in item_parts else 0
+            total_orders_inserted += new_orders_cnt
 
             _log_processed(
                 con, fn, fp,
-                rows_in=rows_in,
+                rows_in=rows_in[path],
                 rows_inserted=new_orders_cnt,
                 status="OK",
-                note=f"orders_inserted={new_orders_cnt}; items_inserted={new_items_cnt}"
+                note=f"orders_inserted={new_orders_cnt}; items_inserted={new_items_cnt}; batch"
             )
-            print(f"OK: {fn} | rows_in={rows_in} | new_orders={new_orders_cnt} | new_items={new_items_cnt}")
+            print(f"OK: {fn} | rows_in={rows_in[path]} | new_orders={new_orders_cnt} | new_items={new_items_cnt}")
 
-        # ---------
-        # 4) Log order_items file come processato (coerente)
-        # ---------
-        if oi_is_unchanged and total_items_inserted == 0:
-            _log_processed(con, ORDER_ITEMS_FILE, oi_fp, rows_in=0, rows_inserted=0, status="SKIP", note="immutato (fingerprint)")
-        else:
-            oi_rows = con.execute(f"SELECT COUNT(*) FROM read_parquet('{oi_path}')").fetchone()[0]
-            _log_processed(
-                con, ORDER_ITEMS_FILE, oi_fp,
-                rows_in=oi_rows,
-                rows_inserted=total_items_inserted,
-                status="OK",
-                note="order_items used as source; inserted only for new orders"
-            )
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
 
-        print("\nBronze incremental completato.")
-        print(f"- Totale nuovi orders inseriti: {total_orders_inserted}")
-        print(f"- Totale nuovi order_items inseriti: {total_items_inserted}")
+    return total_orders_inserted, total_items_inserted
 
-    except Exception as e:
-        print(f"\nERRORE CRITICO: {e}")
-        raise
-    finally:
-        con.close()
+# -----------------------------
+# Main ingestion
+# -----------------------------
+def run_bronze_incremental(db_path: str = DB_PATH, batch: bool = True):
+    """
+    Landing Zone -> Bronze.
+
+    batch=True: tutti i mesi orders nuovi/cambiati sono letti con un unico read_parquet([...]),
+    con un solo anti-join e un solo insert in un'unica transazione (log comunque per file).
+    batch=False: elaborazione un file alla volta.
+    """
+    Path(LANDING_DIR).mkdir(parents=True, exist_ok=True)
+
+    manifest = _load_manifest(MANIFEST_PATH)
+    files_meta = manifest.get("files", {})
+
+    if not files_meta:
+        print("Manifest vuoto: nessun file da processare.")
+        return
+
+    with metered_step(db_path, "bronze", "bronze_incremental") as con:
+        try:
+            _ensure_bronze_schema(con)
+            _ensure_tech_table(con)
+
+            # ---------
+            # 1) Dimensioni (customers/products): REPLACE se cambiano
+            # ---------
+            for dim_file, dim_table in [
+                (CUSTOMERS_FILE, "bronze.customers"),
+                (PRODUCTS_FILE, "bronze.products"),
+            ]:
+                meta = files_meta.get(dim_file)
+                if not meta:
+                    continue
+
+                fp = meta.get("fingerprint", "")
+                parquet_path = os.path.join(LANDING_DIR, dim_file)
+                if not os.path.exists(parquet_path):
+                    raise FileNotFoundError(f"Manca {parquet_path} (atteso da manifest).")
+
+                if _already_processed_same_fingerprint(con, dim_file, fp):
+                    _log_processed(con, dim_file, fp, rows_in=0, rows_inserted=0, status="SKIP", note="immutato (fingerprint)")
+                    continue
+
+                rows_in = con.execute(f"SELECT COUNT(*) FROM read_parquet('{parquet_path}')").fetchone()[0]
+                _replace_table_from_parquet(con, dim_table, parquet_path)
+                _log_processed(con, dim_file, fp, rows_in=rows_in, rows_inserted=rows_in, status="OK", note=f"REPLACE -> {dim_table}")
+                print(f"OK: {dim_file} -> {dim_table} (rows={rows_in})")
+
+            # ---------
+            # 2) Order items: partizioni mensili order_items_YYYY-MM.parquet.
+            #    Si leggono solo quelle dei mesi toccati (DQC solo sulle partizioni cambiate).
+            # ---------
+            item_parts = _item_partitions(files_meta)
+            if not item_parts:
+                raise FileNotFoundError(
+                    f"Nessun file {ORDER_ITEMS_PREFIX}YYYY-MM.parquet nel manifest. Esegui prima scripts/esplosione_dati.py"
+                )
+
+            # Assicura tabella bronze.order_items (schema)
+            _ensure_order_items_table(con, next(iter(item_parts.values()))[2])
+
+            # ---------
+            # 3) Orders mensili: incrementale anti-dup su order_id (batch o file-per-file)
+            # ---------
+            monthly_orders_files = sorted([fn for fn in files_meta.keys() if _is_orders_monthly(fn)])
+            if not monthly_orders_files:
+                print("Nessun file orders_YYYY-MM.parquet nel manifest.")
+                return
+
+            first_orders_path = os.path.join(LANDING_DIR, monthly_orders_files[0])
+            if not os.path.exists(first_orders_path):
+                raise FileNotFoundError(f"Manca {first_orders_path} (atteso da manifest).")
+            _ensure_orders_table(con, first_orders_path)
+
+            if batch:
+                total_orders_inserted, total_items_inserted = _ingest_orders_batch(con, files_meta, monthly_orders_files, item_parts)
+            else:
+                total_orders_inserted, total_items_inserted = _ingest_orders_per_file(con, files_meta, monthly_orders_files, item_parts)
+
+            # Metriche di run: righe lette/inserite dei file registrati da questo run
+            con.metrics.rows_in, con.metrics.rows_out = con.execute("""
+                SELECT COALESCE(SUM(rows_in), 0), COALESCE(SUM(rows_inserted), 0)
+                FROM tech.tech_processed_files
+                WHERE processed_at >= ?
+            """, [con.metrics.started_at]).fetchone()
+
+            print("\nBronze incremental completato.")
+            print(f"- Totale nuovi orders inseriti: {total_orders_inserted}")
+            print(f"- Totale nuovi order_items inseriti: {total_items_inserted}")
+
+        except Exception as e:
+            print(f"\nERRORE CRITICO: {e}")
+            raise
 
 if __name__ == "__main__":
     run_bronze_incremental()
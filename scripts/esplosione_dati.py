@@ -5,29 +5,99 @@
 # - Legge i CSV originali (data/raw/)
 # - Verifica se ci sono dati "nuovi" (per mese) tramite fingerprint
 # - Genera/aggiorna parquet mensili orders_YYYY-MM.parquet
+# - Co-partiziona order_items per mese d'acquisto dell'ordine padre
+#   (order_items_YYYY-MM.parquet, con fingerprint propri)
 # - Converte anche le anagrafiche in parquet completi
 # - Scrive un manifest JSON per tracciare cosa è stato generato
+#
+# Fingerprint vettoriali: un hash per riga (pandas, niente loop Python),
+# salvato per partizione in _row_hashes/ e confrontato con la versione
+# precedente per sapere quali chiavi sono state aggiunte/rimosse/modificate.
+#
+# Modalità streaming (ETL_STREAMING=1): i CSV sono letti a blocchi di
+# ETL_CSV_CHUNK_ROWS righe e smistati in file di staging mensili, così la
+# memoria è limitata dal blocco + dal mese più grande, non dall'intero CSV.
+#
+# Le scritture delle partizioni (parquet + hash + diff) girano su un pool di
+# ETL_TASK_CONCURRENCY thread: al più altrettanti mesi in memoria insieme.
+#
+# Tempi e righe lette/scritte di orders, order_items e anagrafiche
+# finiscono in tech.tech_run_metrics del DB_PATH (layer 'landing').
 # --------------------------------------------------------------
 
 import os
+import sys
 import json
+import shutil
 import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timezone
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from etl.metrics import timed_step
 
 RAW_DATA_PATH = "data/raw/"
 LANDING_ZONE = "data/lake/landing_zone/"
 MANIFEST_PATH = os.path.join(LANDING_ZONE, "_manifest.json")
+ROW_HASHES_DIR = os.path.join(LANDING_ZONE, "_row_hashes")
+STAGING_DIR = "data/lake/_staging/"
+# Database in cui registrare le metriche di run (tech.tech_run_metrics)
+DB_PATH = os.getenv("DB_PATH", "data/warehouse.duckdb")
+
+STREAMING = os.getenv("ETL_STREAMING", "0") == "1"
+CSV_CHUNK_ROWS = int(os.getenv("ETL_CSV_CHUNK_ROWS", "100000"))
+PUBLISH_WORKERS = int(os.getenv("ETL_TASK_CONCURRENCY", "4"))
 
 ORDERS_CSV = "olist_orders_dataset.csv"
+ORDER_ITEMS_CSV = "olist_order_items_dataset.csv"
 DIM_CSVS = [
     "olist_products_dataset.csv",
     "olist_customers_dataset.csv",
-    "olist_order_items_dataset.csv",
 ]
 
+# Tipi fissati per i CSV Olist: l'inferenza per blocco potrebbe cambiare tipo tra
+# un blocco e l'altro, e le due modalità devono produrre gli stessi parquet
+CSV_DTYPES = {
+    ORDERS_CSV: {
+        "order_id": str, "customer_id": str, "order_status": str,
+        "order_purchase_timestamp": str, "order_approved_at": str,
+        "order_delivered_carrier_date": str, "order_delivered_customer_date": str,
+        "order_estimated_delivery_date": str,
+    },
+    ORDER_ITEMS_CSV: {
+        "order_id": str, "order_item_id": "int64", "product_id": str, "seller_id": str,
+        "shipping_limit_date": str, "price": "float64", "freight_value": "float64",
+    },
+    "olist_products_dataset.csv": {
+        "product_id": str, "product_category_name": str,
+        "product_name_lenght": "float64", "product_description_lenght": "float64",
+        "product_photos_qty": "float64", "product_weight_g": "float64",
+        "product_length_cm": "float64", "product_height_cm": "float64", "product_width_cm": "float64",
+    },
+    "olist_customers_dataset.csv": {
+        "customer_id": str, "customer_unique_id": str, "customer_zip_code_prefix": "int64",
+        "customer_city": str, "customer_state": str,
+    },
+}
+
+# Formato dei timestamp nei CSV Olist (parsing esplicito, niente inferenza per riga)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Chiavi usate per il diff per riga
+ORDERS_KEYS = ["order_id"]
+ORDER_ITEMS_KEYS = ["order_id", "order_item_id"]
+DIM_KEY_CANDIDATES = ["customer_id", "product_id", "order_id"]
+
 # -----------------------------
 # Helpers: manifest
 # -----------------------------
@@ -45,30 +115,51 @@ def _save_manifest(path: str, manifest: dict) -> None:
 
 
 # -----------------------------
-# Helpers: fingerprint
+# Helpers: fingerprint (vettoriali, per riga)
 # -----------------------------
 def _md5_update_str(md5: "hashlib._Hash", s: str) -> None:
     md5.update(s.encode("utf-8"))
 
 
-def _fingerprint_orders_month(df_month: pd.DataFrame) -> dict:
-    ts = pd.to_datetime(df_month["order_purchase_timestamp"], errors="coerce")
+def _row_hashes(df: pd.DataFrame, key_cols: list) -> pd.DataFrame:
+    """
+    Un hash uint64 per riga (tutte le colonne) calcolato in blocco da pandas,
+    affiancato alla chiave della riga. Senza chiave si usa l'hash stesso.
+    """
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy(dtype=np.uint64)
+
+    if key_cols:
+        key = df[key_cols[0]].fillna("").astype(str)
+        for col in key_cols[1:]:
+            key = key + "#" + df[col].fillna("").astype(str)
+        keys = key.to_numpy()
+    else:
+        keys = hashes.astype(str)
+
+    # Stesso indice del DataFrame: gli hash calcolati una volta si ripartiscono per mese
+    return pd.DataFrame({"key": keys, "row_hash": hashes}, index=df.index)
+
+
+def _combine_row_hashes(row_hashes: pd.DataFrame) -> str:
+    # Combinazione indipendente dall'ordine delle righe (somma e xor modulo 2^64)
+    values = row_hashes["row_hash"].to_numpy(dtype=np.uint64)
+    total = int(np.add.reduce(values, dtype=np.uint64)) if len(values) else 0
+    xored = int(np.bitwise_xor.reduce(values)) if len(values) else 0
+    return f"{total:016x}{xored:016x}"
+
+
+def _fingerprint_orders_month(df_month: pd.DataFrame, row_hashes: pd.DataFrame) -> dict:
+    ts = df_month["order_purchase_timestamp"]
 
     rowcount = int(len(df_month))
     min_ts = "" if ts.isna().all() else str(ts.min())
     max_ts = "" if ts.isna().all() else str(ts.max())
 
-    order_ids = df_month["order_id"].fillna("").astype(str).sort_values(kind="mergesort")
-    md5_ids = hashlib.md5()
-    for oid in order_ids:
-        _md5_update_str(md5_ids, oid)
-        md5_ids.update(b"|")
-
     md5 = hashlib.md5()
     _md5_update_str(md5, f"rows={rowcount};")
     _md5_update_str(md5, f"min_ts={min_ts};")
     _md5_update_str(md5, f"max_ts={max_ts};")
-    _md5_update_str(md5, f"order_ids_hash={md5_ids.hexdigest()};")
+    _md5_update_str(md5, f"rows_hash={_combine_row_hashes(row_hashes)};")
 
     return {
         "fingerprint": md5.hexdigest(),
@@ -78,23 +169,27 @@ def _fingerprint_orders_month(df_month: pd.DataFrame) -> dict:
     }
 
 
-def _fingerprint_full_df(df: pd.DataFrame) -> dict:
-    rowcount = int(len(df))
-    cols = [str(c) for c in df.columns]
+def _fingerprint_order_items_month(df_month: pd.DataFrame, row_hashes: pd.DataFrame) -> dict:
+    rowcount = int(len(df_month))
 
     md5 = hashlib.md5()
     _md5_update_str(md5, f"rows={rowcount};")
-    _md5_update_str(md5, f"cols={','.join(cols)};")
+    _md5_update_str(md5, f"rows_hash={_combine_row_hashes(row_hashes)};")
+
+    return {
+        "fingerprint": md5.hexdigest(),
+        "rows": rowcount,
+    }
 
-    key_col = next((c for c in ["customer_id", "product_id", "order_id"] if c in df.columns), None)
 
-    if key_col:
-        series = df[key_col].fillna("").astype(str).sort_values(kind="mergesort")
-        md5_keys = hashlib.md5()
-        for v in series:
-            _md5_update_str(md5_keys, v)
-            md5_keys.update(b"|")
-        _md5_update_str(md5, f"keys_hash={md5_keys.hexdigest()};")
+def _fingerprint_full_df(columns: list, row_hashes: pd.DataFrame) -> dict:
+    rowcount = int(len(row_hashes))
+    cols = [str(c) for c in columns]
+
+    md5 = hashlib.md5()
+    _md5_update_str(md5, f"rows={rowcount};")
+    _md5_update_str(md5, f"cols={','.join(cols)};")
+    _md5_update_str(md5, f"rows_hash={_combine_row_hashes(row_hashes)};")
 
     return {
         "fingerprint": md5.hexdigest(),
@@ -104,24 +199,120 @@ def _fingerprint_full_df(df: pd.DataFrame) -> dict:
 
 
 # -----------------------------
-# Main
+# Helpers: diff per riga tra versioni di una partizione
 # -----------------------------
-def esplodi_dati():
-    Path(LANDING_ZONE).mkdir(parents=True, exist_ok=True)
-    manifest = _load_manifest(MANIFEST_PATH)
+def _row_hashes_path(filename: str) -> str:
+    return os.path.join(ROW_HASHES_DIR, filename)
+
+
+def _row_diff_path(filename: str) -> str:
+    return os.path.join(ROW_HASHES_DIR, filename.replace(".parquet", ".diff.parquet"))
+
+
+def _diff_row_hashes(filename: str, row_hashes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Confronta gli hash per riga con quelli salvati alla scrittura precedente.
+    Ritorna (key, change) con change in {'added', 'removed', 'changed'}.
+    """
+    prev_path = _row_hashes_path(filename)
+    if not os.path.exists(prev_path):
+        return pd.DataFrame({"key": row_hashes["key"], "change": "added"})
+
+    # UInt64 nullable: l'outer join non deve convertire gli hash in float
+    prev = pd.read_parquet(prev_path).astype({"row_hash": "UInt64"})
+    cur = row_hashes.astype({"row_hash": "UInt64"})
+    merged = prev.merge(cur, on="key", how="outer", suffixes=("_prev", "_cur"), indicator=True)
+
+    change = np.select(
+        [
+            (merged["_merge"] == "right_only").to_numpy(),
+            (merged["_merge"] == "left_only").to_numpy(),
+            (merged["row_hash_prev"] != merged["row_hash_cur"]).fillna(False).to_numpy(dtype=bool),
+        ],
+        ["added", "removed", "changed"],
+        default="",
+    )
+    diff = pd.DataFrame({"key": merged["key"], "change": change})
+    return diff[diff["change"] != ""].reset_index(drop=True)
+
+
+def _publish(manifest: dict, filename: str, df: pd.DataFrame, row_hashes: pd.DataFrame, fp: dict,
+             file_type: str, source: str, staged_path: str = None):
+    """
+    Scrive la partizione se il fingerprint è cambiato, insieme a hash per riga e diff.
+    Con staged_path il parquet è già stato scritto a blocchi e viene solo spostato.
+    Ritorna l'azione ('CREATO' / 'AGGIORNATO') oppure None se invariata.
+    """
+    file_path = os.path.join(LANDING_ZONE, filename)
+    prev = manifest["files"].get(filename)
+
+    if prev and prev["fingerprint"] == fp["fingerprint"] and os.path.exists(file_path):
+        if staged_path:
+            os.remove(staged_path)
+        return None
+
+    action = "CREATO" if not os.path.exists(file_path) else "AGGIORNATO"
+
+    diff = _diff_row_hashes(filename, row_hashes)
+    counts = diff["change"].value_counts()
+
+    if staged_path:
+        os.replace(staged_path, file_path)
+    else:
+        df.to_parquet(file_path, index=False)
+    row_hashes.reset_index(drop=True).to_parquet(_row_hashes_path(filename), index=False)
+    diff.to_parquet(_row_diff_path(filename), index=False)
+
+    manifest["files"][filename] = {
+        "type": file_type,
+        "source": source,
+        **fp,
+        "diff": {
+            "added": int(counts.get("added", 0)),
+            "removed": int(counts.get("removed", 0)),
+            "changed": int(counts.get("changed", 0)),
+            "path": _row_diff_path(filename),
+        },
+        "written_at_utc": datetime.now(timezone.utc).isoformat(),
+    }
+    return action
+
+
+def _publish_all(manifest: dict, jobs, workers: int = PUBLISH_WORKERS):
+    """
+    Esegue _publish per ogni job (filename, df, row_hashes, fp, file_type, source) su un pool
+    di thread, con al più `workers` partizioni in volo (memoria limitata anche in streaming).
+    Ogni job scrive solo i propri file e la propria voce del manifest.
+    Genera (filename, fp, azione) nell'ordine dei job.
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for filename, df, row_hashes, fp, file_type, source in jobs:
+            if len(pending) >= workers:
+                done_name, done_fp, future = pending.popleft()
+                yield done_name, done_fp, future.result()
+            future = pool.submit(_publish, manifest, filename, df, row_hashes, fp, file_type, source)
+            pending.append((filename, fp, future))
+        while pending:
+            done_name, done_fp, future = pending.popleft()
+            yield done_name, done_fp, future.result()
+
+
+def _diff_summary(manifest: dict, filename: str) -> str:
+    d = manifest["files"][filename]["diff"]
+    return f"+{d['added']} -{d['removed']} ~{d['changed']}"
 
-    print("Step 1: Esplosione dati CSV -> Parquet (Landing Zone)")
-    print(f"- RAW:     {RAW_DATA_PATH}")
-    print(f"- LANDING: {LANDING_ZONE}\n")
 
-    orders_path = os.path.join(RAW_DATA_PATH, ORDERS_CSV)
-    if not os.path.exists(orders_path):
-        raise FileNotFoundError(f"Non trovo {orders_path}")
+# -----------------------------
+# Helpers: lettura CSV (completa o a blocchi) e staging mensile
+# -----------------------------
+def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    # ✅ FIX BOM (encoding utf-8-sig) + normalizzazione colonne
+    df.columns = df.columns.str.strip()
+    return df
 
-    # ✅ FIX BOM + normalizzazione colonne
-    df_orders = pd.read_csv(orders_path, encoding="utf-8-sig")
-    df_orders.columns = df_orders.columns.str.strip()
 
+def _prepare_orders(df_orders: pd.DataFrame) -> pd.DataFrame:
     if "order_purchase_timestamp" not in df_orders.columns:
         raise KeyError(
             f"Colonna 'order_purchase_timestamp' non trovata.\n"
@@ -129,44 +320,225 @@ def esplodi_dati():
         )
 
     df_orders["order_purchase_timestamp"] = pd.to_datetime(
-        df_orders["order_purchase_timestamp"], errors="coerce"
+        df_orders["order_purchase_timestamp"], format=TIMESTAMP_FORMAT, errors="coerce"
     )
+    return df_orders
 
-    df_orders["periodo"] = df_orders["order_purchase_timestamp"].dt.to_period("M")
-    periodi = sorted(df_orders["periodo"].dropna().unique())
 
-    print(f"Ordini: trovati {len(periodi)} mesi\n")
+def _read_csv(csv_path: str) -> pd.DataFrame:
+    df = pd.read_csv(csv_path, encoding="utf-8-sig", dtype=CSV_DTYPES.get(os.path.basename(csv_path)))
+    return _normalize_columns(df)
 
-    created = updated = skipped = 0
+
+def _iter_csv(csv_path: str, chunk_rows: int):
+    reader = pd.read_csv(
+        csv_path,
+        encoding="utf-8-sig",
+        dtype=CSV_DTYPES.get(os.path.basename(csv_path)),
+        chunksize=chunk_rows,
+    )
+    for chunk in reader:
+        yield _normalize_columns(chunk)
+
+
+def _stage_path(stage_dir: str, periodo) -> str:
+    return os.path.join(stage_dir, f"{periodo}.parquet")
+
+
+def _stage_by_month(chunks, stage_dir: str) -> list:
+    """
+    Smista i blocchi (df, periodo per riga) in un parquet di staging per mese,
+    scritto in append: in memoria resta solo il blocco corrente.
+    """
+    Path(stage_dir).mkdir(parents=True, exist_ok=True)
+    writers = {}
+    try:
+        for chunk, periodo in chunks:
+            for p, part in chunk.groupby(periodo, sort=False):
+                table = pa.Table.from_pandas(part, preserve_index=False)
+                if p not in writers:
+                    writers[p] = pq.ParquetWriter(_stage_path(stage_dir, p), table.schema)
+                writers[p].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return sorted(writers)
+
+
+def _iter_orders_months(orders_path: str, streaming: bool, chunk_rows: int, order_month: list):
+    """
+    Genera (periodo, df_mese, row_hashes) per gli ordini.
+    Riempie order_month con le serie order_id -> periodo (per co-partizionare gli items).
+    """
+    if not streaming:
+        df_orders = _prepare_orders(_read_csv(orders_path))
+        periodo = df_orders["order_purchase_timestamp"].dt.to_period("M")
+        order_month.append(pd.Series(periodo.to_numpy(), index=df_orders["order_id"]))
+        print(f"Ordini: trovati {periodo.nunique()} mesi\n")
+
+        # Hash per riga calcolati una sola volta sull'intero file
+        orders_hashes = _row_hashes(df_orders, ORDERS_KEYS)
+
+        # Partizionamento in un solo passaggio (groupby) invece di un filtro completo per mese
+        for p, df_month in df_orders.groupby(periodo, sort=True):
+            yield p, df_month, orders_hashes.loc[df_month.index]
+        return
+
+    def chunks():
+        for chunk in _iter_csv(orders_path, chunk_rows):
+            chunk = _prepare_orders(chunk)
+            periodo = chunk["order_purchase_timestamp"].dt.to_period("M")
+            order_month.append(pd.Series(periodo.to_numpy(), index=chunk["order_id"]))
+            yield chunk, periodo
+
+    stage_dir = os.path.join(STAGING_DIR, "orders")
+    periodi = _stage_by_month(chunks(), stage_dir)
+    print(f"Ordini: trovati {len(periodi)} mesi (streaming)\n")
 
     for p in periodi:
-        df_month = df_orders[df_orders["periodo"] == p].drop(columns="periodo")
-        filename = f"orders_{p}.parquet"
-        file_path = os.path.join(LANDING_ZONE, filename)
+        df_month = pd.read_parquet(_stage_path(stage_dir, p))
+        yield p, df_month, _row_hashes(df_month, ORDERS_KEYS)
+
+
+def _iter_items_months(items_path: str, streaming: bool, chunk_rows: int, order_month: pd.Series):
+    """Genera (periodo, df_mese, row_hashes) per gli items, col mese dell'ordine padre."""
+    orphans = 0
+
+    if not streaming:
+        df_items = _read_csv(items_path)
+        items_periodo = df_items["order_id"].map(order_month)
+        orphans = int(items_periodo.isna().sum())
+        if orphans:
+            print(f"Order items senza ordine/mese di riferimento (esclusi): {orphans}")
+
+        items_hashes = _row_hashes(df_items, ORDER_ITEMS_KEYS)
+        for p, df_items_month in df_items.groupby(items_periodo, sort=True):
+            yield p, df_items_month, items_hashes.loc[df_items_month.index]
+        return
+
+    def chunks():
+        nonlocal orphans
+        for chunk in _iter_csv(items_path, chunk_rows):
+            items_periodo = chunk["order_id"].map(order_month)
+            orphans += int(items_periodo.isna().sum())
+            yield chunk, items_periodo
+
+    stage_dir = os.path.join(STAGING_DIR, "order_items")
+    periodi = _stage_by_month(chunks(), stage_dir)
+    if orphans:
+        print(f"Order items senza ordine/mese di riferimento (esclusi): {orphans}")
 
-        fp = _fingerprint_orders_month(df_month)
-        prev = manifest["files"].get(filename)
+    for p in periodi:
+        df_items_month = pd.read_parquet(_stage_path(stage_dir, p))
+        yield p, df_items_month, _row_hashes(df_items_month, ORDER_ITEMS_KEYS)
+
+
+def _publish_dimension(manifest: dict, csv_path: str, parquet_name: str, streaming: bool, chunk_rows: int):
+    if not streaming:
+        df_dim = _read_csv(csv_path)
+        key_col = next((c for c in DIM_KEY_CANDIDATES if c in df_dim.columns), None)
+        row_hashes = _row_hashes(df_dim, [key_col] if key_col else [])
+        fp = _fingerprint_full_df(list(df_dim.columns), row_hashes)
+        return _publish(manifest, parquet_name, df_dim, row_hashes, fp, "dimension_full_dump", csv_path)
+
+    # Streaming: parquet scritto a blocchi in staging, in memoria restano solo gli hash per riga
+    Path(STAGING_DIR).mkdir(parents=True, exist_ok=True)
+    staged_path = os.path.join(STAGING_DIR, parquet_name)
+    writer = None
+    columns = []
+    hashes = []
+    try:
+        for chunk in _iter_csv(csv_path, chunk_rows):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(staged_path, table.schema)
+                columns = list(chunk.columns)
+            writer.write_table(table)
+            key_col = next((c for c in DIM_KEY_CANDIDATES if c in chunk.columns), None)
+            hashes.append(_row_hashes(chunk, [key_col] if key_col else []))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        return None
+
+    row_hashes = pd.concat(hashes)
+    fp = _fingerprint_full_df(columns, row_hashes)
+    return _publish(manifest, parquet_name, None, row_hashes, fp, "dimension_full_dump", csv_path, staged_path=staged_path)
 
-        if prev and prev["fingerprint"] == fp["fingerprint"] and os.path.exists(file_path):
-            skipped += 1
-            continue
 
-        df_month.to_parquet(file_path, index=False)
+# -----------------------------
+# Main
+# -----------------------------
+def esplodi_dati(streaming: bool = STREAMING, chunk_rows: int = CSV_CHUNK_ROWS, db_path: str = DB_PATH):
+    Path(LANDING_ZONE).mkdir(parents=True, exist_ok=True)
+    Path(ROW_HASHES_DIR).mkdir(parents=True, exist_ok=True)
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+    manifest = _load_manifest(MANIFEST_PATH)
 
-        action = "CREATO" if not os.path.exists(file_path) else "AGGIORNATO"
-        created += action == "CREATO"
-        updated += action == "AGGIORNATO"
+    print("Step 1: Esplosione dati CSV -> Parquet (Landing Zone)")
+    print(f"- RAW:     {RAW_DATA_PATH}")
+    print(f"- LANDING: {LANDING_ZONE}")
+    if streaming:
+        print(f"- MODE:    streaming (chunk={chunk_rows} righe)")
+    print()
 
-        manifest["files"][filename] = {
-            "type": "orders_monthly",
-            "source": orders_path,
-            **fp,
-            "written_at_utc": datetime.now(timezone.utc).isoformat(),
-        }
+    orders_path = os.path.join(RAW_DATA_PATH, ORDERS_CSV)
+    if not os.path.exists(orders_path):
+        raise FileNotFoundError(f"Non trovo {orders_path}")
 
-        print(f"{action}: {filename} (rows={fp['rows']})")
+    order_month_parts = []
+    with timed_step(db_path, "landing", "orders") as metrics:
+        created = updated = skipped = metrics.rows_in = metrics.rows_out = 0
 
-    print(f"\nOrders: created={created}, updated={updated}, skipped={skipped}\n")
+        jobs = (
+            (f"orders_{p}.parquet", df_month, row_hashes, _fingerprint_orders_month(df_month, row_hashes),
+             "orders_monthly", orders_path)
+            for p, df_month, row_hashes in _iter_orders_months(orders_path, streaming, chunk_rows, order_month_parts)
+        )
+        for filename, fp, action in _publish_all(manifest, jobs):
+            metrics.rows_in += fp["rows"]
+            if action is None:
+                skipped += 1
+                continue
+
+            metrics.rows_out += fp["rows"]
+            created += action == "CREATO"
+            updated += action == "AGGIORNATO"
+            print(f"{action}: {filename} (rows={fp['rows']}, diff {_diff_summary(manifest, filename)})")
+
+        print(f"\nOrders: created={created}, updated={updated}, skipped={skipped}\n")
+
+    # ORDER ITEMS: co-partizionati per mese d'acquisto dell'ordine padre,
+    # così Bronze legge solo le partizioni dei mesi cambiati
+    items_path = os.path.join(RAW_DATA_PATH, ORDER_ITEMS_CSV)
+    if os.path.exists(items_path):
+        order_month = pd.concat(order_month_parts)
+        order_month = order_month[~order_month.index.duplicated()]
+
+        with timed_step(db_path, "landing", "order_items") as metrics:
+            created = updated = skipped = metrics.rows_in = metrics.rows_out = 0
+
+            jobs = (
+                (f"order_items_{p}.parquet", df_items_month, row_hashes,
+                 _fingerprint_order_items_month(df_items_month, row_hashes), "order_items_monthly", items_path)
+                for p, df_items_month, row_hashes in _iter_items_months(items_path, streaming, chunk_rows, order_month)
+            )
+            for filename, fp, action in _publish_all(manifest, jobs):
+                metrics.rows_in += fp["rows"]
+                if action is None:
+                    skipped += 1
+                    continue
+
+                metrics.rows_out += fp["rows"]
+                created += action == "CREATO"
+                updated += action == "AGGIORNATO"
+                print(f"{action}: {filename} (rows={fp['rows']}, diff {_diff_summary(manifest, filename)})")
+
+            print(f"\nOrder items: created={created}, updated={updated}, skipped={skipped}\n")
+    else:
+        print(f"SKIP: {ORDER_ITEMS_CSV}\n")
 
     print("Anagrafiche:")
     for csv_name in DIM_CSVS:
@@ -175,30 +547,20 @@ def esplodi_dati():
             print(f"SKIP: {csv_name}")
             continue
 
-        df_dim = pd.read_csv(csv_path, encoding="utf-8-sig")
-        df_dim.columns = df_dim.columns.str.strip()
-
         parquet_name = csv_name.replace(".csv", ".parquet")
-        parquet_path = os.path.join(LANDING_ZONE, parquet_name)
-
-        fp = _fingerprint_full_df(df_dim)
-        prev = manifest["files"].get(parquet_name)
 
-        if prev and prev["fingerprint"] == fp["fingerprint"] and os.path.exists(parquet_path):
+        with timed_step(db_path, "landing", parquet_name) as metrics:
+            action = _publish_dimension(manifest, csv_path, parquet_name, streaming, chunk_rows)
+            metrics.rows_in = manifest["files"].get(parquet_name, {}).get("rows")
+            metrics.rows_out = metrics.rows_in if action else 0
+        if action is None:
             print(f"OK: {parquet_name}")
             continue
 
-        df_dim.to_parquet(parquet_path, index=False)
-        print(f"SCRITTO: {parquet_name}")
-
-        manifest["files"][parquet_name] = {
-            "type": "dimension_full_dump",
-            "source": csv_path,
-            **fp,
-            "written_at_utc": datetime.now(timezone.utc).isoformat(),
-        }
+        print(f"SCRITTO: {parquet_name} (diff {_diff_summary(manifest, parquet_name)})")
 
     _save_manifest(MANIFEST_PATH, manifest)
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
     print("\nStep 1 completato.")
 
 
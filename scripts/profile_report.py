@@ -0,0 +1,89 @@
+#--------------------------------------------------------------
+# profile_report.py
+#
+# Report delle query più lente dai profili JSON di DuckDB
+# (DUCKDB_PROFILING=1, file .jsonl in DUCKDB_PROFILE_DIR scritti da etl/profiling.py):
+# - query raggruppate per impronta (testo normalizzato, letterali esclusi)
+# - ordinate per latenza massima, con esecuzioni, media e p95
+# - per ognuna gli operatori più costosi dell'esecuzione più lenta
+#
+# Uso: python scripts/profile_report.py [--top 10] [--source etl|dashboard|ai] [--operators 5]
+#--------------------------------------------------------------
+
+import argparse
+import glob
+import json
+import os
+import sys
+from pathlib import Path
+
+import duckdb
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from etl.profiling import PROFILE_DIR
+
+PROFILE_COLUMNS = """{
+    fingerprint: 'VARCHAR', source: 'VARCHAR', label: 'VARCHAR', recorded_at: 'TIMESTAMPTZ',
+    query: 'VARCHAR', latency_s: 'DOUBLE', rows: 'BIGINT', operators: 'JSON'
+}"""
+
+SLOWEST_SQL = """
+    WITH profiles AS (
+        SELECT *
+        FROM read_json(?, format = 'newline_delimited', columns = {columns})
+        WHERE CAST(? AS VARCHAR) IS NULL OR source = ?
+    )
+    SELECT
+        fingerprint,
+        string_agg(DISTINCT source || ':' || COALESCE(label, '-'), ', ') AS used_by,
+        COUNT(*) AS executions,
+        AVG(latency_s) AS avg_s,
+        quantile_cont(latency_s, 0.95) AS p95_s,
+        MAX(latency_s) AS max_s,
+        arg_max(query, latency_s) AS query,
+        arg_max(operators, latency_s) AS operators,
+        MAX(recorded_at) AS last_seen
+    FROM profiles
+    GROUP BY fingerprint
+    ORDER BY max_s DESC
+    LIMIT ?
+"""
+
+
+def profile_report(profile_dir: str = PROFILE_DIR, top: int = 10, source: str = None, operators: int = 5):
+    files = glob.glob(os.path.join(profile_dir, "*.jsonl"))
+    if not files:
+        print(f"Nessun profilo in {profile_dir}: eseguire con DUCKDB_PROFILING=1.")
+        return
+
+    con = duckdb.connect()
+    try:
+        rows = con.execute(
+            SLOWEST_SQL.format(columns=PROFILE_COLUMNS), [files, source, source, top]
+        ).fetchall()
+    finally:
+        con.close()
+
+    print(f"Query più lente per impronta ({len(files)} file in {profile_dir}" + (f", sorgente {source})" if source else ")"))
+    for rank, (fp, used_by, executions, avg_s, p95_s, max_s, query, ops, last_seen) in enumerate(rows, start=1):
+        print(f"\n#{rank} {fp} | {used_by}")
+        print(f"   esecuzioni={executions} media={avg_s:.3f}s p95={p95_s:.3f}s max={max_s:.3f}s ultima={last_seen:%Y-%m-%d %H:%M}")
+        print(f"   {query[:300]}")
+        hottest = sorted(json.loads(ops or "[]"), key=lambda op: op.get("timing_s") or 0, reverse=True)[:operators]
+        if hottest:
+            print("   operatori più costosi (esecuzione più lenta):")
+        for op in hottest:
+            print(f"     {op['operator']:<28} {op.get('timing_s') or 0:.4f}s  righe={op.get('cardinality')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query più lente dai profili JSON DuckDB")
+    parser.add_argument("--dir", default=PROFILE_DIR)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--source", choices=["etl", "dashboard", "ai"])
+    parser.add_argument("--operators", type=int, default=5)
+    args = parser.parse_args()
+    profile_report(args.dir, args.top, args.source, args.operators)
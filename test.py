@@ -4,7 +4,7 @@ import os
 con = duckdb.connect("data/warehouse.duckdb")
 
 query = con.execute("""SELECT order_id, COUNT(*) c
-FROM read_parquet('data/lake/silver/orders_*.parquet')
+FROM read_parquet('data/lake/silver/orders/**/*.parquet', hive_partitioning = true)
 GROUP BY 1
 HAVING COUNT(*) > 1
 ORDER BY c DESC
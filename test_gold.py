@@ -13,7 +13,8 @@ def test_gold_layer():
     print("--- TEST STRUTTURA GOLD LAYER ---")
     try:
         # 2. Creazione View
-        con.execute("CREATE VIEW fact_sales AS SELECT * FROM read_parquet('data/lake/gold/fact_sales.parquet')")
+        # fact_sales partizionata hive (year=/month=), dim_time in un file unico
+        con.execute("CREATE VIEW fact_sales AS SELECT * FROM read_parquet('data/lake/gold/fact_sales/**/*.parquet', hive_partitioning = true)")
         con.execute("CREATE VIEW dim_time AS SELECT * FROM read_parquet('data/lake/gold/dim_time.parquet')")
         print("View create correttamente.")
 
@@ -29,7 +30,7 @@ def test_gold_layer():
                 CAST(t.year AS VARCHAR) || '-' || LPAD(CAST(t.month AS VARCHAR), 2, '0') as Periodo,
                 SUM(f.price) as Fatturato
             FROM fact_sales f
-            JOIN dim_time t ON f.order_purchase_timestamp = t.order_purchase_timestamp
+            JOIN dim_time t ON f.date_key = t.date_key
             GROUP BY Periodo 
             ORDER BY Periodo 
             LIMIT 5
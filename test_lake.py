@@ -0,0 +1,113 @@
+#--------------------------------------------------------------
+# Test dell'export incrementale del lake Parquet (etl/tasks/lake.py).
+# - un ENUM allargato con un nuovo valore (nuovo customer_state) non deve cambiare
+#   l'impronta delle partizioni che non contengono righe nuove
+# - le righe senza data finiscono nella partizione hive di default (year/month NULL)
+#--------------------------------------------------------------
+
+import os
+import tempfile
+
+import duckdb
+
+from etl.tasks import lake
+
+EXPORTS = {
+    "fact_orders": ("SELECT * FROM gold.fact_orders", "order_purchase_timestamp", "order_id"),
+}
+
+
+def _partition_inodes(lake_dir):
+    # os.replace di una partizione riscritta cambia l'inode del file
+    table_dir = os.path.join(lake_dir, "gold", "fact_orders")
+    return {
+        os.path.relpath(root, table_dir): os.stat(os.path.join(root, "data.parquet")).st_ino
+        for root, _, files in os.walk(table_dir)
+        if "data.parquet" in files
+    }
+
+
+def _export(db_path, lake_dir):
+    con = duckdb.connect(db_path, read_only=True)
+    previous = lake.LAKE_DIR
+    lake.LAKE_DIR = lake_dir
+    try:
+        lake._export_layer(con, "gold", EXPORTS)
+    finally:
+        lake.LAKE_DIR = previous
+        con.close()
+
+
+def test_enum_extension_keeps_unchanged_partitions():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "warehouse.duckdb")
+        lake_dir = os.path.join(tmp, "lake")
+
+        con = duckdb.connect(db_path)
+        con.execute("CREATE SCHEMA gold")
+        con.execute("CREATE TYPE state_t AS ENUM ('RJ', 'SP')")
+        con.execute("""
+            CREATE TABLE gold.fact_orders AS
+            SELECT * FROM (VALUES
+                ('o1', 'SP'::state_t, TIMESTAMP '2017-01-10 10:00:00'),
+                ('o2', 'RJ'::state_t, TIMESTAMP '2017-02-10 10:00:00'),
+                ('o3', 'SP'::state_t, TIMESTAMP '2017-03-10 10:00:00')
+            ) t(order_id, customer_state, order_purchase_timestamp)
+        """)
+        con.close()
+        _export(db_path, lake_dir)
+        before = _partition_inodes(lake_dir)
+        assert len(before) == 3
+
+        # Nuovo Stato in testa al dominio: gli indici interni di RJ e SP si spostano
+        con = duckdb.connect(db_path)
+        con.execute("CREATE TYPE state_t2 AS ENUM ('AC', 'RJ', 'SP')")
+        con.execute("ALTER TABLE gold.fact_orders ALTER customer_state TYPE state_t2")
+        con.execute("INSERT INTO gold.fact_orders VALUES ('o4', 'AC', TIMESTAMP '2017-04-10 10:00:00')")
+        con.close()
+        _export(db_path, lake_dir)
+        after = _partition_inodes(lake_dir)
+
+        assert set(after) == set(before) | {os.path.join("year=2017", "month=4")}
+        assert all(after[part] == inode for part, inode in before.items()), "partizioni invariate riscritte"
+
+
+def test_null_dates_exported_to_default_partition():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "warehouse.duckdb")
+        lake_dir = os.path.join(tmp, "lake")
+
+        con = duckdb.connect(db_path)
+        con.execute("CREATE SCHEMA gold")
+        con.execute("""
+            CREATE TABLE gold.fact_orders AS
+            SELECT * FROM (VALUES
+                ('o1', 'SP', TIMESTAMP '2017-01-10 10:00:00'),
+                ('o2', 'RJ', NULL)
+            ) t(order_id, customer_state, order_purchase_timestamp)
+        """)
+        con.close()
+        _export(db_path, lake_dir)
+        before = _partition_inodes(lake_dir)
+        assert set(before) == {os.path.join("year=2017", "month=1"), lake.NULL_PARTITION.replace("/", os.sep)}
+
+        con = duckdb.connect()
+        try:
+            rows = con.execute(f"""
+                SELECT order_id, year, month
+                FROM read_parquet('{os.path.join(lake_dir, "gold", "fact_orders", "**", "*.parquet")}', hive_partitioning = true)
+                ORDER BY order_id
+            """).fetchall()
+        finally:
+            con.close()
+        assert rows == [("o1", 2017, 1), ("o2", None, None)]
+
+        # Nuovo export senza cambiamenti: nessuna partizione riscritta, inclusa quella senza data
+        _export(db_path, lake_dir)
+        assert _partition_inodes(lake_dir) == before
+
+
+if __name__ == "__main__":
+    test_enum_extension_keeps_unchanged_partitions()
+    test_null_dates_exported_to_default_partition()
+    print("TEST SUPERATO")
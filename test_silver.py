@@ -0,0 +1,122 @@
+#--------------------------------------------------------------
+# Test del merge incrementale Silver (etl/tasks/silver.py).
+# - una riga Bronze scartata dalla pulizia (order_id NULL, data d'acquisto NULL) non deve
+#   far ricadere i run incrementali successivi nel full rebuild
+# - un ordine nuovo fuori dai mesi del merge porta al full rebuild
+# - gli articoli orfani dei file caricati falliscono la validazione, come nel full
+#--------------------------------------------------------------
+
+import os
+import tempfile
+
+import duckdb
+from pandera.errors import SchemaErrors
+
+from etl.tasks.silver import clean_olist_data
+
+
+def _load_month(con, month, orders, items):
+    # Append di un file mensile in Bronze, loggato come da bronze_incremental
+    con.executemany("INSERT INTO bronze.orders VALUES (?, 'c1', 'delivered', ?, NULL, NULL)", orders)
+    con.executemany("INSERT INTO bronze.order_items VALUES (?, 1, 'p1', 's1', 10.0, 2.0)", items)
+    for name, rows in ((f"orders_{month}.parquet", orders), (f"order_items_{month}.parquet", items)):
+        con.execute("INSERT INTO tech.tech_processed_files VALUES (?, now(), 'OK', ?)", [name, len(rows)])
+
+
+def _silver_modes(con):
+    return dict(con.execute("""
+        SELECT table_name, mode FROM tech.tech_layer_watermarks
+        WHERE layer = 'silver' AND table_name IN ('orders', 'order_items')
+    """).fetchall())
+
+
+def _setup(tmp):
+    # Bronze minimo con un mese caricato e Silver costruito in full
+    db_path = os.path.join(tmp, "warehouse.duckdb")
+    con = duckdb.connect(db_path)
+    con.execute("CREATE SCHEMA bronze")
+    con.execute("CREATE SCHEMA tech")
+    con.execute("""
+        CREATE TABLE bronze.orders (
+            order_id VARCHAR, customer_id VARCHAR, order_status VARCHAR,
+            order_purchase_timestamp TIMESTAMP,
+            order_delivered_customer_date VARCHAR, order_estimated_delivery_date VARCHAR
+        )
+    """)
+    con.execute("""
+        CREATE TABLE bronze.order_items (
+            order_id VARCHAR, order_item_id BIGINT, product_id VARCHAR, seller_id VARCHAR,
+            price DOUBLE, freight_value DOUBLE
+        )
+    """)
+    con.execute("CREATE TABLE bronze.customers AS SELECT 'c1' AS customer_id, 'sao paulo' AS customer_city, 'SP' AS customer_state")
+    con.execute("CREATE TABLE bronze.products AS SELECT 'p1' AS product_id, 'moveis' AS product_category_name")
+    con.execute("""
+        CREATE TABLE tech.tech_processed_files (
+            file_name VARCHAR, processed_at TIMESTAMP, status VARCHAR, rows_inserted BIGINT
+        )
+    """)
+    _load_month(con, "2017-01", [("o1", "2017-01-10 10:00:00")], [("o1",)])
+    con.close()
+    clean_olist_data.fn(db_path, incremental=False)
+    return db_path
+
+
+def _incremental_month(db_path, month, orders, items):
+    con = duckdb.connect(db_path)
+    _load_month(con, month, orders, items)
+    con.close()
+    clean_olist_data.fn(db_path, incremental=True)
+    con = duckdb.connect(db_path)
+    try:
+        return _silver_modes(con), con.execute("SELECT list(order_id ORDER BY order_id) FROM silver.orders").fetchone()[0]
+    finally:
+        con.close()
+
+
+def test_discarded_bronze_rows_keep_silver_incremental():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _setup(tmp)
+
+        # Mese con una riga senza chiave e un ordine senza data d'acquisto
+        modes, _ = _incremental_month(db_path, "2017-02", [("o2", "2017-02-10 10:00:00"), (None, "2017-02-11 10:00:00"), ("o3", None)], [("o2",)])
+        assert modes == {"orders": "INCREMENTAL", "order_items": "INCREMENTAL"}
+
+        # Mese successivo: resta incrementale (nessun fallback al full rebuild)
+        modes, orders = _incremental_month(db_path, "2017-03", [("o4", "2017-03-10 10:00:00")], [("o4",), ("o1",)])
+        assert modes == {"orders": "INCREMENTAL", "order_items": "INCREMENTAL"}
+        assert orders == ["o1", "o2", "o4"]
+
+        con = duckdb.connect(db_path)
+        try:
+            items = con.execute("SELECT order_id, COUNT(*) FROM silver.order_items GROUP BY ALL ORDER BY 1").fetchall()
+        finally:
+            con.close()
+        assert items == [("o1", 1), ("o2", 1), ("o4", 1)]
+
+
+def test_order_outside_merged_months_falls_back_to_full():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _setup(tmp)
+        # File di febbraio con un ordine di aprile: fuori dai mesi del delta
+        modes, orders = _incremental_month(db_path, "2017-02", [("o2", "2017-02-10 10:00:00"), ("o5", "2017-04-01 10:00:00")], [("o2",)])
+        assert modes == {"orders": "FULL", "order_items": "FULL"}
+        assert orders == ["o1", "o2", "o5"]
+
+
+def test_orphan_items_fail_incremental_validation():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _setup(tmp)
+        try:
+            _incremental_month(db_path, "2017-02", [("o2", "2017-02-10 10:00:00")], [("o2",), ("ghost",)])
+        except SchemaErrors as e:
+            assert "references" in str(e) and "ghost" in str(e)
+        else:
+            raise AssertionError("articolo orfano non rifiutato")
+
+
+if __name__ == "__main__":
+    test_discarded_bronze_rows_keep_silver_incremental()
+    test_order_outside_merged_months_falls_back_to_full()
+    test_orphan_items_fail_incremental_validation()
+    print("TEST SUPERATO")
@@ -0,0 +1,45 @@
+#--------------------------------------------------------------
+# Test della validazione Pandera in DuckDB (etl/validation.py).
+# Uno schema con check non compilabili in SQL viene rifiutato con SchemaDefinitionError
+# che nomina il check, mai validato parzialmente.
+#--------------------------------------------------------------
+
+import duckdb
+import pandera.pandas as pa
+from pandera.errors import SchemaDefinitionError
+
+from etl.validation import validate_in_duckdb
+
+
+def _rejected(schema) -> str:
+    con = duckdb.connect()
+    try:
+        con.execute("CREATE TABLE t AS SELECT 'a' AS order_id, 1.0 AS price")
+        validate_in_duckdb(con, schema, "t")
+    except SchemaDefinitionError as e:
+        return str(e)
+    finally:
+        con.close()
+    raise AssertionError("schema con check non supportati accettato")
+
+
+def test_unsupported_checks_are_rejected():
+    assert "str_matches" in _rejected(pa.DataFrameSchema({"order_id": pa.Column(str, pa.Check.str_matches("^a"))}))
+    assert "order_id" in _rejected(pa.DataFrameSchema({"order_id": pa.Column(str, unique=True)}))
+    assert "unique" in _rejected(pa.DataFrameSchema({"order_id": pa.Column(str)}, unique=["order_id"]))
+
+
+def test_supported_checks_still_validate():
+    schema = pa.DataFrameSchema({"price": pa.Column(float, pa.Check.ge(0)), "order_id": pa.Column(str, nullable=False)})
+    con = duckdb.connect()
+    try:
+        con.execute("CREATE TABLE t AS SELECT 'a' AS order_id, 1.0 AS price")
+        assert validate_in_duckdb(con, schema, "t") == 1
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    test_unsupported_checks_are_rejected()
+    test_supported_checks_still_validate()
+    print("TEST SUPERATO")